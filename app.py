@@ -1,28 +1,93 @@
 import os
+import time
 from functools import wraps
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, get_flashed_messages
-from werkzeug.security import check_password_hash
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, flash, session, abort, \
+    get_flashed_messages, jsonify, Response, stream_with_context, send_file, current_app
 
 from applications.api.get_user_data import get_user_data
+from applications.api.permissions import permission_required, has_permission, invalidate as invalidate_permissions
+from applications.api.http_cache import cached_page, init_app as init_http_cache
+from applications.api import passwords
 from applications.database.database import Supplies, database, Finance, Warehouse, QualityControl, Purchase, Users, \
-    Product, Supplier
+    Product, Supplier, PERMISSIONS, init_app as init_database
+from applications.database.pagination import paginate
+from applications.database.replicas import read_replica, stream as replica_stream
+from applications.database import summary, stock, cache, search, audit
+from applications.monitoring.metrics import init_app as init_metrics
+from applications.jobs.runner import init_app as init_jobs
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 
-app = Flask(__name__)
+from config import Config
+
+# 路由
+bp = Blueprint('main', __name__)
 
 # 配置 Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-# 路由
-app.secret_key = os.urandom(24)  # 必须设置密钥才能使用会话
+login_manager.login_view = 'main.login'
+login_manager.blueprint_login_views = {'api': None}  # JSON 接口未登录时返回 401 而不是跳转到登录页
+
+
+def load_secret_key(app):
+    """返回会话密钥: 优先使用配置的 SECRET_KEY, 否则读取密钥文件, 文件不存在时生成并写入。
+
+    以独占方式创建文件, 多个进程同时启动时只有一个进程写入, 其余进程读取它写入的密钥。
+    """
+    if app.config.get('SECRET_KEY'):
+        return app.config['SECRET_KEY']
+    path = app.config.get('SECRET_KEY_FILE') or os.path.join(app.instance_path, 'secret_key')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(32).hex())
+    # 另一个进程可能刚创建文件还未写完, 短暂等待
+    for _ in range(50):
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key
+        time.sleep(0.1)
+    raise RuntimeError(f'会话密钥文件 {path} 为空, 请删除后重试或配置 INVENTORY_SECRET_KEY')
+
+
+def create_app(config=None):
+    """应用工厂。config 可为配置类/对象 (默认 config.Config), 数据库按其中的配置延迟绑定。"""
+    app = Flask(__name__)
+    app.config.from_object(config or Config)
+    app.secret_key = load_secret_key(app)  # 所有工作进程使用同一个密钥, 登录状态在进程间通用
+    if app.config.get('PROXY_FIX_HOPS'):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        hops = app.config['PROXY_FIX_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+    init_database(app)  # 每个请求从连接池取连接, 请求结束后归还
+    init_metrics(app)  # 请求耗时/SQL 统计与 /metrics
+    cache.init_app(app)  # 产品/供应商缓存
+    init_http_cache(app)  # 列表页渲染缓存与响应压缩
+    search.init_app(app)  # 物资搜索索引 (首次搜索时建立)
+    init_jobs(app)  # 后台任务执行器
+    audit.init_app(app)  # 审计日志的后台写入线程 (首次写入时启动)
+    passwords.init_app(app)  # 密码校验进程池 (首次登录时启动) 与登录失败限制
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+
+    from applications.api.rest import api
+    app.register_blueprint(api)
+    return app
+
+
+# 报表中物资明细最多显示的条数 (按数量降序)
+REPORT_SUPPLIES_LIMIT = 50
 
 # 主页路由
 from flask import render_template, redirect, url_for
 
 
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
     user_data = get_user_data()
@@ -44,201 +109,216 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
             flash('请先登录。', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
         elif not current_user.is_admin:
             flash('您没有权限访问此页面。', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
         return f(*args, **kwargs)
 
     return decorated_function
 
 
 # 登录路由
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
+        username = request.form.get('username') or ''
+        password = request.form.get('password') or ''
+
+        # 失败次数过多时在计算哈希之前拒绝, 暴力破解不消耗 CPU
+        retry_after = passwords.THROTTLE.retry_after(username, request.remote_addr)
+        if retry_after:
+            flash(f'登录失败次数过多, 请 {int(retry_after) + 1} 秒后再试', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(int(retry_after) + 1)}
 
+        user = Users.get_or_none(Users.username == username)
         try:
-            user = Users.get(Users.username == username)
-            print(f"User found: {user.username}")  # 调试信息
-
-            # 确保哈希校验的逻辑正确
-            if check_password_hash(user.password, password):
-                login_user(user)
-                session['user_id'] = user.id  # 写入 session
-                print(f"User ID in session: {session['user_id']}")
-                return redirect(url_for('index'))
-            else:
-                flash('用户名或密码错误', 'error')
-                print('Password check failed')  # 调试信息
-                return redirect(url_for('login'))
-        except Users.DoesNotExist:
+            # 用户不存在时同样计算一次哈希, 响应时间不泄露用户名是否存在
+            ok, new_hash = passwords.HASHER.verify(user.password if user else None, password)
+        except passwords.HasherBusy:
+            flash('登录请求过多, 请稍后再试', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
+        if not ok:
+            passwords.THROTTLE.failed(username, request.remote_addr)
             flash('用户名或密码错误', 'error')
-            print('User does not exist')  # 调试信息
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
+
+        if new_hash:  # 哈希算法或参数已调整, 按新参数保存 (其他请求已修改密码时不覆盖)
+            Users.update(password=new_hash).where(Users.id == user.id, Users.password == user.password).execute()
+        passwords.THROTTLE.succeeded(username)
+        login_user(user)
+        session['user_id'] = user.id  # 写入 session
+        return redirect(url_for('.index'))
 
     return render_template('login.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required  # 需要登录才能访问
 def logout():
     logout_user()
     session.pop('user_id', None)  # 清除 session
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 
-@app.route('/protected')
+@bp.route('/protected')
 @login_required  # 需要登录才能访问
 def protected():
     return '这是一个受保护的页面，仅登录用户可见。'
 
 
-@app.route('/manage_supplies', methods=['GET', 'POST'])
+@bp.route('/manage_supplies', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_supplies')
+@read_replica
+@cached_page(Supplies)
 def manage_data():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_supplies:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
-
-        if request.method == 'POST':
-            name = request.form.get('物资名称')
-            spec = request.form.get('规格')
+    if request.method == 'POST':
+        name = request.form.get('物资名称')
+        spec = request.form.get('规格')
+        try:
+            qty = int(request.form['数量'])
+        except ValueError:
+            flash("数量必须是整数", 'danger')
+        else:
             try:
-                qty = int(request.form['数量'])
-            except ValueError:
-                flash("数量必须是整数", 'danger')
-            else:
-                try:
-                    # 查找是否已存在相同名称和规格的物品
-                    existing_item = Supplies.get_or_none(
-                        (Supplies.name == name) & (Supplies.specification == spec)
-                    )
-
-                    if existing_item:
-                        # 如果存在，增加数量
-                        existing_item.quantity += qty
-                        existing_item.save()
-                        flash("已添加数量到现有物品！", 'success')
-                    else:
-                        # 如果不存在，创建新物品
-                        Supplies.create(name=name, specification=spec, quantity=qty)
-                        flash("物资信息已成功添加！", 'success')
-
-                except Exception as e:
-                    flash(f"保存数据时出错: {e}", 'danger')
+                # 相同名称和规格的物品已存在时在数据库内原子累加数量，否则创建新物品
+                if stock.add_supplies(name, spec, qty, user_id=current_user.id):
+                    flash("已添加数量到现有物品！", 'success')
+                else:
+                    flash("物资信息已成功添加！", 'success')
 
-        try:
-            data = Supplies.select()
-        except Exception as e:
-            flash(f"获取数据时出错: {e}", 'danger')
-            data = []
+            except Exception as e:
+                flash(f"保存数据时出错: {e}", 'danger')
 
-        # 使用 Jinja2 模板渲染 HTML
-        user_data = get_user_data()
-    return render_template('manage_supplies.html', data=data)
+    try:
+        page = paginate(Supplies.select(),
+                        sort_fields={'id': Supplies.id, 'name': Supplies.name,
+                                     'specification': Supplies.specification, 'quantity': Supplies.quantity},
+                        filter_fields={'name': Supplies.name, 'specification': Supplies.specification})
+    except Exception as e:
+        flash(f"获取数据时出错: {e}", 'danger')
+        page = None
+
+    # 使用 Jinja2 模板渲染 HTML
+    user_data = get_user_data()
+    return render_template('manage_supplies.html', data=page.items if page else [], page=page)
 
 
 # --- 采购管理 ---
-@app.route('/purchase_management', methods=['GET', 'POST'])
+@bp.route('/purchase_management', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_purchases')
+@read_replica
+@cached_page(Purchase, Supplier, Product)
 def purchase_management():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_suppliers:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
     if request.method == 'POST':
-        # 1. 从表单获取数据
-        material_name = request.form.get('material_name')
-        supplier = request.form.get('supplier')
-        quantity = int(request.form.get('quantity'))
-        unit_price = float(request.form.get('unit_price'))
-        total_price = quantity * unit_price
+        # 1. 从表单获取数据 (供应商与产品从缓存的下拉列表中选择)
+        supplier_id = request.form.get('supplier', type=int)
+        product_id = request.form.get('product', type=int)
+        quantity = request.form.get('quantity', type=int)
+        unit_price = request.form.get('unit_price', type=float)
         purchase_date = request.form.get('purchase_date')
 
         # 2. 数据验证 (可以根据需要添加更多验证)
-        if not all([material_name, supplier, quantity, unit_price, total_price, purchase_date]):
+        if not all([supplier_id, product_id, quantity, unit_price, purchase_date]):
             flash("请填写所有必填字段！", 'danger')
+        elif cache.suppliers.get(supplier_id) is None or cache.products.get(product_id) is None:
+            flash("供应商或产品不存在！", 'danger')
         else:
+            total_price = quantity * unit_price
             # 3. 创建 Purchase 对象并保存到数据库
             try:
-                Purchase.create(
-                    material_name=material_name,
-                    supplier=supplier,
-                    quantity=quantity,
-                    unit_price=unit_price,
-                    total_price=total_price,
-                    purchase_date=purchase_date
-                )
+                with database.atomic():  # 采购记录与汇总表在同一事务内写入
+                    purchase = Purchase.create(
+                        supplier=supplier_id,
+                        product=product_id,
+                        quantity=quantity,
+                        total_price=total_price,
+                        purchase_date=purchase_date
+                    )
+                    summary.record_purchase(purchase.product_id, quantity, total_price)
                 flash('采购订单已提交！', 'success')
-                return redirect(url_for('purchase_management'))
+                return redirect(url_for('.purchase_management'))
             except Exception as e:
                 flash(f"保存采购订单时出错: {e}", 'danger')
 
     # 获取所有采购订单数据 (用于在页面上显示)
-    purchases = Purchase.select()
+    # 供应商与产品随采购订单一起 JOIN 查询, 渲染名称时不再逐行查询
+    query = (Purchase
+             .select(Purchase, Supplier, Product)
+             .join(Supplier)
+             .switch(Purchase)
+             .join(Product))
+    page = paginate(query,
+                    sort_fields={'id': Purchase.id, 'quantity': Purchase.quantity,
+                                 'total_price': Purchase.total_price, 'purchase_date': Purchase.purchase_date},
+                    filter_fields={'supplier': Purchase.supplier, 'product': Purchase.product,
+                                   'purchase_date': Purchase.purchase_date})
     user_data = get_user_data()
-    return render_template('purchase_management.html', purchases=purchases)
+    suppliers, more_suppliers = cache.suppliers.options()
+    products, more_products = cache.products.options()
+    return render_template('purchase_management.html', purchases=page.items, page=page,
+                           suppliers=suppliers, more_suppliers=more_suppliers,
+                           products=products, more_products=more_products)
 
 
 # --- 质量监控管理 ---
-@app.route('/quality_control', methods=['GET', 'POST'])
+@bp.route('/quality_control', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_quality_controls')
+@read_replica
+@cached_page(QualityControl, Purchase, Product, Supplier)
 def quality_control():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_quality_controls:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
     if request.method == 'POST':
         # 1. 从表单获取数据
-        material_name = request.form.get('material_name')
+        purchase_id = request.form.get('purchase', type=int)
         inspection_date = request.form.get('inspection_date')
         inspector = request.form.get('inspector')
         result = request.form.get('result')
-        remarks = request.form.get('remarks')
 
         # 2. 数据验证 (可以根据需要添加更多验证)
-        if not all([material_name, inspection_date, inspector, result]):
+        if not all([purchase_id, inspection_date, inspector, result]):
             flash("请填写所有必填字段！", 'danger')
+        elif not Purchase.select().where(Purchase.id == purchase_id).exists():
+            flash(f"采购订单 {purchase_id} 不存在！", 'danger')
         else:
             # 3. 创建 QualityControl 对象并保存到数据库
             try:
                 QualityControl.create(
-                    material_name=material_name,
+                    purchase=purchase_id,
                     inspection_date=inspection_date,
                     inspector=inspector,
-                    result=result,
-                    remarks=remarks
+                    result=result
                 )
                 flash('质量检查记录已保存！', 'success')
-                return redirect(url_for('quality_control'))
+                return redirect(url_for('.quality_control'))
             except Exception as e:
                 flash(f"保存质量检查记录时出错: {e}", 'danger')
 
     # 获取所有质量检查记录 (用于在页面上显示)
-    inspections = QualityControl.select()
-    return render_template('quality_control.html', inspections=inspections,)
+    # 采购订单及其产品、供应商一起 JOIN 查询, 每页固定一条 SQL
+    query = (QualityControl
+             .select(QualityControl, Purchase, Product, Supplier)
+             .join(Purchase)
+             .join(Product)
+             .switch(Purchase)
+             .join(Supplier))
+    page = paginate(query,
+                    sort_fields={'id': QualityControl.id, 'inspection_date': QualityControl.inspection_date,
+                                 'inspector': QualityControl.inspector, 'result': QualityControl.result},
+                    filter_fields={'inspector': QualityControl.inspector, 'result': QualityControl.result,
+                                   'inspection_date': QualityControl.inspection_date})
+    return render_template('quality_control.html', inspections=page.items, page=page)
 
 
 # --- 出入库管理 ---
-@app.route('/warehouse_management', methods=['GET', 'POST'])
+@bp.route('/warehouse_management', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_warehouses')
+@read_replica
+@cached_page(Warehouse)
 def warehouse_management():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_warehouses:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
     if request.method == 'POST':
         # 1. 确定操作类型 (入库/出库)
         operation_type = request.form.get('operation_type')
@@ -246,6 +326,7 @@ def warehouse_management():
         # 2. 从表单获取数据
         material_name = request.form.get('material_name')
         quantity = int(request.form.get('quantity'))
+        location = request.form.get('location')
         date = request.form.get('date')
 
         # 3. 数据验证 (可以根据需要添加更多验证)
@@ -253,53 +334,87 @@ def warehouse_management():
             flash("请填写所有必填字段！", 'danger')
         else:
             # 4. 更新库存记录 (Warehouse 模型)
+            # 库存增减为单条条件 UPDATE，并在同一事务内写入库存流水
             try:
-                # 查找 existing_item 的逻辑
-                existing_item = Warehouse.get_or_none(Warehouse.material_name)
-
                 if operation_type == 'in':
-                    if existing_item:
-                        existing_item.quantity += quantity
-                    else:
-                        Warehouse.create(
-                            material_name=material_name,
-                            quantity=quantity
-                        )
+                    stock.stock_in(material_name, quantity, location=location, date=date, user_id=current_user.id)
                     flash('入库操作已完成！', 'success')
                 elif operation_type == 'out':
-                    if existing_item:
-                        if existing_item.quantity >= quantity:
-                            existing_item.quantity -= quantity
-                            flash('出库操作已完成！', 'success')
-                        else:
-                            flash('出库数量超过库存！', 'danger')
-                    else:
-                        flash('没有找到对应的库存记录！', 'danger')
+                    stock.stock_out(material_name, quantity, location=location, date=date, user_id=current_user.id)
+                    flash('出库操作已完成！', 'success')
                 else:
                     flash('无效的操作类型！', 'danger')
+                return redirect(url_for('.warehouse_management'))
 
-                if existing_item:
-                    existing_item.save()
-                return redirect(url_for('warehouse_management'))
-
+            except stock.StockError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('.warehouse_management'))
             except Exception as e:
                 flash(f"出入库操作时出错: {e}", 'danger')
 
     # 获取库存信息 (用于在页面上显示)
-    inventory = Warehouse.select()
-    return render_template('warehouse_management.html', inventory=inventory)
+    page = paginate(Warehouse.select(),
+                    sort_fields={'id': Warehouse.id, 'material_name': Warehouse.material_name,
+                                 'quantity': Warehouse.quantity, 'location': Warehouse.location},
+                    filter_fields={'material_name': Warehouse.material_name, 'location': Warehouse.location})
+    return render_template('warehouse_management.html', inventory=page.items, page=page)
+
+
+# --- 补货提醒 ---
+# 出入库时只检查被修改的物资, 页面只读取提醒表与补货点表
+REORDER_PERMISSIONS = {
+    stock.SOURCE_WAREHOUSE: 'can_manage_warehouses',
+    stock.SOURCE_SUPPLIES: 'can_manage_supplies',
+}
+REORDER_SOURCE_LABELS = {stock.SOURCE_WAREHOUSE: '仓库库存', stock.SOURCE_SUPPLIES: '物资'}
+
+
+@bp.route('/reorder_alerts', methods=['GET', 'POST'])
+@login_required
+@read_replica
+def reorder_alerts():
+    from applications.database import reorder
+    from applications.database.database import ReorderRule
+
+    sources = [source for source, name in REORDER_PERMISSIONS.items() if has_permission(current_user, name)]
+    if not sources:
+        return render_template('permissions_error.html', status=404)
+
+    if request.method == 'POST':
+        source = request.form.get('source')
+        material_name = (request.form.get('material_name') or '').strip()
+        if source not in sources:
+            flash('权限不足或无效的类型！', 'danger')
+        elif not request.form.get('reorder_point'):
+            reorder.delete_rule(source, material_name)
+            flash(f'已删除 {material_name} 的补货点', 'success')
+        else:
+            try:
+                below = reorder.set_rule(source, material_name,
+                                         int(request.form['reorder_point']),
+                                         int(request.form.get('reorder_quantity') or 0),
+                                         int(request.form.get('lead_time_days') or 0))
+                flash(f"已保存 {material_name} 的补货点{'，当前库存已低于补货点' if below else ''}", 'success')
+            except ValueError as e:
+                flash(f'保存补货点时出错: {e}', 'danger')
+        return redirect(url_for('.reorder_alerts'))
+
+    lookback_days = current_app.config.get('REORDER_LOOKBACK_DAYS', reorder.DEFAULT_LOOKBACK_DAYS)
+    rules = (ReorderRule
+             .select()
+             .where(ReorderRule.source.in_(sources))
+             .order_by(ReorderRule.source, ReorderRule.material_name))
+    return render_template('reorder_alerts.html', alerts=reorder.get_alerts(sources, lookback_days), rules=rules,
+                           sources=sources, source_labels=REORDER_SOURCE_LABELS, lookback_days=lookback_days)
 
 
 # --- 财务管理 ---
-@app.route('/finance_management', methods=['GET', 'POST'])
+@bp.route('/finance_management', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_finances')
+@read_replica
+@cached_page(Finance)
 def finance_management():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_finances:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
     if request.method == 'POST':
         # 1. 从表单获取数据
         transaction_type = request.form.get('transaction_type')
@@ -313,68 +428,44 @@ def finance_management():
         else:
             # 3. 创建/更新 Finance 对象并保存到数据库
             try:
-                Finance.create(
-                    transaction_type=transaction_type,
-                    amount=amount,
-                    date=date,
-                    description=description
-                )
+                with database.atomic():  # 财务记录与汇总表在同一事务内写入
+                    Finance.create(
+                        type=transaction_type,
+                        amount=amount,
+                        date=date,
+                        description=description
+                    )
+                    summary.record_finance(transaction_type, amount, date=date)
                 flash('财务记录已更新！', 'success')
-                return redirect(url_for('finance_management'))
+                return redirect(url_for('.finance_management'))
             except Exception as e:
                 flash(f"更新财务记录时出错: {e}", 'danger')
 
     # 获取财务信息 (用于在页面上显示)
-    transactions = Finance.select()
-    return render_template('finance_management.html', transactions=transactions)
+    page = paginate(Finance.select(),
+                    sort_fields={'id': Finance.id, 'date': Finance.date, 'type': Finance.type,
+                                 'amount': Finance.amount},
+                    filter_fields={'type': Finance.type, 'date': Finance.date})
+    return render_template('finance_management.html', transactions=page.items, page=page)
 
 
 # --- 统计报表 ---
-@app.route('/report', methods=['GET'])
+@bp.route('/report', methods=['GET'])
 @login_required
+@permission_required('can_manage_reports')
+@read_replica
+@cached_page(*summary.REPORT_MODELS, vary=summary.report_date)
 def report():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_reports:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
-    # --- 物资统计 ---
-    supplies_data = Supplies.select()
-    total_supplies_value = 0
-    for item in supplies_data:
-        total_supplies_value += item.quantity  # 假设价值等同于数量，你需要根据实际情况修改
-
-    # --- 采购统计 ---
-    purchases_data = Purchase.select()
-    total_purchase_amount = sum(purchase.total_price for purchase in purchases_data)
-
-    # --- 财务统计 ---
-    finance_data = Finance.select()
-    total_income = sum(transaction.amount for transaction in finance_data if transaction.transaction_type == 'income')
-    total_expenses = sum(
-        transaction.amount for transaction in finance_data if transaction.transaction_type == 'expense')
-    net_profit = total_income - total_expenses
-
-    return render_template('report.html',
-                           supplies_data=supplies_data,
-                           total_supplies_value=total_supplies_value,
-                           purchases_data=purchases_data,
-                           total_purchase_amount=total_purchase_amount,
-                           total_income=total_income,
-                           total_expenses=total_expenses,
-                           net_profit=net_profit)
+    # 统计值均读取自增量维护的汇总表 (见 applications/database/summary.py); 完整报表可提交后台任务生成
+    return render_template('report.html', **summary.report_context(REPORT_SUPPLIES_LIMIT))
 
 # 管理供应商路由
-@app.route('/manage_suppliers', methods=['GET', 'POST'])
+@bp.route('/manage_suppliers', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_suppliers')
+@read_replica
+@cached_page(Supplier)
 def manage_suppliers():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_suppliers:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
 
     if request.method == 'POST':
         # 获取表单数据
@@ -396,24 +487,25 @@ def manage_suppliers():
                     address=address
                 )
                 flash("供应商信息已成功添加！", 'success')
-                return redirect(url_for('manage_suppliers'))
+                return redirect(url_for('.manage_suppliers'))
             except Exception as e:
                 flash(f"保存供应商信息时出错: {e}", 'danger')
 
     # 获取所有供应商数据 (用于在页面上显示)
-    suppliers = Supplier.select()
-    return render_template('manage_suppliers.html', suppliers=suppliers)
+    page = paginate(Supplier.select(),
+                    sort_fields={'id': Supplier.id, 'name': Supplier.name,
+                                 'contact_person': Supplier.contact_person},
+                    filter_fields={'name': Supplier.name, 'contact_person': Supplier.contact_person,
+                                   'phone': Supplier.phone})
+    return render_template('manage_suppliers.html', suppliers=page.items, page=page)
 
 # 管理产品路由
-@app.route('/manage_products', methods=['GET', 'POST'])
+@bp.route('/manage_products', methods=['GET', 'POST'])
 @login_required
+@permission_required('can_manage_products')
+@read_replica
+@cached_page(Product)
 def manage_products():
-    # 从数据库查询当前用户的权限
-    with database.atomic():  # 使用上下文管理器确保连接正确打开和关闭
-        user_permissions = Users.select().where(Users.id == current_user.id).get()
-        if not user_permissions.can_manage_products:
-            # 返回权限不足的 HTML 页面
-            return render_template('permissions_error.html', status=404)
 
     if request.method == 'POST':
         # 获取表单数据
@@ -435,25 +527,228 @@ def manage_products():
                     price=price
                 )
                 flash("产品信息已成功添加！", 'success')
-                return redirect(url_for('manage_products'))
+                return redirect(url_for('.manage_products'))
             except Exception as e:
                 flash(f"保存产品信息时出错: {e}", 'danger')
 
     # 获取所有产品数据 (用于在页面上显示)
-    products = Product.select()
-    return render_template('manage_products.html', products=products)
+    page = paginate(Product.select(),
+                    sort_fields={'id': Product.id, 'name': Product.name, 'unit': Product.unit,
+                                 'price': Product.price},
+                    filter_fields={'name': Product.name, 'unit': Product.unit})
+    return render_template('manage_products.html', products=page.items, page=page)
+
+# 批量导入路由 (CSV / JSON Lines 文件上传, 返回 JSON 结果)
+IMPORT_PERMISSIONS = {
+    'supplies': 'can_manage_supplies',
+    'suppliers': 'can_manage_suppliers',
+    'products': 'can_manage_products',
+    'purchases': 'can_manage_purchases',
+    'quality_controls': 'can_manage_quality_controls',
+    'finance': 'can_manage_finances',
+}
+
+
+@bp.route('/import/<kind>', methods=['POST'])
+@login_required
+def bulk_import(kind):
+    if kind not in IMPORT_PERMISSIONS:
+        abort(404)
+    if not has_permission(current_user, IMPORT_PERMISSIONS[kind]):
+        return jsonify({'error': '权限不足'}), 403
+
+    from applications.database import bulk_import as importer
+
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': '请上传 CSV 或 JSON Lines 文件'}), 400
+    fmt = request.form.get('format') or importer.guess_format(upload.filename)
+    try:
+        chunk_size = int(request.form.get('chunk_size', importer.DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        return jsonify({'error': 'chunk_size 必须是整数'}), 400
+
+    try:
+        rows = importer.read_rows(upload.stream, fmt)
+        result = importer.import_rows(kind, rows, chunk_size=max(1, chunk_size), user_id=current_user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result.to_dict())
+
+
+# 导出路由 (CSV / JSON Lines 流式下载)
+EXPORT_PERMISSIONS = {
+    'purchases': 'can_manage_purchases',
+    'finance': 'can_manage_finances',
+    'warehouse': 'can_manage_warehouses',
+    'quality_control': 'can_manage_quality_controls',
+}
+
+
+@bp.route('/export/<table>', methods=['GET'])
+@login_required
+def export_table(table):
+    if table not in EXPORT_PERMISSIONS:
+        abort(404)
+    if not has_permission(current_user, EXPORT_PERMISSIONS[table]):
+        return jsonify({'error': '权限不足'}), 403
+
+    from applications.database import export as exporter
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        return jsonify({'error': f'不支持的导出格式: {fmt}'}), 400
+    columns = [name for name in request.args.get('columns', '').split(',') if name]
+    try:
+        query, names = exporter.build_query(table, columns, request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # stream_with_context 让数据库连接保持到最后一行发送完毕, 查询由只读副本执行
+    return Response(stream_with_context(replica_stream(exporter.generate(query, names, fmt))),
+                    content_type=exporter.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'})
+
+
+# --- 后台任务 (完整报表、导出、导入) ---
+# 提交后立即返回任务编号; 相同的请求共用一个任务, 结果可轮询进度后下载
+def _job_data(job):
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': url_for('.job_status', job_id=job.id),
+    }
+    if job.status == 'done':
+        data['download_url'] = url_for('.job_download', job_id=job.id)
+    return data
+
+
+def _wants_html():
+    return request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html'
+
+
+def _submit_job(kind, params, permission):
+    from applications.jobs.runner import get_runner
+
+    job, created = get_runner().submit(kind, params, permission, user_id=current_user.id)
+    if _wants_html():
+        return redirect(url_for('.job_status', job_id=job.id))
+    return jsonify(_job_data(job)), 202 if created else 200
+
+
+@bp.route('/jobs/report', methods=['POST'])
+@login_required
+@permission_required('can_manage_reports')
+def submit_report_job():
+    return _submit_job('report', {}, 'can_manage_reports')
+
+
+@bp.route('/jobs/export/<table>', methods=['POST'])
+@login_required
+def submit_export_job(table):
+    if table not in EXPORT_PERMISSIONS:
+        abort(404)
+    if not has_permission(current_user, EXPORT_PERMISSIONS[table]):
+        return jsonify({'error': '权限不足'}), 403
+
+    from applications.database import export as exporter
+
+    fmt = request.values.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        return jsonify({'error': f'不支持的导出格式: {fmt}'}), 400
+    params = {
+        'table': table,
+        'format': fmt,
+        'columns': [name for name in request.values.get('columns', '').split(',') if name],
+        'start': request.values.get('start'),
+        'end': request.values.get('end'),
+    }
+    try:
+        exporter.build_query(table, params['columns'], params['start'], params['end'])  # 提交前校验参数
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _submit_job('export', params, EXPORT_PERMISSIONS[table])
+
+
+@bp.route('/jobs/import/<kind>', methods=['POST'])
+@login_required
+def submit_import_job(kind):
+    if kind not in IMPORT_PERMISSIONS:
+        abort(404)
+    if not has_permission(current_user, IMPORT_PERMISSIONS[kind]):
+        return jsonify({'error': '权限不足'}), 403
+
+    from applications.database import bulk_import as importer
+    from applications.jobs.runner import get_runner
+
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': '请上传 CSV 或 JSON Lines 文件'}), 400
+    try:
+        chunk_size = max(1, int(request.form.get('chunk_size', importer.DEFAULT_CHUNK_SIZE)))
+    except ValueError:
+        return jsonify({'error': 'chunk_size 必须是整数'}), 400
+    # 相同内容的文件保存为同一路径, 重复提交时与进行中的任务去重
+    path, digest = get_runner().save_upload(upload.stream)
+    params = {
+        'kind': kind,
+        'format': request.form.get('format') or importer.guess_format(upload.filename),
+        'chunk_size': chunk_size,
+        'path': path,
+        'sha256': digest,
+        'user_id': current_user.id,
+    }
+    return _submit_job('import', params, IMPORT_PERMISSIONS[kind])
+
+
+def _get_job(job_id):
+    from applications.database.database import Job
+
+    job = Job.get_or_none(Job.id == job_id)
+    if job is None:
+        abort(404)
+    if not has_permission(current_user, job.permission):
+        abort(403)
+    return job
+
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = _get_job(job_id)
+    if _wants_html():
+        return render_template('job.html', job=job, job_data=_job_data(job))
+    return jsonify(_job_data(job))
+
+
+@bp.route('/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+def job_download(job_id):
+    job = _get_job(job_id)
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        return jsonify({'error': '任务尚未完成或结果已过期'}), 409
+    return send_file(job.result_path, mimetype=job.content_type, as_attachment=True, download_name=job.filename)
+
 
 # 系统管理视图
-@app.route('/system_management', methods=['GET', 'POST'])
+@bp.route('/system_management', methods=['GET', 'POST'])
 @login_required
 @admin_required
+@cached_page(Users)
 def system_management():
-    users = Users.select()
-    return render_template('system_management.html', users=users)
+    page = paginate(Users.select(),
+                    sort_fields={'id': Users.id, 'username': Users.username, 'is_admin': Users.is_admin},
+                    filter_fields={'username': Users.username})
+    return render_template('system_management.html', users=page.items, page=page)
 
 
 # 编辑用户权限视图
-@app.route('/edit_user_permissions/<int:user_id>', methods=['GET', 'POST'])
+@bp.route('/edit_user_permissions/<int:user_id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def edit_user_permissions(user_id):
@@ -462,19 +757,15 @@ def edit_user_permissions(user_id):
         abort(404)
 
     if request.method == 'POST':
-        user.can_manage_users = 'can_manage_users' in request.form
-        user.can_manage_supplies = 'can_manage_supplies' in request.form
-        user.can_manage_suppliers = 'can_manage_suppliers' in request.form
-        user.can_manage_products = 'can_manage_products' in request.form
-        user.can_manage_purchases = 'can_manage_purchases' in request.form
-        user.can_manage_quality_controls = 'can_manage_quality_controls' in request.form
-        user.can_manage_warehouses = 'can_manage_warehouses' in request.form
-        user.can_manage_finances = 'can_manage_finances' in request.form
+        # 递增权限版本号, 各进程的权限缓存在该用户下次请求时失效
+        user.set_permissions(name for name in PERMISSIONS if name in request.form)
         user.save()
-        return redirect(url_for('system_management'))
+        invalidate_permissions(user.id)
+        return redirect(url_for('.system_management'))
 
     return render_template('edit_user_permissions.html', user=user)
 
 
+# 开发服务器; 生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+from functools import wraps
+
+from flask import current_app, get_flashed_messages, make_response, request, session
+from flask_login import current_user
+
+from applications.api.permissions import get_permissions
+from applications.database import cache
+from applications.database.versions import get_versions
+
+try:
+    import brotli  # 可选依赖, 未安装时只使用 gzip
+except ImportError:
+    brotli = None
+
+# 渲染结果缓存的默认容量 (页) 与过期时间 (秒), 可通过 app.config['PAGE_CACHE_SIZE'] / ['PAGE_CACHE_TTL'] 覆盖
+DEFAULT_PAGE_CACHE_SIZE = 500
+DEFAULT_PAGE_CACHE_TTL = 300
+# 响应体小于该字节数时不压缩 (app.config['COMPRESS_MIN_SIZE'])
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'text/csv', 'application/json'}
+
+_pages = cache.register(cache.LRUCache('page', DEFAULT_PAGE_CACHE_SIZE, DEFAULT_PAGE_CACHE_TTL))
+
+
+def cached_page(*models, vary=None):
+    """列表页/报表页的 HTTP 缓存, 需放在 login_required / permission_required 之后。
+
+    models 为页面读取的模型。GET 请求按 (路由, 权限集合, 查询参数, 各表版本) 生成 ETag:
+    浏览器带 If-None-Match / If-Modified-Since 且数据未变时直接返回 304, 否则优先使用已渲染的 HTML。
+    有待显示的闪现消息时照常渲染且不缓存。
+    页面内容还取决于数据以外的因素 (如当前日期) 时, vary 为返回该因素的函数, 其值计入缓存键与 ETag;
+    此时数据未变也可能需要重新渲染, 因此只按 ETag 判断 304, 不使用 If-Modified-Since。
+    """
+    tables = [model._meta.table_name for model in models]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+
+            versions = get_versions(tables)
+            key = (request.endpoint,
+                   tuple(sorted(get_permissions(current_user))),
+                   tuple(sorted(request.args.items(multi=True))),
+                   tuple(versions[table][0] for table in tables),
+                   vary() if vary is not None else None)
+            etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            modified = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+            last_modified = max(modified) if modified else None
+
+            found, body = _pages.get(key)
+            if request.if_none_match.contains_weak(etag) or (
+                    not request.if_none_match and vary is None and last_modified and request.if_modified_since
+                    and last_modified <= request.if_modified_since.replace(tzinfo=None)):
+                response = current_app.response_class(status=304)
+            elif found:
+                response = current_app.response_class(body, mimetype='text/html')
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or get_flashed_messages():
+                    return response
+                _pages.set(key, response.get_data())
+
+            response.set_etag(etag, weak=True)  # 压缩后字节不同, 使用弱 ETag
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True  # 每次都向服务器确认
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', DEFAULT_COMPRESS_MIN_SIZE):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """按配置设置渲染缓存容量, 并对较大的文本响应启用 gzip/brotli 压缩。"""
+    _pages.max_size = app.config.get('PAGE_CACHE_SIZE', DEFAULT_PAGE_CACHE_SIZE)
+    _pages.ttl = app.config.get('PAGE_CACHE_TTL', DEFAULT_PAGE_CACHE_TTL)
+    app.after_request(_compress)
@@ -0,0 +1,243 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# 登录的密码校验: 哈希计算刻意很慢, 放到有界的进程池中执行 (降低优先级), 避免登录高峰或暴力破解占满
+# 处理其他请求的 CPU; 失败次数过多的用户名/IP 在计算哈希之前就被拒绝
+
+# 新哈希使用的算法 (werkzeug 格式, 如 scrypt 或 pbkdf2:sha256:600000, app.config['PASSWORD_HASH_METHOD']);
+# 用户的哈希与之不同时, 登录成功后用本次的明文密码重新计算
+DEFAULT_METHOD = 'scrypt'
+# 进程池大小, 0 表示在请求线程内计算 (app.config['PASSWORD_HASH_WORKERS'])
+DEFAULT_WORKERS = min(2, os.cpu_count() or 1)
+# 同时排队与计算的校验数上限, 超出的请求最多等待 wait 秒, 仍无空位则返回 "繁忙" (app.config['PASSWORD_HASH_QUEUE'])
+DEFAULT_QUEUE = DEFAULT_WORKERS * 4
+DEFAULT_WAIT = 5.0
+# 单次计算的超时秒数
+HASH_TIMEOUT = 30.0
+# 哈希进程的 nice 值 (仅 POSIX), 使处理页面请求的进程优先获得 CPU
+DEFAULT_NICE = 10
+
+# 登录失败限制: window 秒内同一用户名失败 max_user 次、或同一 IP 失败 max_ip 次后, 直到最早一次失败移出窗口前都拒绝登录
+DEFAULT_FAILURE_WINDOW = 300
+DEFAULT_MAX_USER_FAILURES = 5
+DEFAULT_MAX_IP_FAILURES = 50
+# 最多记录的用户名/IP 数, 超出时丢弃最久未失败的记录
+MAX_THROTTLE_KEYS = 100000
+
+
+class HasherBusy(Exception):
+    """排队的校验过多, 请求应稍后重试。"""
+
+
+# --- 在哈希进程中执行 ---
+
+_method_prefixes = {}  # {配置的算法: 生成的哈希中 $ 之前的部分 (含默认参数)}
+_dummy_hashes = {}  # 用户不存在时用于校验的哈希, 使耗时与用户存在时相同, 不泄露用户名是否存在
+
+
+def _method_prefix(method):
+    if method not in _method_prefixes:
+        _dummy_hashes[method] = generate_password_hash('', method)
+        _method_prefixes[method] = _dummy_hashes[method].split('$', 1)[0]
+    return _method_prefixes[method]
+
+
+def verify_and_rehash(stored, password, method):
+    """返回 (密码是否正确, 新哈希)。密码正确且 stored 的算法或参数与 method 不同时新哈希不为 None。"""
+    prefix = _method_prefix(method)
+    if not stored:
+        check_password_hash(_dummy_hashes[method], password)
+        return False, None
+    if not check_password_hash(stored, password):
+        return False, None
+    if stored.split('$', 1)[0] != prefix:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+def _lower_priority(nice):
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+# --- 在 Web 进程中执行 ---
+
+class _FairSlots:
+    """按到达顺序分配的计数信号量。threading.Semaphore 释放时新到的请求可能抢先, 持续高峰下个别请求会
+    一直等到超时; 这里释放的空位直接交给等待最久的请求。"""
+
+    def __init__(self, size):
+        self._free = size
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            granted = threading.Event()
+            self._waiters.append(granted)
+        if granted.wait(timeout):
+            return True
+        with self._lock:
+            if granted.is_set():  # 超时的同时分到了空位
+                return True
+            self._waiters.remove(granted)
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._free += 1
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = DEFAULT_METHOD
+        self.workers = DEFAULT_WORKERS
+        self.max_pending = DEFAULT_QUEUE
+        self.wait = DEFAULT_WAIT
+        self.nice = DEFAULT_NICE
+        self.busy = 0  # 因繁忙被拒绝的次数
+        self._slots = _FairSlots(self.max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, method=DEFAULT_METHOD, workers=DEFAULT_WORKERS, max_pending=None, wait=DEFAULT_WAIT,
+                  nice=DEFAULT_NICE):
+        self.shutdown()
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending or max(workers, 1) * 4
+        self.wait = wait
+        self.nice = nice
+        self._slots = _FairSlots(self.max_pending)
+
+    def _get_executor(self):
+        # 进程池在第一次登录时创建; fork 出的工作进程不使用继承来的进程池。使用 spawn, 不复制本进程的线程与连接
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'),
+                                                         initializer=_lower_priority, initargs=(self.nice,))
+                    self._pid = os.getpid()
+        return self._executor
+
+    def verify(self, stored, password):
+        """校验密码, 返回 (是否正确, 需要替换的新哈希或 None)。stored 为 None 表示用户不存在。"""
+        if not self.workers:
+            return verify_and_rehash(stored, password, self.method)
+        if not self._slots.acquire(timeout=self.wait):
+            self.busy += 1
+            raise HasherBusy()
+        try:
+            for attempt in range(2):
+                try:
+                    future = self._get_executor().submit(verify_and_rehash, stored, password, self.method)
+                    return future.result(timeout=HASH_TIMEOUT)
+                except BrokenProcessPool:  # 哈希进程被杀死, 重建进程池后重试一次
+                    with self._lock:
+                        self._executor = None
+                    if attempt:
+                        raise
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+
+class LoginThrottle:
+    """按用户名与 IP 记录最近的登录失败时间, 超过上限时在计算哈希之前拒绝。
+
+    计数保存在进程内, 多进程部署时每个工作进程各自计数 (实际上限为进程数倍)。
+    """
+
+    def __init__(self, window=DEFAULT_FAILURE_WINDOW, max_user=DEFAULT_MAX_USER_FAILURES,
+                 max_ip=DEFAULT_MAX_IP_FAILURES):
+        self.window = window
+        self.max_user = max_user
+        self.max_ip = max_ip
+        self.rejected = 0
+        self._failures = OrderedDict()  # {('user' | 'ip', 键): deque[失败时间]}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def retry_after(self, username, ip):
+        """返回还需等待的秒数, 0 表示可以尝试登录。"""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for key, limit in ((('user', username.casefold()), self.max_user), (('ip', ip), self.max_ip)):
+                failures = self._recent(key, now)
+                if failures is not None and len(failures) >= limit:
+                    wait = max(wait, failures[-limit] + self.window - now)
+            if wait:
+                self.rejected += 1
+        return wait
+
+    def failed(self, username, ip):
+        now = time.monotonic()
+        with self._lock:
+            for key in (('user', username.casefold()), ('ip', ip)):
+                failures = self._failures.setdefault(key, deque())
+                failures.append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > MAX_THROTTLE_KEYS:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, username):
+        """登录成功后清除该用户名的失败记录 (IP 的记录保留, 避免用一个账号为暴力破解其他账号 "解锁")。"""
+        with self._lock:
+            self._failures.pop(('user', username.casefold()), None)
+
+
+HASHER = PasswordHasher()
+THROTTLE = LoginThrottle()
+
+
+def _metric_lines():
+    return [
+        '# HELP inventory_login_rejected_total 因失败次数过多或校验繁忙被拒绝的登录',
+        '# TYPE inventory_login_rejected_total counter',
+        f'inventory_login_rejected_total{{reason="throttled"}} {THROTTLE.rejected}',
+        f'inventory_login_rejected_total{{reason="busy"}} {HASHER.busy}',
+    ]
+
+
+def init_app(app):
+    from applications.monitoring.metrics import register_collector
+
+    HASHER.configure(method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+                     workers=app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS),
+                     max_pending=app.config.get('PASSWORD_HASH_QUEUE'),
+                     wait=app.config.get('PASSWORD_HASH_WAIT', DEFAULT_WAIT),
+                     nice=app.config.get('PASSWORD_HASH_NICE', DEFAULT_NICE))
+    THROTTLE.window = app.config.get('LOGIN_FAILURE_WINDOW', DEFAULT_FAILURE_WINDOW)
+    THROTTLE.max_user = app.config.get('LOGIN_MAX_USER_FAILURES', DEFAULT_MAX_USER_FAILURES)
+    THROTTLE.max_ip = app.config.get('LOGIN_MAX_IP_FAILURES', DEFAULT_MAX_IP_FAILURES)
+    register_collector(_metric_lines)
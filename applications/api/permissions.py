@@ -0,0 +1,55 @@
+import threading
+from functools import wraps
+
+from flask import jsonify, render_template
+from flask_login import current_user
+
+from applications.database.database import PERMISSIONS
+
+# 进程内权限缓存: {用户 ID: (权限版本号, 权限名集合)}
+# 用户行由 Flask-Login 的 user_loader 每个请求加载一次, 权限检查只比较版本号, 不再查询数据库
+_cache = {}
+_lock = threading.Lock()
+
+
+def get_permissions(user):
+    """返回用户拥有的权限名集合。权限被修改后版本号变化, 缓存自动失效。"""
+    version = user.permission_version or 0
+    entry = _cache.get(user.id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    mask = user.permissions or 0
+    names = frozenset(name for bit, name in enumerate(PERMISSIONS) if mask & (1 << bit))
+    with _lock:
+        _cache[user.id] = (version, names)
+    return names
+
+
+def has_permission(user, name):
+    return name in get_permissions(user)
+
+
+def invalidate(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def permission_required(name, api=False):
+    """要求当前用户拥有 name 权限, 需放在 login_required 之后。
+
+    页面路由返回权限不足页面; api=True 时返回 JSON 403。
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not has_permission(current_user, name):
+                if api:
+                    return jsonify({'error': '权限不足'}), 403
+                # 返回权限不足的 HTML 页面
+                return render_template('permissions_error.html', status=404)
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,389 @@
+import datetime
+import decimal
+import json
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user, login_required
+
+from applications.api.permissions import has_permission, permission_required
+from applications.database.database import database, Supplies, Purchase, QualityControl, Finance, \
+    StockMovement, Warehouse, AuditLog, GoodsReceipt
+from applications.database.pagination import paginate
+from applications.database import stock, search, stock_history, summary, reorder, audit, receiving
+from applications.database.replicas import read_replica
+from applications.database.bulk_import import write_batch, BatchError
+
+# 面向扫码枪、ERP 等程序客户端的 JSON 接口
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# 单次批量请求允许的最大操作数 (可通过 app.config['API_MAX_BATCH'] 覆盖)
+DEFAULT_MAX_BATCH = 1000
+
+
+class Resource:
+    def __init__(self, model, permission, sort_fields, filter_fields, batch_kind=None):
+        self.model = model
+        self.permission = permission  # 所需的权限名, 见 PERMISSIONS
+        self.sort_fields = sort_fields
+        self.filter_fields = filter_fields
+        self.batch_kind = batch_kind  # bulk_import 中对应的写入类型
+
+
+RESOURCES = {
+    'supplies': Resource(
+        Supplies, 'can_manage_supplies',
+        sort_fields={'id': Supplies.id, 'name': Supplies.name, 'quantity': Supplies.quantity},
+        filter_fields={'name': Supplies.name, 'specification': Supplies.specification},
+        batch_kind='supplies'),
+    'warehouse': Resource(
+        Warehouse, 'can_manage_warehouses',
+        sort_fields={'id': Warehouse.id, 'material_name': Warehouse.material_name, 'quantity': Warehouse.quantity},
+        filter_fields={'material_name': Warehouse.material_name, 'location': Warehouse.location}),
+    'stock_movements': Resource(
+        StockMovement, 'can_manage_warehouses',
+        sort_fields={'id': StockMovement.id, 'created_at': StockMovement.created_at},
+        filter_fields={'material_name': StockMovement.material_name, 'source': StockMovement.source,
+                       'operation': StockMovement.operation}),
+    'purchases': Resource(
+        Purchase, 'can_manage_purchases',
+        sort_fields={'id': Purchase.id, 'purchase_date': Purchase.purchase_date},
+        filter_fields={'supplier': Purchase.supplier, 'product': Purchase.product,
+                       'purchase_date': Purchase.purchase_date},
+        batch_kind='purchases'),
+    'quality_controls': Resource(
+        QualityControl, 'can_manage_quality_controls',
+        sort_fields={'id': QualityControl.id, 'inspection_date': QualityControl.inspection_date},
+        filter_fields={'purchase': QualityControl.purchase, 'result': QualityControl.result,
+                       'inspection_date': QualityControl.inspection_date},
+        batch_kind='quality_controls'),
+    'receipts': Resource(
+        GoodsReceipt, 'can_manage_purchases',
+        sort_fields={'id': GoodsReceipt.id, 'received_date': GoodsReceipt.received_date},
+        filter_fields={'supplier': GoodsReceipt.supplier, 'received_date': GoodsReceipt.received_date}),
+    'finance': Resource(
+        Finance, 'can_manage_finances',
+        sort_fields={'id': Finance.id, 'date': Finance.date, 'amount': Finance.amount},
+        filter_fields={'type': Finance.type, 'date': Finance.date},
+        batch_kind='finance'),
+}
+
+
+def _error(message, status=400, **extra):
+    return jsonify({'error': message, **extra}), status
+
+
+def _serialize(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def _get_resource(name):
+    """返回 (resource, 错误响应), 资源不存在或无权限时 resource 为 None。"""
+    resource = RESOURCES.get(name)
+    if resource is None:
+        return None, _error(f'未知的资源: {name}', 404)
+    if not has_permission(current_user, resource.permission):
+        return None, _error('权限不足', 403)
+    return resource, None
+
+
+@api.route('/search', methods=['GET'])
+@login_required
+@read_replica
+def search_materials():
+    """物资/产品/库存的前缀与子串搜索 (输入提示)。参数: q, sources (逗号分隔, 默认全部有权限的表), limit。"""
+    query = request.args.get('q', '')
+    names = [name for name in request.args.get('sources', '').split(',') if name] or list(search.INDEXES)
+    unknown = [name for name in names if name not in search.INDEXES]
+    if unknown:
+        return _error(f"未知的搜索范围: {', '.join(unknown)}")
+    names = [name for name in names if has_permission(current_user, search.INDEXES[name].permission)]
+    limit = min(max(request.args.get('limit', search.DEFAULT_LIMIT, type=int), 1), search.MAX_LIMIT)
+    results = search.search(query, names, limit) if names and query.strip() else []
+    return jsonify({'query': query, 'results': results})
+
+
+# 按时间点查询库存、补货提醒所需的权限
+STOCK_PERMISSIONS = {
+    stock.SOURCE_WAREHOUSE: 'can_manage_warehouses',
+    stock.SOURCE_SUPPLIES: 'can_manage_supplies',
+}
+
+
+@api.route('/stock_at', methods=['GET'])
+@login_required
+def stock_at():
+    """某一时间点的库存。参数: at (默认当前时间), source (warehouse/supplies), material_name, location, item_id。"""
+    source = request.args.get('source', stock.SOURCE_WAREHOUSE)
+    if source not in STOCK_PERMISSIONS:
+        return _error(f'未知的库存类型: {source}')
+    if not has_permission(current_user, STOCK_PERMISSIONS[source]):
+        return _error('权限不足', 403)
+    try:
+        at = stock_history.parse_time(request.args['at']) if request.args.get('at') else datetime.datetime.now()
+        result = stock_history.stock_at(at, source,
+                                        material_name=request.args.get('material_name'),
+                                        location=request.args.get('location'),
+                                        item_id=request.args.get('item_id', type=int))
+    except ValueError as e:
+        return _error(str(e))
+
+    # 最新检查点之后的流水过多时在后台新建检查点, 使之后的查询保持只读取一小段流水
+    threshold = current_app.config.get('STOCK_CHECKPOINT_MOVEMENTS', stock_history.DEFAULT_CHECKPOINT_MOVEMENTS)
+    if stock_history.pending_movements() >= threshold:
+        from applications.jobs.runner import get_runner
+        get_runner().submit('stock_checkpoint', {}, STOCK_PERMISSIONS[source], user_id=current_user.id)
+
+    result['at'] = result['at'].isoformat()
+    if result['checkpoint']:
+        result['checkpoint']['taken_at'] = _serialize(result['checkpoint']['taken_at'])
+    return jsonify(result)
+
+
+@api.route('/reorder_alerts', methods=['GET'])
+@login_required
+@read_replica
+def reorder_alerts():
+    """当前低于补货点的物资与建议采购量 (只包含有权限的库存类型)。"""
+    sources = [source for source, name in STOCK_PERMISSIONS.items() if has_permission(current_user, name)]
+    if not sources:
+        return _error('权限不足', 403)
+    lookback_days = current_app.config.get('REORDER_LOOKBACK_DAYS', reorder.DEFAULT_LOOKBACK_DAYS)
+    alerts = reorder.get_alerts(sources, lookback_days)
+    return jsonify({'lookback_days': lookback_days,
+                    'alerts': [{key: _serialize(value) for key, value in alert.items()} for alert in alerts]})
+
+
+def _date_arg(name, default=None):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} 应为 YYYY-MM-DD 格式的日期')
+
+
+def _finance_json(result):
+    return {key: ({name: str(amount) for name, amount in value.items()} if key == 'by_type' else _serialize(value))
+            for key, value in result.items()}
+
+
+@api.route('/finance/summary', methods=['GET'])
+@login_required
+@permission_required('can_manage_finances', api=True)
+@read_replica
+def finance_summary():
+    """start ~ end (含, 默认为本月 1 日至今天) 的收入、支出与净额, 读取日/月汇总表。"""
+    today = datetime.date.today()
+    try:
+        start = _date_arg('start', today.replace(day=1))
+        end = _date_arg('end', today)
+        result = summary.get_finance_range(start, end)
+    except ValueError as e:
+        return _error(str(e))
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), **_finance_json(result)})
+
+
+@api.route('/finance/series', methods=['GET'])
+@login_required
+@permission_required('can_manage_finances', api=True)
+@read_replica
+def finance_series():
+    """按 period (day/week/month, 默认 month) 划分的收支序列, 默认为最近一年。"""
+    today = datetime.date.today()
+    period = request.args.get('period', summary.MONTH)
+    try:
+        start = _date_arg('start', today - datetime.timedelta(days=365))
+        end = _date_arg('end', today)
+        points = summary.get_finance_series(period, start, end)
+    except ValueError as e:
+        return _error(str(e))
+    return jsonify({'period': period, 'start': start.isoformat(), 'end': end.isoformat(),
+                    'points': [_finance_json(point) for point in points]})
+
+
+def _time_arg(name, end=False):
+    """ISO 格式的时间; 只有日期时 start 表示当天开始, end 表示当天结束。"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    if len(value) == 10 and not end:
+        try:
+            return datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time.min)
+        except ValueError:
+            pass
+    return stock_history.parse_time(value)
+
+
+@api.route('/audit', methods=['GET'])
+@login_required
+@permission_required('can_manage_users', api=True)
+@read_replica
+def audit_log():
+    """审计日志, 按 ID 游标分页, 默认最新的在前。参数: user_id, table, record_id, start, end, after/before, per_page。"""
+    table = request.args.get('table')
+    if table and table not in audit.AUDITED_TABLES:
+        return _error(f'未记录审计日志的表: {table}')
+    try:
+        query = audit.query_events(user_id=request.args.get('user_id', type=int),
+                                   table=table,
+                                   record_id=request.args.get('record_id', type=int),
+                                   start=_time_arg('start'),
+                                   end=_time_arg('end', end=True))
+    except ValueError as e:
+        return _error(str(e))
+    args = request.args.copy()
+    args.setdefault('order', 'desc')
+    page = paginate(query, {'id': AuditLog.id}, args=args)
+    return jsonify({
+        'items': [{
+            'id': row.id,
+            'created_at': _serialize(row.created_at),
+            'user_id': row.user_id,
+            'context': row.context,
+            'table': row.table_name,
+            'action': row.action,
+            'record_id': row.record_id,
+            'changes': json.loads(row.changes) if row.changes else None,
+        } for row in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+# 收货同时写入采购、质检与仓库库存
+RECEIVING_PERMISSIONS = ('can_manage_purchases', 'can_manage_quality_controls', 'can_manage_warehouses')
+
+
+@api.route('/receipts', methods=['POST'])
+@login_required
+def create_receipt():
+    """收货: 请求体为整张收货单 (见 receiving.receive), 采购、质检与入库在一个事务内完成。
+
+    明细有误时返回 422 与全部错误 (index 为明细序号), 不写入任何数据; 不合格的明细在结果的 rejected 中列出。
+    """
+    if not all(has_permission(current_user, name) for name in RECEIVING_PERMISSIONS):
+        return _error('权限不足', 403)
+    order = request.get_json(silent=True)
+    max_lines = current_app.config.get('RECEIVING_MAX_LINES', receiving.DEFAULT_MAX_LINES)
+    try:
+        result = receiving.receive(order, user_id=current_user.id, max_lines=max_lines)
+    except receiving.ReceivingError as e:
+        return _error(str(e), 422, errors=[{'index': index, 'message': message} for index, message in e.errors])
+    return jsonify(result.to_dict()), 201
+
+
+@api.route('/receipts/<int:receipt_id>', methods=['GET'])
+@login_required
+@permission_required('can_manage_purchases', api=True)
+@read_replica
+def get_receipt(receipt_id):
+    """收货单及其明细 (采购数量、合格数量与质检结果)。"""
+    receipt = GoodsReceipt.get_or_none(GoodsReceipt.id == receipt_id)
+    if receipt is None:
+        return _error(f'收货单 {receipt_id} 不存在', 404)
+    lines = []
+    for purchase in receiving.receipt_lines(receipt_id):
+        inspection = getattr(purchase, 'inspection', None)
+        lines.append({
+            'purchase_id': purchase.id,
+            'product': purchase.product_id,
+            'material_name': purchase.product.name,
+            'quantity': purchase.quantity,
+            'total_price': _serialize(purchase.total_price),
+            'accepted': inspection.accepted_quantity if inspection else None,
+            'result': inspection.result if inspection else None,
+        })
+    return jsonify({**{name: _serialize(value) for name, value in receipt.__data__.items()}, 'lines': lines})
+
+
+@api.route('/<name>', methods=['GET'])
+@login_required
+@read_replica
+def list_resource(name):
+    """游标分页列表。参数同列表页 (sort, order, after, before, per_page, 筛选列), fields 指定返回的列。"""
+    resource, error = _get_resource(name)
+    if error:
+        return error
+
+    model = resource.model
+    fields = model._meta.sorted_fields
+    requested = [field for field in request.args.get('fields', '').split(',') if field]
+    if requested:
+        unknown = [field for field in requested if field not in model._meta.fields]
+        if unknown:
+            return _error(f"未知的字段: {', '.join(unknown)}")
+        fields = [model._meta.fields[field] for field in requested]
+
+    # 游标需要排序列与主键, 即使未被请求也一并查询
+    sort_field = resource.sort_fields.get(request.args.get('sort'), resource.sort_fields['id'])
+    selected = list(dict.fromkeys(fields + [sort_field, model._meta.primary_key]))
+    page = paginate(model.select(*selected), resource.sort_fields, resource.filter_fields)
+
+    names = [field.name for field in fields]
+    return jsonify({
+        'items': [{name: _serialize(row.__data__.get(name)) for name in names} for row in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+def _apply_stock_movements(operations):
+    stock.lock_ledger()  # 在批量事务的开始处加锁, 见 stock.lock_ledger
+    applied = 0
+    for line, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BatchError(line, '每个操作必须是 JSON 对象')
+        try:
+            kind = operation.get('operation')
+            material_name = operation['material_name']
+            quantity = int(operation['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise BatchError(line, '缺少 material_name 或 quantity 不是整数')
+        kwargs = {'location': operation.get('location'), 'date': operation.get('date'), 'user_id': current_user.id}
+        try:
+            if kind == 'in':
+                stock.stock_in(material_name, quantity, **kwargs)
+            elif kind == 'out':
+                stock.stock_out(material_name, quantity, **kwargs)
+            else:
+                raise BatchError(line, '无效的操作类型, 应为 in 或 out')
+        except stock.StockError as e:
+            raise BatchError(line, str(e))
+        applied += 1
+    return applied
+
+
+@api.route('/<name>/batch', methods=['POST'])
+@login_required
+def batch_resource(name):
+    """批量写入: 请求体为 {"operations": [...]}, 所有操作在同一事务内完成, 任一失败则整体回滚。"""
+    resource, error = _get_resource(name)
+    if error:
+        return error
+    if resource.batch_kind is None and name != 'stock_movements':
+        return _error(f'{name} 不支持批量写入', 405)
+
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list):
+        return _error('请求体必须包含 operations 数组')
+    max_batch = current_app.config.get('API_MAX_BATCH', DEFAULT_MAX_BATCH)
+    if len(operations) > max_batch:
+        return _error(f'单次最多 {max_batch} 个操作')
+
+    try:
+        if name == 'stock_movements':
+            with database.atomic():
+                applied = _apply_stock_movements(operations)
+            result = {'applied': applied}
+        else:
+            inserted, updated = write_batch(resource.batch_kind, operations, user_id=current_user.id)
+            result = {'inserted': inserted, 'updated': updated}
+    except BatchError as e:
+        return _error(str(e), 422, index=e.line)
+    return jsonify(result)
@@ -0,0 +1,406 @@
+import atexit
+import datetime
+import decimal
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from peewee import Insert, Update, Delete, Expression, Node, Field, Entity, DatabaseError, InterfaceError
+
+from applications.database.database import database, AuditLog
+
+# 审计日志: 包装数据库对象的 execute, 从模型的 INSERT/UPDATE/DELETE 查询中取出 (表, 操作, 记录, 字段值),
+# 放入进程内的有界队列, 由后台线程批量写入 audit_log。请求只多出构造事件与入队的开销, 没有额外的同步写入。
+# 事务内的事件先暂存, 提交后才入队, 回滚 (包括回滚到保存点) 时丢弃, 因此不会记录未生效的修改
+
+logger = logging.getLogger(__name__)
+
+# 记录审计日志的表
+AUDITED_TABLES = {'supplies', 'warehouse', 'purchase', 'quality_control', 'goods_receipt', 'finance', 'product',
+                  'supplier', 'reorder_rule', 'users'}
+# 不记录取值的字段
+REDACTED_FIELDS = {('users', 'password')}
+# insert_many 的行数不超过该值时记录每行的值, 否则只记录行数
+MAX_LOGGED_ROWS = 100
+
+# 队列容量 (条, app.config['AUDIT_QUEUE_SIZE']): 队列满时写入方最多等待 put_timeout 秒 (背压), 仍满则丢弃并记录错误
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_PUT_TIMEOUT = 5.0
+# 每批最多写入的条数与攒批的最长等待秒数 (app.config['AUDIT_BATCH_SIZE'] / ['AUDIT_FLUSH_INTERVAL'])
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+# 写入失败后重试的间隔秒数 (逐次加倍, 不超过 MAX_RETRY_DELAY)
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+# audit_log 尚未由迁移创建时丢弃事件, 每隔该秒数重新检查一次
+TABLE_CHECK_INTERVAL = 60.0
+
+_SAVEPOINT_SQL = re.compile(r'(SAVEPOINT|ROLLBACK TO SAVEPOINT|RELEASE SAVEPOINT)\s+(\S+?);?\s*$', re.IGNORECASE)
+
+_local = threading.local()  # pending: 事务内暂存的事件, savepoints: {保存点: 暂存条数}, actor: (用户 ID, 来源)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _sql(db, node):
+    """把表达式 (如 quantity + 5 或 WHERE 条件) 转为带参数值的 SQL 文本。"""
+    sql, params = db.get_sql_context().sql(node).query()
+    for param in params:
+        sql = sql.replace(db.param, json.dumps(param, ensure_ascii=False, default=_json_default), 1)
+    return sql
+
+
+def _column_name(key):
+    """INSERT/UPDATE 数据的键可以是字段、Entity (如迁移中的 Entity('列名')) 或字符串。"""
+    if isinstance(key, Field):
+        return key.name
+    if isinstance(key, Entity):
+        return key._path[-1]  # Entity 的 __getattr__ 会构造新的 Entity, 不能用 getattr(key, 'name')
+    return str(key)
+
+
+def _values(db, table, data):
+    values = {}
+    for key, value in data.items():
+        name = _column_name(key)
+        if (table, name) in REDACTED_FIELDS:
+            value = '***'
+        elif isinstance(value, Node):
+            value = {'sql': _sql(db, value)}
+        values[name] = value
+    return values
+
+
+def _record_id(model, where):
+    """WHERE 为 "主键 = 值" 时返回该值。"""
+    if isinstance(where, Expression) and where.op == '=' and where.lhs is model._meta.primary_key \
+            and not isinstance(where.rhs, Node):
+        return where.rhs
+    return None
+
+
+def _event(db, query, cursor):
+    model = query.model
+    table = model._meta.table_name
+    pk = model._meta.primary_key
+    record_id, changes = None, {}
+    if isinstance(query, Insert):
+        action = 'insert'
+        data = query._insert
+        if isinstance(data, dict):
+            changes = _values(db, table, data)
+            record_id = changes.get(pk.name) if pk.name in changes else cursor.lastrowid
+        elif isinstance(data, (list, tuple)):
+            columns = [_column_name(column) for column in query._columns or ()]
+            rows = [row if isinstance(row, dict) else dict(zip(columns, row)) for row in data]
+            changes = {'rows': len(rows)}
+            if len(rows) <= MAX_LOGGED_ROWS:
+                changes['values'] = [_values(db, table, row) for row in rows]
+        else:
+            changes = {'sql': _sql(db, data)} if isinstance(data, Node) else {'rows': None}
+    else:
+        action = 'update' if isinstance(query, Update) else 'delete'
+        if action == 'update':
+            changes = _values(db, table, query._update)
+        record_id = _record_id(model, query._where)
+        if record_id is None and query._where is not None:
+            changes['where'] = _sql(db, query._where)
+        changes['rows'] = cursor.rowcount
+    user_id, context = _actor()
+    return {
+        'created_at': datetime.datetime.now(),
+        'user_id': user_id,
+        'context': context,
+        'table_name': table,
+        'action': action,
+        'record_id': record_id if isinstance(record_id, int) else None,
+        'changes': json.dumps(changes, ensure_ascii=False, default=_json_default),
+    }
+
+
+def _actor():
+    """(用户 ID, 来源): 后台任务等通过 acting_as 指定, 请求中取已加载的登录用户 (不触发额外的查询)。"""
+    actor = getattr(_local, 'actor', None)
+    if actor is not None:
+        return actor
+    from flask import g, has_request_context, request
+
+    if not has_request_context():
+        return None, None
+    user = g.get('_login_user')
+    user_id = user.id if user is not None and getattr(user, 'is_authenticated', False) else None
+    return user_id, f'{request.method} {request.path}'[:255]
+
+
+@contextmanager
+def acting_as(user_id, context=None):
+    """范围内的写入记为 user_id 所为, 用于后台任务与命令行脚本。"""
+    previous = getattr(_local, 'actor', None)
+    _local.actor = (user_id, context[:255] if context else context)
+    try:
+        yield
+    finally:
+        _local.actor = previous
+
+
+def _pending():
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = []
+        _local.savepoints = {}
+    return pending
+
+
+def _discard():
+    _local.pending = []
+    _local.savepoints = {}
+
+
+def _publish():
+    pending = getattr(_local, 'pending', None)
+    if pending:
+        _discard()
+        for event in pending:
+            WRITER.put(event)
+
+
+def track(db):
+    """包装数据库对象的 execute / execute_sql / commit / rollback, 捕获写入并跟踪事务的提交与回滚。"""
+    if getattr(db, '_audit_tracked', False):
+        return
+    execute, execute_sql, commit, rollback = db.execute, db.execute_sql, db.commit, db.rollback
+
+    def audited_execute(query, *args, **kwargs):
+        cursor = execute(query, *args, **kwargs)
+        if WRITER.enabled and isinstance(query, (Insert, Update, Delete)) \
+                and getattr(query, 'model', None) is not None and query.model._meta.table_name in AUDITED_TABLES:
+            try:
+                event = _event(db, query, cursor)
+            except Exception:
+                logger.exception('生成审计事件失败')
+            else:
+                if db.in_transaction():
+                    _pending().append(event)
+                else:
+                    WRITER.put(event)
+        return cursor
+
+    def savepoint_execute_sql(sql, params=None, *args, **kwargs):
+        cursor = execute_sql(sql, params, *args, **kwargs)
+        match = _SAVEPOINT_SQL.match(sql) if sql[:1] in 'SRsr' else None
+        if match:
+            statement, name = match.group(1).upper(), match.group(2)
+            _pending()
+            if statement == 'SAVEPOINT':
+                _local.savepoints[name] = len(_local.pending)
+            elif statement.startswith('ROLLBACK') and name in _local.savepoints:
+                del _local.pending[_local.savepoints[name]:]
+        return cursor
+
+    def audited_commit(*args, **kwargs):
+        result = commit(*args, **kwargs)
+        _publish()
+        return result
+
+    def audited_rollback(*args, **kwargs):
+        _discard()
+        return rollback(*args, **kwargs)
+
+    db.execute = audited_execute
+    db.execute_sql = savepoint_execute_sql
+    db.commit = audited_commit
+    db.rollback = audited_rollback
+    db._audit_tracked = True
+
+
+class AuditWriter:
+    """后台写入线程: 从有界队列取事件, 攒够 batch_size 条或等待 flush_interval 秒后用一条 INSERT 写入。
+
+    线程在第一个事件入队时启动 (fork 出的工作进程各自启动), 进程退出时写完队列中剩余的事件。
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.queue_size = DEFAULT_QUEUE_SIZE
+        self.put_timeout = DEFAULT_PUT_TIMEOUT
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._table_ready = False
+        self._table_checked_at = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=True, queue_size=DEFAULT_QUEUE_SIZE, put_timeout=DEFAULT_PUT_TIMEOUT,
+                  batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.stop()
+        self.enabled = enabled
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None:
+                self._queue = queue.Queue(maxsize=self.queue_size)  # fork 后不使用继承的队列
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def put(self, event):
+        self._ensure_started()
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += 1
+            logger.error('审计队列已满, 丢弃事件: %s %s %s', event['table_name'], event['action'], event['record_id'])
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _take(self):
+        """阻塞取第一条事件, 再在 flush_interval 内攒批。返回 (事件列表, 是否收到停止信号)。"""
+        batch = []
+        event = self._queue.get()
+        if event is None:
+            return batch, True
+        batch.append(event)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                event = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is None:
+                return batch, True
+            batch.append(event)
+        return batch, False
+
+    def _check_table(self):
+        now = time.monotonic()
+        if self._table_checked_at is not None and now - self._table_checked_at < TABLE_CHECK_INTERVAL:
+            return False
+        self._table_checked_at = now
+        self._table_ready = AuditLog.table_exists()
+        if not self._table_ready:
+            logger.warning('audit_log 表不存在 (需执行迁移), 审计事件将被丢弃')
+        return self._table_ready
+
+    def _write(self, batch):
+        delay = RETRY_DELAY
+        while True:
+            try:
+                with database.connection_context():
+                    if not self._table_ready and not self._check_table():
+                        self.dropped += len(batch)
+                        return
+                    AuditLog.insert_many(batch).execute()
+            except (DatabaseError, InterfaceError):
+                self.failures += 1
+                if self._stopping:
+                    logger.exception('进程退出时写入审计日志失败, 丢弃 %d 条', len(batch))
+                    self.dropped += len(batch)
+                    return
+                logger.exception('写入审计日志失败, %.1f 秒后重试', delay)
+                time.sleep(delay)  # 重试期间队列逐渐填满, 写入方随之等待 (背压)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            else:
+                self.written += len(batch)
+                return
+
+    def _run(self):
+        while True:
+            batch, stop = self._take()
+            if batch:
+                self._write(batch)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """等待队列中已有的事件全部写入。"""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """写完剩余事件后停止线程 (进程退出时调用)。"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+WRITER = AuditWriter()
+atexit.register(WRITER.stop)
+
+
+def flush():
+    WRITER.flush()
+
+
+def query_events(user_id=None, table=None, record_id=None, start=None, end=None):
+    """审计日志查询 (未分页), start / end 为时间范围 (含)。"""
+    query = AuditLog.select()
+    if user_id is not None:
+        query = query.where(AuditLog.user_id == user_id)
+    if table:
+        query = query.where(AuditLog.table_name == table)
+    if record_id is not None:
+        query = query.where(AuditLog.record_id == record_id)
+    if start is not None:
+        query = query.where(AuditLog.created_at >= start)
+    if end is not None:
+        query = query.where(AuditLog.created_at <= end)
+    return query
+
+
+def _metric_lines():
+    return [
+        '# HELP inventory_audit_events_total 审计事件数',
+        '# TYPE inventory_audit_events_total counter',
+        f'inventory_audit_events_total{{result="written"}} {WRITER.written}',
+        f'inventory_audit_events_total{{result="dropped"}} {WRITER.dropped}',
+        '# HELP inventory_audit_write_failures_total 审计日志写入失败次数',
+        '# TYPE inventory_audit_write_failures_total counter',
+        f'inventory_audit_write_failures_total {WRITER.failures}',
+        '# HELP inventory_audit_queue_depth 等待写入的审计事件数',
+        '# TYPE inventory_audit_queue_depth gauge',
+        f'inventory_audit_queue_depth {WRITER.depth()}',
+    ]
+
+
+def init_app(app):
+    from applications.monitoring.metrics import register_collector
+
+    WRITER.configure(enabled=app.config.get('AUDIT_ENABLED', True),
+                     queue_size=app.config.get('AUDIT_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+                     put_timeout=app.config.get('AUDIT_PUT_TIMEOUT', DEFAULT_PUT_TIMEOUT),
+                     batch_size=app.config.get('AUDIT_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                     flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+    register_collector(_metric_lines)
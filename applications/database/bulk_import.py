@@ -0,0 +1,367 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from peewee import Case, DatabaseError
+
+from applications.database.database import database, init_database, Supplies, Supplier, Product, Purchase, \
+    QualityControl, Finance, StockMovement
+from applications.database import summary, reorder
+from applications.database.stock import SOURCE_SUPPLIES, lock_ledger
+
+# 每个事务写入的行数
+DEFAULT_CHUNK_SIZE = 1000
+# 结果中最多返回的错误明细条数 (错误总数另行统计)
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []  # [(行号, 错误信息)]
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+        }
+
+
+# --- 流式读取 ---
+
+def read_rows(stream, fmt):
+    """逐行解析 CSV 或 JSON Lines, 产出 (行号, dict), 不把整个文件读入内存。
+
+    stream 可以是文本流或二进制流 (如上传文件), 二进制流按 UTF-8 (可带 BOM) 解码。
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = e  # 交给 import_rows 记为该行的错误
+            yield line_no, row
+    else:
+        raise ValueError(f"不支持的文件格式: {fmt}")
+
+
+def guess_format(filename):
+    return 'jsonl' if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+# --- 字段校验 ---
+
+def _text(row, key):
+    value = row.get(key)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        raise ValueError(f"缺少字段 {key}")
+    return value
+
+
+def _int(row, key):
+    value = _text(row, key)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"字段 {key} 必须是整数")
+
+
+def _decimal(row, key):
+    value = _text(row, key)
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"字段 {key} 必须是数字")
+
+
+def _date(row, key):
+    value = _text(row, key)
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"字段 {key} 必须是 YYYY-MM-DD 格式的日期")
+
+
+def _clean_supplies(row):
+    # 与 stock.add_supplies 一致: 导入只增加物资数量
+    quantity = _int(row, 'quantity')
+    if quantity <= 0:
+        raise ValueError('字段 quantity 必须大于零')
+    return {'name': _text(row, 'name'), 'specification': _text(row, 'specification'), 'quantity': quantity}
+
+
+def _clean_supplier(row):
+    return {'name': _text(row, 'name'), 'contact_person': _text(row, 'contact_person'),
+            'phone': _text(row, 'phone'), 'address': _text(row, 'address')}
+
+
+def _clean_product(row):
+    return {'name': _text(row, 'name'), 'description': _text(row, 'description'),
+            'unit': _text(row, 'unit'), 'price': _decimal(row, 'price')}
+
+
+def _clean_purchase(row):
+    quantity = _int(row, 'quantity')
+    if row.get('total_price') not in (None, ''):
+        total_price = _decimal(row, 'total_price')
+    else:
+        total_price = quantity * _decimal(row, 'unit_price')
+    return {'supplier': _int(row, 'supplier'), 'product': _int(row, 'product'), 'quantity': quantity,
+            'total_price': total_price, 'purchase_date': _date(row, 'purchase_date')}
+
+
+def _clean_quality_control(row):
+    return {'purchase': _int(row, 'purchase'), 'inspection_date': _date(row, 'inspection_date'),
+            'inspector': _text(row, 'inspector'), 'result': _text(row, 'result')}
+
+
+def _clean_finance(row):
+    return {'type': _text(row, 'type'), 'amount': _decimal(row, 'amount'), 'date': _date(row, 'date'),
+            'description': str(row.get('description') or '')}
+
+
+# --- 分块写入 ---
+# 每个写入函数接收 [(行号, 已校验的行)], 返回 (新增数, 更新数, [(行号, 错误信息)])
+
+def _write_supplies(chunk, user_id):
+    # 与 manage_data 一致: 相同名称和规格的物资合并数量, 块内重复行先在内存中合并
+    lock_ledger()  # 本块写入库存流水
+    merged = {}
+    for _, row in chunk:
+        key = (row['name'], row['specification'])
+        merged[key] = merged.get(key, 0) + row['quantity']
+
+    names = {name for name, _ in merged}
+    existing = {(item.name, item.specification): item.id
+                for item in Supplies.select(Supplies.id, Supplies.name, Supplies.specification)
+                .where(Supplies.name.in_(names))
+                if (item.name, item.specification) in merged}
+
+    if existing:
+        # 一条 UPDATE ... CASE 完成整块的数量累加
+        (Supplies
+         .update(quantity=Supplies.quantity + Case(Supplies.id, [(existing[key], merged[key]) for key in existing], 0))
+         .where(Supplies.id.in_(list(existing.values())))
+         .execute())
+
+    new_keys = [key for key in merged if key not in existing]
+    if new_keys:
+        Supplies.insert_many(
+            [{'name': name, 'specification': spec, 'quantity': merged[(name, spec)]} for name, spec in new_keys]
+        ).execute()
+
+    # 写入库存流水 (新插入行需要回查 ID)
+    ids = dict(existing)
+    if new_keys:
+        new_names = {name for name, _ in new_keys}
+        for item in (Supplies.select(Supplies.id, Supplies.name, Supplies.specification)
+                     .where(Supplies.name.in_(new_names))):
+            ids.setdefault((item.name, item.specification), item.id)
+    StockMovement.insert_many([
+        {'source': SOURCE_SUPPLIES, 'item_id': ids[key], 'material_name': key[0],
+         'operation': 'in', 'quantity': quantity, 'user_id': user_id}
+        for key, quantity in merged.items()
+    ]).execute()
+    summary.record_supplies_change(sum(merged.values()))
+    for name in names:
+        reorder.evaluate(SOURCE_SUPPLIES, name)  # 只检查本块涉及的物资
+    return len(new_keys), len(existing), []
+
+
+def _write_simple(model):
+    def write(chunk, user_id):
+        model.insert_many([row for _, row in chunk]).execute()
+        model.notify_change()  # 批量写入不经过 save(), 手动使缓存失效
+        return len(chunk), 0, []
+
+    return write
+
+
+def _write_purchases(chunk, user_id):
+    supplier_ids = {row['supplier'] for _, row in chunk}
+    product_ids = {row['product'] for _, row in chunk}
+    known_suppliers = {pk for pk, in Supplier.select(Supplier.id).where(Supplier.id.in_(supplier_ids)).tuples()}
+    known_products = {pk for pk, in Product.select(Product.id).where(Product.id.in_(product_ids)).tuples()}
+
+    errors, rows = [], []
+    for line, row in chunk:
+        if row['supplier'] not in known_suppliers:
+            errors.append((line, f"供应商 {row['supplier']} 不存在"))
+        elif row['product'] not in known_products:
+            errors.append((line, f"产品 {row['product']} 不存在"))
+        else:
+            rows.append(row)
+    if not rows:
+        return 0, 0, errors
+
+    Purchase.insert_many(rows).execute()
+
+    # 汇总表按产品合并后更新
+    totals = {}
+    for row in rows:
+        count, quantity, amount = totals.get(row['product'], (0, 0, 0))
+        totals[row['product']] = (count + 1, quantity + row['quantity'], amount + row['total_price'])
+    for product_id, (count, quantity, amount) in totals.items():
+        summary.record_purchase(product_id, quantity, amount, count=count)
+    return len(rows), 0, errors
+
+
+def _write_quality_controls(chunk, user_id):
+    purchase_ids = {row['purchase'] for _, row in chunk}
+    known = {pk for pk, in Purchase.select(Purchase.id).where(Purchase.id.in_(purchase_ids)).tuples()}
+
+    errors, rows = [], []
+    for line, row in chunk:
+        if row['purchase'] not in known:
+            errors.append((line, f"采购订单 {row['purchase']} 不存在"))
+        else:
+            rows.append(row)
+    if rows:
+        QualityControl.insert_many(rows).execute()
+    return len(rows), 0, errors
+
+
+def _write_finance(chunk, user_id):
+    rows = [row for _, row in chunk]
+    Finance.insert_many(rows).execute()
+
+    summary.record_finance_rows(rows)  # 总计与日/周/月汇总
+    return len(rows), 0, []
+
+
+IMPORTERS = {
+    'supplies': (_clean_supplies, _write_supplies),
+    'suppliers': (_clean_supplier, _write_simple(Supplier)),
+    'products': (_clean_product, _write_simple(Product)),
+    'purchases': (_clean_purchase, _write_purchases),
+    'quality_controls': (_clean_quality_control, _write_quality_controls),
+    'finance': (_clean_finance, _write_finance),
+}
+
+
+class BatchError(ValueError):
+    """批量写入中某一行无效, line 为该行在批次中的序号 (从 0 开始)。"""
+
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+
+
+def _flush(writer, chunk, result, user_id):
+    try:
+        with database.atomic():
+            inserted, updated, errors = writer(chunk, user_id)
+    except DatabaseError:
+        # 整块失败时逐行重试, 定位出错的行, 其余行照常写入
+        inserted = updated = 0
+        errors = []
+        for line, row in chunk:
+            try:
+                with database.atomic():
+                    row_inserted, row_updated, row_errors = writer([(line, row)], user_id)
+            except DatabaseError as e:
+                errors.append((line, str(e)))
+            else:
+                inserted += row_inserted
+                updated += row_updated
+                errors.extend(row_errors)
+    result.inserted += inserted
+    result.updated += updated
+    for line, message in errors:
+        result.add_error(line, message)
+
+
+def import_rows(kind, rows, chunk_size=DEFAULT_CHUNK_SIZE, user_id=None):
+    """校验并分块写入 rows ((行号, dict) 的可迭代对象), 返回 ImportResult。
+
+    校验失败或写入失败的行记录在结果中, 不会中断整个导入。
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"不支持的导入类型: {kind}")
+    clean, writer = IMPORTERS[kind]
+    result = ImportResult()
+    chunk = []
+    for line, row in rows:
+        try:
+            if not isinstance(row, dict):
+                raise ValueError(f"无法解析: {row}")
+            chunk.append((line, clean(row)))
+        except ValueError as e:
+            result.add_error(line, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            _flush(writer, chunk, result, user_id)
+            chunk = []
+    if chunk:
+        _flush(writer, chunk, result, user_id)
+    return result
+
+
+def write_batch(kind, rows, user_id=None):
+    """校验 rows (dict 列表) 并在一个事务内全部写入, 返回 (新增数, 更新数)。
+
+    与 import_rows 不同, 任意一行无效都会整体回滚并抛出 BatchError。
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"不支持的导入类型: {kind}")
+    clean, writer = IMPORTERS[kind]
+    chunk = []
+    for line, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("每个操作必须是 JSON 对象")
+            chunk.append((line, clean(row)))
+        except ValueError as e:
+            raise BatchError(line, str(e))
+    if not chunk:
+        return 0, 0
+    with database.atomic():
+        inserted, updated, errors = writer(chunk, user_id)
+        if errors:
+            raise BatchError(*errors[0])  # 在事务内抛出, 整批回滚
+    return inserted, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入物资、采购、产品、供应商、质检或财务数据')
+    parser.add_argument('kind', choices=sorted(IMPORTERS))
+    parser.add_argument('path', help='CSV 或 JSON Lines 文件')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='文件格式, 默认按扩展名判断')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    init_database()
+    with open(args.path, encoding='utf-8-sig', newline='') as f:
+        rows = read_rows(f, args.format or guess_format(args.path))
+        with database.connection_context():
+            result = import_rows(args.kind, rows, chunk_size=args.chunk_size)
+
+    print(f"新增 {result.inserted} 条, 更新 {result.updated} 条, 错误 {result.error_count} 条")
+    for line, message in result.errors:
+        print(f"第 {line} 行: {message}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from applications.database.database import Product, Supplier, on_change
+from applications.database.replicas import use_primary
+
+# 默认容量 (条) 与过期时间 (秒), 可通过 app.config['REFERENCE_CACHE_SIZE'] / ['REFERENCE_CACHE_TTL'] 覆盖
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL = 300
+# 表单下拉框最多列出的条数 (app.config['REFERENCE_OPTIONS_LIMIT']), 超过时页面改为输入 ID
+DEFAULT_OPTIONS_LIMIT = 500
+# 跨进程失效: 每隔该秒数检查一次版本文件
+VERSION_CHECK_INTERVAL = 1.0
+
+# 下拉框选项在缓存中的键
+_OPTIONS = object()
+
+
+class VersionStore:
+    """基于本地 SQLite 文件的版本表, 同一台机器上的多个工作进程通过它互相通知缓存失效。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_version (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, name):
+        row = self._connect().execute('SELECT version FROM cache_version WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        with self._connect() as conn:
+            conn.execute('INSERT INTO cache_version (name, version) VALUES (?, 1) '
+                         'ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存, 每个条目在 ttl 秒后过期, 超过 max_size 条时淘汰最久未使用的条目。"""
+
+    def __init__(self, name, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # {键: (过期时间, 值)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (是否命中, 值)。值可以是 None, 因此用单独的标志表示是否命中。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ModelCache:
+    """按主键缓存模型实例, 未命中时从数据库读取 (read-through)。
+
+    缓存的实例由多个请求共享, 调用方不要修改其字段。
+    """
+
+    def __init__(self, model, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, options_limit=DEFAULT_OPTIONS_LIMIT):
+        self.model = model
+        self.name = model._meta.table_name
+        self.options_limit = options_limit
+        self.entries = LRUCache(self.name, max_size, ttl)
+        self.version_store = None
+        self._version = 0
+        self._checked_at = 0.0
+
+    def configure(self, max_size=None, ttl=None, version_store=None, options_limit=None):
+        if max_size is not None:
+            self.entries.max_size = max_size
+        if ttl is not None:
+            self.entries.ttl = ttl
+        if options_limit is not None:
+            self.options_limit = options_limit
+        self.version_store = version_store
+        self.entries.clear()
+        if version_store is not None:
+            self._version = version_store.get(self.name)
+
+    def _check_version(self):
+        # 其他进程修改过数据时清空本进程的缓存
+        store = self.version_store
+        if store is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        version = store.get(self.name)
+        if version != self._version:
+            self.entries.clear()
+            self._version = version
+
+    def get(self, pk):
+        """返回主键为 pk 的实例, 不存在时返回 None (不存在的结果同样缓存)。"""
+        self._check_version()
+        found, value = self.entries.get(pk)
+        if not found:
+            with use_primary():  # 缓存的实例由之后的请求共用, 不能从延迟的副本读取
+                value = self.model.get_or_none(self.model._meta.primary_key == pk)
+            self.entries.set(pk, value)
+        return value
+
+    def get_many(self, pks):
+        """返回 {主键: 实例}, 未命中的主键用一条 IN 查询读取, 不存在的主键不出现在结果中。"""
+        self._check_version()
+        result, missing = {}, []
+        for pk in set(pks):
+            found, value = self.entries.get(pk)
+            if not found:
+                missing.append(pk)
+            elif value is not None:
+                result[pk] = value
+        if missing:
+            primary_key = self.model._meta.primary_key
+            with use_primary():
+                loaded = {row.get_id(): row for row in self.model.select().where(primary_key.in_(missing))}
+            for pk in missing:
+                self.entries.set(pk, loaded.get(pk))
+            result.update(loaded)
+        return result
+
+    def options(self):
+        """返回 (按主键排序的前 options_limit 个实例, 是否还有更多), 用于表单下拉框。
+
+        只缓存这一段, 内存占用与表的行数无关; 还有更多时页面应允许直接输入 ID。
+        """
+        self._check_version()
+        found, value = self.entries.get(_OPTIONS)
+        if not found:
+            with use_primary():
+                rows = list(self.model.select().order_by(self.model._meta.primary_key).limit(self.options_limit + 1))
+            value = (rows[:self.options_limit], len(rows) > self.options_limit)
+            self.entries.set(_OPTIONS, value)
+        return value
+
+    def invalidate(self, pk=None):
+        """使 pk 对应的缓存失效, pk 为 None 时清空整个缓存。配置了版本文件时同时通知其他进程。"""
+        if pk is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(pk)
+        self.entries.pop(_OPTIONS)
+        if self.version_store is not None:
+            self.version_store.bump(self.name)  # 本进程下次检查版本时也会清空一次, 不影响正确性
+
+
+products = ModelCache(Product)
+suppliers = ModelCache(Supplier)
+CACHES = (products, suppliers)
+
+# 通过模型保存/删除的写入在提交后使对应缓存失效; insert_many 等批量写入需调用 Model.notify_change
+for _cache in CACHES:
+    on_change(_cache.model, lambda instance, cache=_cache: cache.invalidate(instance.get_id() if instance else None))
+
+# 在 /metrics 中输出命中统计的缓存 (其他模块的 LRUCache 通过 register 加入)
+_registered = [cache.entries for cache in CACHES]
+
+
+def register(lru):
+    if lru not in _registered:
+        _registered.append(lru)
+    return lru
+
+
+def _metric_lines():
+    lines = []
+    for metric, help_text, attribute in (('inventory_cache_hits_total', '缓存命中次数', 'hits'),
+                                         ('inventory_cache_misses_total', '缓存未命中次数', 'misses'),
+                                         ('inventory_cache_evictions_total', '缓存淘汰次数', 'evictions')):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for lru in _registered:
+            lines.append(f'{metric}{{cache="{lru.name}"}} {getattr(lru, attribute)}')
+    lines.append('# HELP inventory_cache_entries 缓存当前条数')
+    lines.append('# TYPE inventory_cache_entries gauge')
+    for lru in _registered:
+        lines.append(f'inventory_cache_entries{{cache="{lru.name}"}} {len(lru)}')
+    return lines
+
+
+def init_app(app):
+    """按配置设置缓存容量、过期时间与跨进程版本文件, 并在 /metrics 中输出命中统计。"""
+    from applications.monitoring.metrics import register_collector
+
+    path = app.config.get('CACHE_VERSION_FILE')
+    store = VersionStore(path) if path else None
+    for cache in CACHES:
+        cache.configure(max_size=app.config.get('REFERENCE_CACHE_SIZE'),
+                        ttl=app.config.get('REFERENCE_CACHE_TTL'),
+                        version_store=store,
+                        options_limit=app.config.get('REFERENCE_OPTIONS_LIMIT'))
+    register_collector(_metric_lines)
@@ -1,17 +1,150 @@
+import datetime
+import logging
+import threading
+
 from flask_login import UserMixin
-from peewee import MySQLDatabase, Model, CharField, IntegerField, ForeignKeyField, DecimalField, DateField, TextField, \
-    BooleanField
-from flask import Flask
+from peewee import Model, CharField, IntegerField, ForeignKeyField, DecimalField, DateField, TextField, \
+    BooleanField, DateTimeField, DatabaseProxy, MySQLDatabase, BigAutoField, BigIntegerField
+
+# 模型绑定到代理对象, 导入本模块不会创建连接; 实际数据库在 init_app / init_database 时按配置绑定
+database = DatabaseProxy()
+
+logger = logging.getLogger(__name__)
+
+
+def create_database(config):
+    """按配置创建数据库对象。DATABASE_ENGINE 为 sqlite 时 DATABASE_NAME 为数据库文件路径。"""
+    if config.get('DATABASE_ENGINE', 'mysql') == 'sqlite':
+        from playhouse.sqlite_ext import SqliteExtDatabase
+        return SqliteExtDatabase(config['DATABASE_NAME'], pragmas={'journal_mode': 'wal', 'foreign_keys': 1})
+
+    # 连接池: 每个工作线程从池中取连接, 请求结束后归还而不是断开
+    from playhouse.pool import PooledMySQLDatabase
+    return PooledMySQLDatabase(config['DATABASE_NAME'], **config['DATABASE_POOL'], **config['DATABASE'])
 
-app = Flask(__name__)
-app.config['DATABASE'] = {
-    'user': 'Inventory',
-    'password': 'password',
-    'host': 'xxx.xxx.xxx.xxx',
-    'port': 3306
-}
 
-database = MySQLDatabase('Inventory', **app.config['DATABASE'])
+def init_database(config=None):
+    """按配置绑定数据库 (默认使用 config.Config), 供命令行脚本使用。不会立即连接。"""
+    if config is None:
+        from config import Config
+        config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    database.initialize(create_database(config))
+    track_commits(database.obj)  # 提交后执行 after_commit 登记的回调
+    from applications.database import versions, replicas, audit
+    versions.track(database.obj)  # 写入时递增表版本
+    replicas.configure(database.obj, config)  # 只读副本 (未配置时不改变行为)
+    audit.track(database.obj)  # 写入事件进入审计队列
+    return database
+
+
+# --- 提交后回调 ---
+_commit_state = threading.local()  # callbacks: 当前事务提交后要执行的回调, keys: 已登记的回调键
+
+
+def after_commit(callback, key=None):
+    """callback 在当前事务提交后执行, 不在事务中时立即执行; 事务回滚时丢弃。
+
+    用于缓存失效等必须在其他连接能读到新数据之后才做的操作。同一事务内 key 相同的回调只登记一次。
+    回调中的异常只记录日志。
+    """
+    if database.obj is None or not database.in_transaction():
+        callback()
+        return
+    if getattr(_commit_state, 'callbacks', None) is None:
+        _reset_after_commit()
+    if key is not None:
+        if key in _commit_state.keys:
+            return
+        _commit_state.keys.add(key)
+    _commit_state.callbacks.append(callback)
+
+
+def _reset_after_commit():
+    _commit_state.callbacks = []
+    _commit_state.keys = set()
+
+
+def _run_after_commit():
+    callbacks = getattr(_commit_state, 'callbacks', None)
+    if not callbacks:
+        return
+    _reset_after_commit()
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception('提交后回调执行失败')
+
+
+def track_commits(db):
+    """包装数据库对象的 commit / rollback, 提交后执行 after_commit 登记的回调, 回滚时丢弃。"""
+    if getattr(db, '_commits_tracked', False):
+        return
+    commit, rollback = db.commit, db.rollback
+
+    def tracked_commit(*args, **kwargs):
+        result = commit(*args, **kwargs)
+        _run_after_commit()
+        return result
+
+    def tracked_rollback(*args, **kwargs):
+        _reset_after_commit()
+        return rollback(*args, **kwargs)
+
+    db.commit = tracked_commit
+    db.rollback = tracked_rollback
+    db._commits_tracked = True
+
+
+def is_mysql():
+    return isinstance(database.obj, MySQLDatabase)
+
+
+def init_app(app):
+    """按 app.config 绑定数据库, 并把连接的获取与归还挂到应用的请求生命周期上。"""
+    init_database(app.config)
+    from applications.database import replicas
+    replicas.init_app(app)
+
+    @app.before_request
+    def open_connection():
+        database.connect(reuse_if_open=True)
+
+    @app.teardown_request
+    def close_connection(exception):
+        if not database.is_closed():
+            database.close()  # 归还到连接池
+
+
+def after_fork():
+    """在 fork 出的工作进程中调用 (gunicorn 的 post_fork): 丢弃从主进程继承的连接。
+
+    继承的连接与主进程共用同一个套接字, 不能在子进程中使用或关闭 (关闭会断开主进程的连接),
+    因此只清除引用, 工作进程在第一个请求时建立自己的连接。
+    """
+    if database.obj is None:
+        return
+    from applications.database.replicas import ROUTER
+    for db in [database.obj] + [replica.db for replica in ROUTER.replicas]:
+        db._state.reset()
+        if hasattr(db, '_in_use'):  # 连接池; fork 时锁可能正被主进程的其他线程持有, 一并重建
+            db._pool_lock = threading.RLock()
+            db._connections = []
+            db._in_use = {}
+
+
+# 权限位, 按顺序对应 Users.permissions 的第 0, 1, 2... 位 (只能在末尾追加, 不能调整顺序)
+PERMISSIONS = (
+    'can_manage_users',
+    'can_manage_supplies',
+    'can_manage_suppliers',
+    'can_manage_products',
+    'can_manage_purchases',
+    'can_manage_quality_controls',
+    'can_manage_warehouses',
+    'can_manage_finances',
+    'can_manage_reports',
+)
 
 
 # 用户模型
@@ -21,17 +154,64 @@ class Users(Model, UserMixin):
     password = CharField()
     is_admin = BooleanField(default=False)  # 是否是管理员
     is_active = BooleanField(default=True)  # 用户是否被禁用
-    can_manage_users = BooleanField(default=False)
-    can_manage_supplies = BooleanField(default=False)
-    can_manage_suppliers = BooleanField(default=False)
-    can_manage_products = BooleanField(default=False)
-    can_manage_purchases = BooleanField(default=False)
-    can_manage_quality_controls = BooleanField(default=False)
-    can_manage_warehouses = BooleanField(default=False)
-    can_manage_finances = BooleanField(default=False)
+    permissions = IntegerField(default=0)  # 权限位掩码, 见 PERMISSIONS
+    permission_version = IntegerField(default=0)  # 每次修改权限时递增, 使权限缓存失效
+
     class Meta:
         database = database
 
+    def set_permissions(self, names):
+        """整体替换权限并递增版本号, 调用方负责 save()。"""
+        self.permissions = sum(1 << PERMISSIONS.index(name) for name in set(names))
+        self.permission_version = (self.permission_version or 0) + 1
+
+
+def _permission_property(bit):
+    def getter(self):
+        return bool((self.permissions or 0) & bit)
+
+    def setter(self, value):
+        self.permissions = (self.permissions or 0) | bit if value else (self.permissions or 0) & ~bit
+
+    return property(getter, setter)
+
+
+# user.can_manage_xxx 仍可按原来的布尔字段方式读写
+for _bit, _name in enumerate(PERMISSIONS):
+    setattr(Users, _name, _permission_property(1 << _bit))
+
+
+# --- 变更通知 ---
+# {模型类: [回调]}, 回调参数为被修改的实例, 批量写入时为 None
+_change_listeners = {}
+
+
+def on_change(model, listener):
+    """注册 model 的写入回调, 用于缓存失效等。"""
+    _change_listeners.setdefault(model, []).append(listener)
+
+
+class NotifyingModel(Model):
+    """save() / delete_instance() 之后调用 on_change 注册的回调, 在事务中时等到提交之后再调用。
+
+    insert_many、update() 等批量写入不经过实例, 写入方需自行调用 notify_change()。
+    """
+
+    @classmethod
+    def notify_change(cls, instance=None):
+        # 提交前失效的话, 并发的读取可能把提交前的旧数据重新放入缓存, 直到过期
+        for listener in _change_listeners.get(cls, ()):
+            after_commit(lambda listener=listener: listener(instance))
+
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        self.notify_change(self)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        self.notify_change(self)
+        return result
 
 
 class Supplies(Model):
@@ -41,10 +221,14 @@ class Supplies(Model):
 
     class Meta:
         database = database
+        indexes = (
+            (('name', 'specification'), True),  # 按名称+规格查找/合并物资, 唯一: 并发的首次新增只建一行
+            (('quantity',), False),  # 报表按数量降序取前 n 条
+        )
 
 
 # --- 供应商模型 (为 Purchase 模型添加关联) ---
-class Supplier(Model):
+class Supplier(NotifyingModel):
     name = CharField()
     contact_person = CharField()
     phone = CharField()
@@ -55,7 +239,7 @@ class Supplier(Model):
 
 
 # --- 产品模型 (为多个模型添加关联) ---
-class Product(Model):
+class Product(NotifyingModel):
     name = CharField()
     description = TextField()
     unit = CharField()  # 单位，例如：个、箱、米
@@ -72,6 +256,7 @@ class Purchase(Model):
     quantity = IntegerField()
     total_price = DecimalField(decimal_places=2)
     purchase_date = DateField()  # 采购日期
+    receipt_id = IntegerField(null=True)  # 收货单 (GoodsReceipt) ID, 逐条录入的采购为空
 
     # 可以添加其他字段，例如：
     # purchase_order_number = CharField()  # 采购订单号
@@ -79,6 +264,10 @@ class Purchase(Model):
 
     class Meta:
         database = database
+        indexes = (
+            (('purchase_date',), False),
+            (('receipt_id',), False),  # 收货单明细
+        )
 
 
 # --- 质量监控模型 ---
@@ -87,6 +276,7 @@ class QualityControl(Model):
     inspection_date = DateField()  # 质检日期
     inspector = CharField()  # 质检员
     result = CharField()  # 质检结果 (例如：合格、不合格)
+    accepted_quantity = IntegerField(null=True)  # 合格数量 (收货时录入, 逐条录入的质检为空)
 
     # 可以添加其他字段，例如：
     # defects = TextField()  # 缺陷描述
@@ -94,6 +284,9 @@ class QualityControl(Model):
 
     class Meta:
         database = database
+        indexes = (
+            (('inspection_date',), False),
+        )
 
 
 # --- 仓库模型 ---
@@ -107,10 +300,122 @@ class Warehouse(Model):
     # last_in_date = DateField()  # 最后入库日期
     # last_out_date = DateField()  # 最后出库日期
 
+    class Meta:
+        database = database
+        indexes = (
+            (('material_name', 'location'), True),  # 出入库按物资名称(+库位)定位库存记录, 唯一: 并发的首次入库只建一行
+        )
+
+
+# --- 收货单 ---
+# 一次到货的整张采购单: 明细为 receipt_id 指向它的采购记录, 每条明细有一条质检记录, 合格数量入库
+class GoodsReceipt(Model):
+    supplier = ForeignKeyField(Supplier, backref='receipts')  # 供应商
+    received_date = DateField()  # 到货 (质检、入库) 日期
+    inspector = CharField()  # 质检员
+    line_count = IntegerField(default=0)  # 明细条数
+    accepted_quantity = IntegerField(default=0)  # 合格 (入库) 总数
+    rejected_quantity = IntegerField(default=0)  # 不合格总数
+    user_id = IntegerField(null=True)  # 操作人
+    created_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        database = database
+        table_name = 'goods_receipt'
+        indexes = (
+            (('received_date',), False),
+        )
+
+
+# --- 库存变动流水 (只追加, 不修改) ---
+class StockMovement(Model):
+    source = CharField()  # 变动对象：warehouse (仓库库存) 或 supplies (物资)
+    item_id = IntegerField()  # 对应 Warehouse / Supplies 记录的 ID
+    material_name = CharField()
+    location = CharField(null=True)  # 库位
+    operation = CharField()  # 操作类型：in (入库) 或 out (出库)
+    quantity = IntegerField()  # 变动数量 (入库为正, 出库为负)
+    date = DateField(null=True)  # 业务日期
+    user_id = IntegerField(null=True)  # 操作人
+    created_at = DateTimeField(default=datetime.datetime.now)  # 记录时间
+
+    class Meta:
+        database = database
+        indexes = (
+            (('source', 'item_id'), False),
+            (('material_name', 'created_at'), False),
+            (('created_at',), False),  # 把时间点换算成流水 ID, 见 stock_history
+            (('source', 'item_id', 'created_at'), False),  # 按时间点汇总各库存记录的流水, 见 stock_history
+        )
+
+
+# --- 锁行 ---
+# 需要与一类写入事务互斥的操作对同一行加锁, 例如建库存检查点时等待进行中的出入库提交, 见 stock.lock_ledger
+class AppLock(Model):
+    name = CharField(primary_key=True)
+
+    class Meta:
+        database = database
+        table_name = 'app_lock'
+
+
+# --- 库存检查点 (某一时刻全部库存的快照, 用于按时间点查询库存) ---
+class StockCheckpoint(Model):
+    taken_at = DateTimeField(default=datetime.datetime.now)
+    last_movement_id = IntegerField(index=True)  # 快照恰好包含 ID 不超过该值的全部流水 (均已提交)
+    movements_until = DateTimeField(null=True)  # 这些流水中最晚的记录时间
+    item_count = IntegerField(default=0)
+
     class Meta:
         database = database
 
 
+class StockSnapshot(Model):
+    checkpoint = ForeignKeyField(StockCheckpoint, on_delete='CASCADE')
+    source = CharField()  # 同 StockMovement.source
+    item_id = IntegerField()
+    material_name = CharField()
+    location = CharField(null=True)
+    quantity = IntegerField()
+
+    class Meta:
+        database = database
+        indexes = (
+            (('checkpoint', 'source', 'item_id'), True),
+        )
+
+
+# --- 补货提醒 ---
+class ReorderRule(Model):
+    source = CharField()  # 同 StockMovement.source
+    material_name = CharField()  # 物资/库存名称, 同名的多条记录 (不同规格或库位) 合计判断
+    reorder_point = IntegerField()  # 库存低于该值时提醒
+    reorder_quantity = IntegerField(default=0)  # 最小采购量
+    lead_time_days = IntegerField(default=7)  # 采购提前期, 建议采购量需覆盖这段时间的消耗
+
+    class Meta:
+        database = database
+        indexes = (
+            (('source', 'material_name'), True),
+        )
+
+
+class StockAlert(Model):
+    # 当前低于补货点的物资; 只在出入库时按被修改的物资增删, 列表查询只读取这张表
+    source = CharField()
+    material_name = CharField()
+    quantity = IntegerField()  # 最近一次检查时的库存
+    reorder_point = IntegerField()
+    created_at = DateTimeField(default=datetime.datetime.now)  # 开始低于补货点的时间
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        database = database
+        indexes = (
+            (('source', 'material_name'), True),
+        )
+
+
 # --- 财务模型 ---
 class Finance(Model):
     date = DateField()  # 财务记录日期
@@ -124,33 +429,117 @@ class Finance(Model):
 
     class Meta:
         database = database
+        indexes = (
+            (('date', 'type'), False),
+            (('type', 'date', 'amount'), False),  # 覆盖索引: 按类型+日期范围汇总金额无需回表
+        )
 
 
-# 在应用启动时创建表格
-with app.app_context():
-    try:
-        database.connect()
-        database.create_tables([
-            Users,
-            Supplies,
-            Supplier,  # 确保 Supplier 在 Purchase 之前创建
-            Product,  # 将 Product 添加到此处
-            Purchase,
-            QualityControl,
-            Warehouse,
-            Finance  # 添加Finance模型
-        ])
-        # 设置 AUTO_INCREMENT
-        database.execute_sql('ALTER TABLE Users MODIFY id INT AUTO_INCREMENT')
-        print("数据库连接成功！已创建表格。")
-    except Exception as e:
-        print(f"数据库连接或表格创建失败：{e}")
+# --- 统计汇总模型 ---
+# 以下表格与业务写入在同一事务内增量维护 (见 summary.py), /report 直接读取而不扫描明细表
+class SummaryTotal(Model):
+    name = CharField(primary_key=True)  # 汇总项名称，例如：supplies_quantity
+    value = DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        database = database
 
 
-@app.teardown_appcontext
-def close_connection(exception):
-    database.close()
+class PurchaseSummary(Model):
+    product = ForeignKeyField(Product, primary_key=True, backref='purchase_summary')  # 产品
+    purchase_count = IntegerField(default=0)  # 采购次数
+    total_quantity = IntegerField(default=0)  # 采购总量
+    total_amount = DecimalField(max_digits=20, decimal_places=2, default=0)  # 采购总金额
+
+    class Meta:
+        database = database
+
+
+class FinanceSummary(Model):
+    type = CharField(primary_key=True)  # 类型 (例如：收入、支出)
+    record_count = IntegerField(default=0)
+    total_amount = DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        database = database
+
+
+class FinanceRollup(Model):
+    period = CharField()  # 粒度: day / week / month
+    period_start = DateField()  # 该日 / 该周周一 / 该月 1 日
+    type = CharField()  # 类型 (与 Finance.type 相同)
+    record_count = IntegerField(default=0)
+    total_amount = DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        database = database
+        indexes = (
+            (('period', 'period_start', 'type'), True),  # 增量累加的唯一键, 也用于按时间范围查询
+        )
+
+
+# --- 表版本 ---
+# 每张表被写入 (INSERT/UPDATE/DELETE) 的事务提交后递增, 用于页面的 ETag/Last-Modified 与渲染缓存, 见 versions.py
+class TableVersion(Model):
+    name = CharField(primary_key=True)  # 表名
+    version = IntegerField(default=0)
+    updated_at = DateTimeField(null=True)  # 最后一次写入时间 (UTC)
+
+    class Meta:
+        database = database
+        table_name = 'table_version'
+
+
+# --- 后台任务 ---
+# 报表、导出、导入等耗时操作由 applications/jobs 的工作线程执行, 结果文件保存在 JOB_RESULT_DIR
+class Job(Model):
+    kind = CharField()  # 任务类型: report / export / import
+    params = TextField()  # JSON 参数
+    dedup_key = CharField(max_length=64)  # 类型 + 参数 (+ 数据版本) 的哈希, 相同请求共用一个任务
+    active_key = CharField(max_length=64, null=True)  # 未完成时等于 dedup_key, 结束后为空; 唯一, 保证相同的未完成任务只有一个
+    permission = CharField()  # 查看进度与下载结果所需的权限
+    status = CharField(default='pending')  # pending / running / done / failed
+    progress = IntegerField(default=0)  # 0 ~ 100
+    message = TextField(null=True)  # 结果摘要或失败原因
+    result_path = CharField(max_length=512, null=True)
+    content_type = CharField(null=True)
+    filename = CharField(null=True)  # 下载文件名
+    user_id = IntegerField(null=True)  # 提交人
+    created_at = DateTimeField(default=datetime.datetime.now)
+    started_at = DateTimeField(null=True)
+    heartbeat_at = DateTimeField(null=True)  # 执行中的任务由所在进程定期更新, 长时间未更新说明进程已退出
+    finished_at = DateTimeField(null=True)
+
+    class Meta:
+        database = database
+        indexes = (
+            (('dedup_key', 'status'), False),  # 提交时查找相同的任务
+            (('active_key',), True),
+        )
+
+
+# --- 审计日志 ---
+# 对物资、库存、采购、质检、收货单、财务、产品/供应商、补货点与用户 (权限) 的每次写入, 由 audit.py 在后台批量追加;
+# 只追加, 不修改或删除
+class AuditLog(Model):
+    id = BigAutoField()
+    created_at = DateTimeField(default=datetime.datetime.now)  # 写入 (提交) 时间
+    user_id = IntegerField(null=True)  # 操作人, 命令行脚本等没有登录用户时为空
+    context = CharField(null=True)  # 来源: 请求的方法与路径, 或后台任务
+    table_name = CharField(max_length=64)
+    action = CharField(max_length=16)  # insert / update / delete
+    record_id = BigIntegerField(null=True)  # 能确定单条记录时为其主键
+    changes = TextField(null=True)  # JSON: 写入的字段值, 以及无法确定单条记录时的条件
+
+    class Meta:
+        database = database
+        table_name = 'audit_log'
+        indexes = (
+            (('user_id', 'created_at'), False),  # 按操作人 + 时间范围查询
+            (('table_name', 'record_id'), False),  # 某条记录的修改历史
+            (('table_name', 'created_at'), False),  # 按表 + 时间范围查询
+            (('created_at',), False),
+        )
 
 
-if __name__ == '__main__':
-    app.run(debug=True)
+# 表结构的创建与变更见 migrations.py (python -m applications.database.migrations upgrade)
@@ -0,0 +1,139 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+
+from peewee import DecimalField
+
+from applications.database.database import is_mysql, Purchase, Finance, Warehouse, QualityControl
+from applications.database.replicas import read_database
+
+# 可导出的表: {名称: (模型, 用于日期范围筛选的字段)}
+EXPORTS = {
+    'purchases': (Purchase, Purchase.purchase_date),
+    'finance': (Finance, Finance.date),
+    'warehouse': (Warehouse, None),
+    'quality_control': (QualityControl, QualityControl.inspection_date),
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# 每次从游标取回的行数
+FETCH_SIZE = 1000
+# 输出缓冲超过该字节数即向客户端发送一次
+FLUSH_SIZE = 64 * 1024
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"参数 {name} 必须是 YYYY-MM-DD 格式的日期")
+
+
+def build_query(table, columns=None, start=None, end=None):
+    """构造导出查询, 返回 (query, 列名列表)。参数不合法时抛出 ValueError。"""
+    if table not in EXPORTS:
+        raise ValueError(f"不支持导出的表: {table}")
+    model, date_field = EXPORTS[table]
+
+    fields = model._meta.sorted_fields
+    if columns:
+        by_name = {field.name: field for field in fields}
+        unknown = [name for name in columns if name not in by_name]
+        if unknown:
+            raise ValueError(f"未知的列: {', '.join(unknown)}")
+        fields = [by_name[name] for name in columns]
+
+    query = model.select(*fields).order_by(model._meta.primary_key)
+    if start or end:
+        if date_field is None:
+            raise ValueError(f"{table} 不支持按日期筛选")
+        if start:
+            query = query.where(date_field >= _parse_date(start, 'start'))
+        if end:
+            query = query.where(date_field <= _parse_date(end, 'end'))
+    return query, [field.name for field in fields]
+
+
+def iter_rows(query):
+    """逐行产出查询结果 (元组)。
+
+    MySQL 下使用服务端游标, 结果不会整体缓冲在客户端, 内存占用与表大小无关;
+    游标在生成器结束或被关闭时释放。
+    """
+    sql, params = query.sql()
+    db = read_database()  # 在 replicas.reading() 范围内为只读副本
+    if is_mysql():
+        from MySQLdb.cursors import SSCursor  # 服务端 (不缓冲) 游标, 结果集逐行从服务器读取
+        cursor = db.connection().cursor(SSCursor)
+    else:
+        cursor = db.cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def _converter(field):
+    """游标中的原始值 -> 字段的 Python 值。
+
+    SQLite 中金额为整数/浮点数、日期为字符串, MySQL 中为 Decimal 与 date; 统一转换后两种数据库的导出内容相同。
+    """
+    if isinstance(field, DecimalField):
+        exponent = decimal.Decimal(10) ** -field.decimal_places
+
+        def convert(value):
+            value = field.python_value(value)
+            return value.quantize(exponent) if value is not None else None
+
+        return convert
+    return field.python_value
+
+
+def _format(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def generate(query, names, fmt, on_progress=None):
+    """按 fmt (csv / jsonl) 分批产出导出内容。on_progress 在每批输出时以已写出的行数调用。"""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM, 便于 Excel 正确识别中文
+        writer.writerow(names)
+        write = lambda row: writer.writerow([_format(value) for value in row])
+    elif fmt == 'jsonl':
+        def write(row):
+            buffer.write(json.dumps(dict(zip(names, map(_format, row))), ensure_ascii=False))
+            buffer.write('\n')
+    else:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+    converters = [_converter(field) for field in query._returning]
+    count = 0
+    for row in iter_rows(query):
+        write([convert(value) for convert, value in zip(converters, row)])
+        count += 1
+        if buffer.tell() >= FLUSH_SIZE:
+            if on_progress is not None:
+                on_progress(count)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if on_progress is not None:
+        on_progress(count)
+    yield buffer.getvalue()
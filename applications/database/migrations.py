@@ -0,0 +1,470 @@
+import argparse
+import datetime
+
+from peewee import Model, IntegerField, CharField, DateTimeField, ForeignKeyField, BooleanField, Entity, fn
+from playhouse.migrate import SchemaMigrator, migrate
+
+from applications.database.database import database, init_database, is_mysql, PERMISSIONS, Users, Supplies, Supplier, Product, \
+    Purchase, QualityControl, Warehouse, Finance, StockMovement, SummaryTotal, PurchaseSummary, FinanceSummary, \
+    TableVersion, Job, StockCheckpoint, StockSnapshot, FinanceRollup, ReorderRule, StockAlert, AuditLog, \
+    GoodsReceipt, AppLock
+from applications.database import versions
+from applications.database.stock import SOURCE_WAREHOUSE, SOURCE_SUPPLIES, LEDGER_LOCK
+
+
+# 已应用的迁移版本
+class SchemaVersion(Model):
+    version = IntegerField(primary_key=True)
+    description = CharField()
+    applied_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        database = database
+        table_name = 'schema_version'
+
+
+class Migration:
+    def __init__(self, version, description, upgrade, downgrade):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.downgrade = downgrade
+
+
+# --- 迁移辅助函数 ---
+# 均为幂等操作, 已存在 (或已删除) 时直接跳过, 以兼容旧版本在启动时自动建表留下的数据库
+
+def index_name(model, columns):
+    # 与 peewee 自动生成的索引名一致, 例如 supplies_name_specification, purchase_supplier_id
+    return '_'.join([model._meta.table_name] + [model._meta.fields[column].column_name for column in columns])
+
+
+def add_index(model, columns, unique=False):
+    """在线添加索引。MySQL 使用 ALGORITHM=INPLACE, LOCK=NONE, 建索引期间不阻塞读写。"""
+    table = model._meta.table_name
+    name = index_name(model, columns)
+    columns = [model._meta.fields[column].column_name for column in columns]
+    for index in database.get_indexes(table):
+        if index.name == name or list(index.columns) == columns:
+            return
+    column_sql = ', '.join(f'`{column}`' if is_mysql() else f'"{column}"' for column in columns)
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    if is_mysql():
+        database.execute_sql(f'ALTER TABLE `{table}` ADD {kind} `{name}` ({column_sql}), '
+                             f'ALGORITHM=INPLACE, LOCK=NONE')
+    else:
+        database.execute_sql(f'CREATE {kind} "{name}" ON "{table}" ({column_sql})')
+
+
+def column_names(model):
+    return {column.name for column in database.get_columns(model._meta.table_name)}
+
+
+def drop_index(model, name):
+    table = model._meta.table_name
+    if name not in {index.name for index in database.get_indexes(table)}:
+        return
+    if is_mysql():
+        database.execute_sql(f'ALTER TABLE `{table}` DROP INDEX `{name}`, ALGORITHM=INPLACE, LOCK=NONE')
+    else:
+        database.execute_sql(f'DROP INDEX "{name}"')
+
+
+# --- 迁移定义 ---
+
+INITIAL_MODELS = [
+    Users,
+    Supplies,
+    Supplier,  # 确保 Supplier 在 Purchase 之前创建
+    Product,
+    Purchase,
+    QualityControl,
+    Warehouse,
+    Finance,
+    StockMovement,
+    SummaryTotal,
+    PurchaseSummary,
+    FinanceSummary,
+]
+
+
+def _initial_upgrade():
+    database.create_tables(INITIAL_MODELS, safe=True)
+    if is_mysql():
+        # 设置 AUTO_INCREMENT
+        database.execute_sql('ALTER TABLE Users MODIFY id INT AUTO_INCREMENT')
+
+
+def _initial_downgrade():
+    database.drop_tables(INITIAL_MODELS, safe=True)
+
+
+# 热点查询所需的索引: (模型, 列)
+HOT_PATH_INDEXES = [
+    (Supplies, ('name', 'specification')),
+    (Warehouse, ('material_name', 'location')),
+    (Purchase, ('purchase_date',)),
+    (Purchase, ('supplier',)),
+    (Purchase, ('product',)),
+    (QualityControl, ('purchase',)),
+    (QualityControl, ('inspection_date',)),
+    (Warehouse, ('product',)),
+    (Finance, ('date', 'type')),
+    (Finance, ('type', 'date', 'amount')),
+    (StockMovement, ('source', 'item_id')),
+    (StockMovement, ('material_name', 'created_at')),
+    (Supplies, ('quantity',)),  # 报表按数量降序取前 n 条物资
+]
+
+
+def _indexes_upgrade():
+    for model, columns in HOT_PATH_INDEXES:
+        add_index(model, columns)
+
+
+def _indexes_downgrade():
+    for model, columns in reversed(HOT_PATH_INDEXES):
+        # 外键索引由 MySQL 外键约束依赖, 保留
+        if any(isinstance(model._meta.fields[column], ForeignKeyField) for column in columns):
+            continue
+        drop_index(model, index_name(model, columns))
+
+
+# 权限改为位掩码前 Users 表上的布尔列 (can_manage_reports 为新增权限, 沿用财务权限)
+LEGACY_PERMISSION_COLUMNS = PERMISSIONS[:PERMISSIONS.index('can_manage_finances') + 1]
+
+
+def _permission_bits(name):
+    source = 'can_manage_finances' if name == 'can_manage_reports' else name
+    return source, 1 << PERMISSIONS.index(name)
+
+
+def _permissions_upgrade():
+    table = Users._meta.table_name
+    migrator = SchemaMigrator.from_database(database.obj)
+    columns = column_names(Users)
+    if 'permissions' not in columns:
+        migrate(migrator.add_column(table, 'permissions', IntegerField(default=0)),
+                migrator.add_column(table, 'permission_version', IntegerField(default=0)))
+
+    legacy = [name for name in LEGACY_PERMISSION_COLUMNS if name in columns]
+    if legacy:
+        for name in PERMISSIONS:
+            source, bit = _permission_bits(name)
+            if source in legacy:
+                (Users
+                 .update(permissions=Users.permissions.bin_or(bit))
+                 .where(Entity(table, source) == True)
+                 .execute())
+        migrate(*[migrator.drop_column(table, name) for name in legacy])
+
+
+def _permissions_downgrade():
+    table = Users._meta.table_name
+    migrator = SchemaMigrator.from_database(database.obj)
+    columns = column_names(Users)
+    missing = [name for name in LEGACY_PERMISSION_COLUMNS if name not in columns]
+    if missing:
+        migrate(*[migrator.add_column(table, name, BooleanField(default=False)) for name in missing])
+    if 'permissions' in columns:
+        for name in missing:
+            bit = 1 << PERMISSIONS.index(name)
+            database.execute(Users.update({Entity(name): True}).where(Users.permissions.bin_and(bit) != 0))
+        migrate(migrator.drop_column(table, 'permissions'),
+                migrator.drop_column(table, 'permission_version'))
+
+
+def _table_versions_upgrade():
+    database.create_tables([TableVersion], safe=True)
+    # 预先插入各表的版本行, 之后的写入只需 UPDATE
+    rows = [{'name': model._meta.table_name, 'version': 0} for model in INITIAL_MODELS]
+    TableVersion.insert_many(rows).on_conflict_ignore().execute()
+    versions.reset()
+
+
+def _table_versions_downgrade():
+    database.drop_tables([TableVersion], safe=True)
+    versions.reset()
+
+
+def _jobs_upgrade():
+    database.create_tables([Job], safe=True)
+
+
+def _jobs_downgrade():
+    database.drop_tables([Job], safe=True)
+
+
+def _stock_history_upgrade():
+    # 第一个检查点在迁移 14 中建立 (需要流水锁行)
+    database.create_tables([StockCheckpoint, StockSnapshot], safe=True)
+    add_index(StockMovement, ('created_at',))
+
+
+def _stock_history_downgrade():
+    database.drop_tables([StockSnapshot, StockCheckpoint], safe=True)
+    drop_index(StockMovement, index_name(StockMovement, ('created_at',)))
+
+
+def _finance_rollups_upgrade():
+    from applications.database import summary
+
+    database.create_tables([FinanceRollup], safe=True)
+    summary.rebuild_finance_rollups()  # 从已有的财务明细填充
+
+
+def _finance_rollups_downgrade():
+    database.drop_tables([FinanceRollup], safe=True)
+
+
+def _reorder_upgrade():
+    database.create_tables([ReorderRule, StockAlert], safe=True)
+
+
+def _reorder_downgrade():
+    database.drop_tables([StockAlert, ReorderRule], safe=True)
+
+
+def _audit_upgrade():
+    database.create_tables([AuditLog], safe=True)
+
+
+def _audit_downgrade():
+    database.drop_tables([AuditLog], safe=True)
+
+
+def _receiving_upgrade():
+    database.create_tables([GoodsReceipt], safe=True)
+    migrator = SchemaMigrator.from_database(database.obj)
+    operations = []
+    if 'receipt_id' not in column_names(Purchase):
+        operations.append(migrator.add_column(Purchase._meta.table_name, 'receipt_id', IntegerField(null=True)))
+    if 'accepted_quantity' not in column_names(QualityControl):
+        operations.append(migrator.add_column(QualityControl._meta.table_name, 'accepted_quantity',
+                                              IntegerField(null=True)))
+    if operations:
+        migrate(*operations)
+    add_index(Purchase, ('receipt_id',))
+
+
+def _receiving_downgrade():
+    drop_index(Purchase, index_name(Purchase, ('receipt_id',)))
+    migrator = SchemaMigrator.from_database(database.obj)
+    operations = []
+    if 'receipt_id' in column_names(Purchase):
+        operations.append(migrator.drop_column(Purchase._meta.table_name, 'receipt_id'))
+    if 'accepted_quantity' in column_names(QualityControl):
+        operations.append(migrator.drop_column(QualityControl._meta.table_name, 'accepted_quantity'))
+    if operations:
+        migrate(*operations)
+    database.drop_tables([GoodsReceipt], safe=True)
+
+
+def _report_index_upgrade():
+    # 迁移 2 之后加入 HOT_PATH_INDEXES 的索引; add_index 跳过已存在的索引
+    _indexes_upgrade()
+
+
+def _report_index_downgrade():
+    drop_index(Supplies, index_name(Supplies, ('quantity',)))
+
+
+# 改为唯一索引的库存定位键: (模型, 列, 流水中的变动对象)
+UNIQUE_STOCK_KEYS = [
+    (Supplies, ('name', 'specification'), SOURCE_SUPPLIES),
+    (Warehouse, ('material_name', 'location'), SOURCE_WAREHOUSE),
+]
+
+
+def _merge_duplicates(model, columns, source):
+    """把唯一键相同的库存记录合并到 ID 最小的一条: 数量相加, 流水与检查点快照改为指向保留的记录。"""
+    fields = [getattr(model, column) for column in columns]
+    groups = list(model
+                  .select(*fields, fn.MIN(model.id))
+                  .group_by(*fields)
+                  .having(fn.COUNT(model.id) > 1)
+                  .tuples())
+    for *key, keep in groups:
+        duplicates = [pk for pk, in (model
+                                     .select(model.id)
+                                     .where(*[field == value for field, value in zip(fields, key)], model.id != keep)
+                                     .tuples())]
+        extra = model.select(fn.SUM(model.quantity)).where(model.id.in_(duplicates)).scalar()
+        model.update(quantity=model.quantity + extra).where(model.id == keep).execute()
+        (StockMovement
+         .update(item_id=keep)
+         .where(StockMovement.source == source, StockMovement.item_id.in_(duplicates))
+         .execute())
+        snapshots = (StockSnapshot
+                     .select(StockSnapshot.checkpoint, fn.SUM(StockSnapshot.quantity))
+                     .where(StockSnapshot.source == source, StockSnapshot.item_id.in_(duplicates))
+                     .group_by(StockSnapshot.checkpoint)
+                     .tuples())
+        for checkpoint_id, quantity in list(snapshots):
+            updated = (StockSnapshot
+                       .update(quantity=StockSnapshot.quantity + quantity)
+                       .where(StockSnapshot.checkpoint == checkpoint_id, StockSnapshot.source == source,
+                              StockSnapshot.item_id == keep)
+                       .execute())
+            if not updated:
+                StockSnapshot.create(checkpoint=checkpoint_id, source=source, item_id=keep, material_name=key[0],
+                                     location=key[1] if source == SOURCE_WAREHOUSE else None, quantity=quantity)
+        StockSnapshot.delete().where(StockSnapshot.source == source, StockSnapshot.item_id.in_(duplicates)).execute()
+        model.delete().where(model.id.in_(duplicates)).execute()
+
+
+def _unique_stock_keys_upgrade():
+    for model, columns, source in UNIQUE_STOCK_KEYS:
+        _merge_duplicates(model, columns, source)
+        name = index_name(model, columns)
+        if not any(index.name == name and index.unique for index in database.get_indexes(model._meta.table_name)):
+            drop_index(model, name)
+            add_index(model, columns, unique=True)
+
+
+def _unique_stock_keys_downgrade():
+    for model, columns, _ in reversed(UNIQUE_STOCK_KEYS):
+        drop_index(model, index_name(model, columns))
+        add_index(model, columns)
+
+
+def _job_dedup_upgrade():
+    migrator = SchemaMigrator.from_database(database.obj)
+    columns = column_names(Job)
+    operations = []
+    if 'active_key' not in columns:
+        operations.append(migrator.add_column(Job._meta.table_name, 'active_key', CharField(max_length=64, null=True)))
+    if 'heartbeat_at' not in columns:
+        operations.append(migrator.add_column(Job._meta.table_name, 'heartbeat_at', DateTimeField(null=True)))
+    if operations:
+        migrate(*operations)
+    # 已有的未完成任务: 相同 dedup_key 中只有最新的一个参与去重
+    seen = set()
+    active = Job.select(Job.id, Job.dedup_key).where(Job.status.in_(('pending', 'running'))).order_by(Job.id.desc())
+    for job_id, key in list(active.tuples()):
+        if key not in seen:
+            seen.add(key)
+            Job.update(active_key=key).where(Job.id == job_id).execute()
+    add_index(Job, ('active_key',), unique=True)
+
+
+def _job_dedup_downgrade():
+    drop_index(Job, index_name(Job, ('active_key',)))
+    migrator = SchemaMigrator.from_database(database.obj)
+    columns = column_names(Job)
+    migrate(*[migrator.drop_column(Job._meta.table_name, name) for name in ('active_key', 'heartbeat_at')
+              if name in columns])
+
+
+def _ledger_lock_upgrade():
+    from applications.database import stock_history
+
+    database.create_tables([AppLock], safe=True)
+    AppLock.insert(name=LEDGER_LOCK).on_conflict_ignore().execute()
+    if 'movements_until' not in column_names(StockCheckpoint):
+        migrator = SchemaMigrator.from_database(database.obj)
+        migrate(migrator.add_column(StockCheckpoint._meta.table_name, 'movements_until', DateTimeField(null=True)))
+    # 之前的检查点把当前库存与最大流水 ID 配对, 可能遗漏当时未提交的流水, 全部删除后在流水锁下重建第一个检查点:
+    # 之后的时间点向前累加流水, 之前的时间点从它向后扣减
+    StockSnapshot.delete().execute()
+    StockCheckpoint.delete().execute()
+    stock_history.take_checkpoint()
+
+
+def _ledger_lock_downgrade():
+    if 'movements_until' in column_names(StockCheckpoint):
+        migrator = SchemaMigrator.from_database(database.obj)
+        migrate(migrator.drop_column(StockCheckpoint._meta.table_name, 'movements_until'))
+    database.drop_tables([AppLock], safe=True)
+
+
+def _movement_range_index_upgrade():
+    # stock_at 按 (类型, 库存记录) 分组, 在记录时间范围内汇总流水
+    add_index(StockMovement, ('source', 'item_id', 'created_at'))
+
+
+def _movement_range_index_downgrade():
+    drop_index(StockMovement, index_name(StockMovement, ('source', 'item_id', 'created_at')))
+
+
+MIGRATIONS = [
+    Migration(1, '初始表结构', _initial_upgrade, _initial_downgrade),
+    Migration(2, '热点查询索引', _indexes_upgrade, _indexes_downgrade),
+    Migration(3, '用户权限改为位掩码', _permissions_upgrade, _permissions_downgrade),
+    Migration(4, '表版本 (页面 ETag 与渲染缓存)', _table_versions_upgrade, _table_versions_downgrade),
+    Migration(5, '后台任务表', _jobs_upgrade, _jobs_downgrade),
+    Migration(6, '库存检查点 (按时间点查询库存)', _stock_history_upgrade, _stock_history_downgrade),
+    Migration(7, '财务日/周/月汇总', _finance_rollups_upgrade, _finance_rollups_downgrade),
+    Migration(8, '补货点与补货提醒', _reorder_upgrade, _reorder_downgrade),
+    Migration(9, '审计日志', _audit_upgrade, _audit_downgrade),
+    Migration(10, '收货单 (采购、质检、入库一次完成)', _receiving_upgrade, _receiving_downgrade),
+    Migration(11, '物资数量索引 (报表)', _report_index_upgrade, _report_index_downgrade),
+    Migration(12, '库存定位键改为唯一索引 (合并重复的库存记录)', _unique_stock_keys_upgrade,
+              _unique_stock_keys_downgrade),
+    Migration(13, '后台任务去重唯一键与心跳', _job_dedup_upgrade, _job_dedup_downgrade),
+    Migration(14, '库存流水锁与检查点重建', _ledger_lock_upgrade, _ledger_lock_downgrade),
+    Migration(15, '库存流水按记录时间范围汇总的索引', _movement_range_index_upgrade, _movement_range_index_downgrade),
+]
+
+
+# --- 执行 ---
+
+def current_version():
+    database.create_tables([SchemaVersion], safe=True)
+    return SchemaVersion.select(SchemaVersion.version).order_by(SchemaVersion.version.desc()).scalar() or 0
+
+
+def upgrade(target=None):
+    """依次应用高于当前版本的迁移, 直到 target (默认最新)。返回应用的迁移列表。"""
+    applied = []
+    version = current_version()
+    for migration in MIGRATIONS:
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        # MySQL 的 DDL 会隐式提交, 事务只保证版本记录与 SQLite 下的 DDL 一起生效
+        with database.atomic():
+            migration.upgrade()
+            SchemaVersion.create(version=migration.version, description=migration.description)
+        applied.append(migration)
+    return applied
+
+
+def downgrade(target):
+    """依次回退高于 target 的迁移。返回回退的迁移列表。"""
+    reverted = []
+    version = current_version()
+    for migration in reversed(MIGRATIONS):
+        if migration.version > version or migration.version <= target:
+            continue
+        with database.atomic():
+            migration.downgrade()
+            SchemaVersion.delete().where(SchemaVersion.version == migration.version).execute()
+        reverted.append(migration)
+    return reverted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库结构迁移')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    upgrade_parser = subparsers.add_parser('upgrade', help='升级到指定版本 (默认最新)')
+    upgrade_parser.add_argument('target', type=int, nargs='?')
+    downgrade_parser = subparsers.add_parser('downgrade', help='回退到指定版本')
+    downgrade_parser.add_argument('target', type=int)
+    subparsers.add_parser('status', help='显示当前版本')
+    args = parser.parse_args()
+
+    init_database()
+    with database.connection_context():
+        if args.command == 'upgrade':
+            for migration in upgrade(args.target):
+                print(f"已升级: {migration.version} {migration.description}")
+        elif args.command == 'downgrade':
+            for migration in downgrade(args.target):
+                print(f"已回退: {migration.version} {migration.description}")
+        version = current_version()
+        latest = MIGRATIONS[-1].version
+        print(f"当前版本: {version} (最新: {latest})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import base64
+import datetime
+import decimal
+import json
+
+from flask import current_app, request
+from peewee import CharField, TextField
+
+# 每页默认条数与上限 (可通过 app.config['PAGE_SIZE'] / ['MAX_PAGE_SIZE'] 覆盖)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Page:
+    """一页查询结果, 以及模板渲染分页/排序/筛选控件所需的状态。"""
+
+    def __init__(self, items, sort, order, filters, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.order = order
+        self.filters = filters
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def args(self, **overrides):
+        """生成保留当前排序/筛选条件的查询参数, 供 url_for 使用。"""
+        args = {'sort': self.sort, 'order': self.order, 'per_page': self.per_page}
+        args.update({key: value for key, value in self.filters.items() if value})
+        args.update(overrides)
+        return {key: value for key, value in args.items() if value is not None}
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([_encode_value(sort_value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标, 格式错误时返回 None (等同于从第一页开始)。"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _seek(field, pk, sort_value, row_id, forward):
+    # (field, id) 组合键上的 "大于/小于" 条件, 对应 ORDER BY field, id 的索引顺序
+    if forward:
+        return (field > sort_value) | ((field == sort_value) & (pk > row_id))
+    return (field < sort_value) | ((field == sort_value) & (pk < row_id))
+
+
+def _row_value(row, field):
+    # 直接读原始数据, 避免外键字段触发额外查询
+    return row.__data__.get(field.name)
+
+
+def paginate(query, sort_fields, filter_fields=None, default_sort='id', args=None):
+    """对 query 做键集 (seek) 分页, 并应用请求中的排序与列筛选。
+
+    sort_fields / filter_fields 为 {参数名: 模型字段} 的白名单, 只有其中的列才允许
+    排序或筛选。字符串列按前缀匹配 (可走索引), 其他列按等值匹配。
+    请求参数: sort, order (asc/desc), after / before (游标), per_page, 以及各筛选列。
+    """
+    args = request.args if args is None else args
+    filter_fields = filter_fields or {}
+    model = query.model
+    pk = model._meta.primary_key
+
+    config = current_app.config
+    max_size = config.get('MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    try:
+        per_page = int(args.get('per_page', config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)))
+    except (TypeError, ValueError):
+        per_page = config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    per_page = max(1, min(per_page, max_size))
+
+    sort = args.get('sort', default_sort)
+    if sort not in sort_fields:
+        sort = default_sort
+    field = sort_fields[sort]
+    order = 'desc' if args.get('order') == 'desc' else 'asc'
+    ascending = order == 'asc'
+
+    # --- 列筛选 ---
+    filters = {}
+    for key, filter_field in filter_fields.items():
+        value = (args.get(key) or '').strip()
+        filters[key] = value
+        if not value:
+            continue
+        if isinstance(filter_field, (CharField, TextField)):
+            query = query.where(filter_field.startswith(value))
+        else:
+            query = query.where(filter_field == value)
+
+    # --- 游标定位 ---
+    after = decode_cursor(args['after']) if args.get('after') else None
+    before = decode_cursor(args['before']) if args.get('before') else None
+    backward = before is not None and after is None
+    if after is not None:
+        query = query.where(_seek(field, pk, after[0], after[1], forward=ascending))
+    elif before is not None:
+        query = query.where(_seek(field, pk, before[0], before[1], forward=not ascending))
+
+    # 向前翻页时反向排序取数, 再在内存中翻转这一页
+    scan_ascending = ascending != backward
+    if field is pk:
+        ordering = [pk.asc() if scan_ascending else pk.desc()]
+    else:
+        ordering = [field.asc(), pk.asc()] if scan_ascending else [field.desc(), pk.desc()]
+
+    # 多取一行用于判断是否还有下一页
+    rows = list(query.order_by(*ordering).limit(per_page + 1))
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+
+    # 从后一页翻回来时必然还有下一页; 带 after 游标时必然还有上一页
+    has_next = True if backward else has_more
+    has_prev = has_more if backward else after is not None
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_next:
+            next_cursor = encode_cursor(_row_value(last, field), _row_value(last, pk))
+        if has_prev:
+            prev_cursor = encode_cursor(_row_value(first, field), _row_value(first, pk))
+
+    return Page(rows, sort, order, filters, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,295 @@
+import argparse
+import datetime
+import json
+
+from peewee import Case, EXCLUDED, JOIN, chunked, fn
+
+from applications.database.database import database, init_database, is_mysql, Supplier, Product, Purchase, \
+    QualityControl, Warehouse, StockMovement, GoodsReceipt
+from applications.database import summary, reorder
+from applications.database.bulk_import import MAX_REPORTED_ERRORS, _clean_purchase, _text, _int, _date
+from applications.database.stock import SOURCE_WAREHOUSE, lock_ledger
+
+# 收货: 一次提交整张采购单 (可达数千条明细) 的到货与质检结果, 在一个事务内写入采购记录与质检记录,
+# 合格数量按 (物资, 库位) 合并后以一条 UPDATE ... CASE 和批量 INSERT (唯一键冲突时累加) 记入仓库库存,
+# 语句数与明细条数基本无关
+
+# 质检结果 (与质检页面一致); 部分合格表示合格数量介于 0 与到货数量之间
+RESULT_ACCEPTED = '合格'
+RESULT_REJECTED = '不合格'
+RESULT_PARTIAL = '部分合格'
+# 单张收货单最多的明细条数 (app.config['RECEIVING_MAX_LINES'])
+DEFAULT_MAX_LINES = 5000
+# 每条 INSERT / UPDATE 语句处理的行数
+WRITE_BATCH_SIZE = 500
+
+
+class ReceivingError(ValueError):
+    """收货单无效, 没有写入任何数据。errors 为 [(明细序号 (从 0 开始, 表头为 None), 错误信息)]。"""
+
+    def __init__(self, errors):
+        super().__init__(errors[0][1])
+        self.errors = errors
+
+
+class ReceiptResult:
+    def __init__(self, receipt):
+        self.receipt = receipt
+        self.rejected = []  # 有不合格数量的明细
+        self.warehouse_created = 0  # 新建的库存记录数
+        self.warehouse_updated = 0  # 累加数量的库存记录数
+
+    def to_dict(self):
+        return {
+            'receipt_id': self.receipt.id,
+            'lines': self.receipt.line_count,
+            'accepted_quantity': self.receipt.accepted_quantity,
+            'rejected_quantity': self.receipt.rejected_quantity,
+            'warehouse_created': self.warehouse_created,
+            'warehouse_updated': self.warehouse_updated,
+            'rejected': self.rejected,
+        }
+
+
+# --- 校验 ---
+
+def _clean_header(order):
+    today = datetime.date.today().isoformat()
+    return {
+        'supplier': _int(order, 'supplier'),
+        'purchase_date': _date({'purchase_date': order.get('purchase_date') or today}, 'purchase_date'),
+        'received_date': _date({'received_date': order.get('received_date') or today}, 'received_date'),
+        'inspector': _text(order, 'inspector'),
+        'location': str(order.get('location') or '').strip(),
+    }
+
+
+def _clean_line(line, header):
+    """返回 (采购记录, 质检记录, 库位)。合格数量缺省时按质检结果推断: 合格为全部, 不合格为 0。"""
+    if not isinstance(line, dict):
+        raise ValueError('每条明细必须是 JSON 对象')
+    purchase = _clean_purchase({**line, 'supplier': header['supplier'], 'purchase_date': header['purchase_date']})
+    quantity = purchase['quantity']
+    if quantity <= 0:
+        raise ValueError('到货数量必须大于零')
+
+    result = str(line.get('result') or '').strip()
+    if line.get('accepted') not in (None, ''):
+        accepted = _int(line, 'accepted')
+        if not 0 <= accepted <= quantity:
+            raise ValueError('合格数量必须在 0 与到货数量之间')
+    elif result in ('', RESULT_ACCEPTED):
+        accepted = quantity
+    elif result == RESULT_REJECTED:
+        accepted = 0
+    else:
+        raise ValueError(f'质检结果为 {result} 时请填写合格数量 accepted')
+    if not result:
+        result = RESULT_ACCEPTED if accepted == quantity else RESULT_REJECTED if accepted == 0 else RESULT_PARTIAL
+
+    inspection = {'inspection_date': header['received_date'],
+                  'inspector': str(line.get('inspector') or '').strip() or header['inspector'],
+                  'result': result, 'accepted_quantity': accepted}
+    return purchase, inspection, str(line.get('location') or '').strip() or header['location']
+
+
+def _validate(order, max_lines):
+    """返回 (表头, [(采购记录, 质检记录, 库位)], {产品 ID: 名称}), 有任何错误时抛出 ReceivingError。"""
+    if not isinstance(order, dict):
+        raise ReceivingError([(None, '收货单必须是 JSON 对象')])
+    lines = order.get('lines')
+    if not isinstance(lines, list) or not lines:
+        raise ReceivingError([(None, '收货单必须包含 lines 数组')])
+    if len(lines) > max_lines:
+        raise ReceivingError([(None, f'单张收货单最多 {max_lines} 条明细')])
+    try:
+        header = _clean_header(order)
+    except ValueError as e:
+        raise ReceivingError([(None, str(e))])
+    if not Supplier.select().where(Supplier.id == header['supplier']).exists():
+        raise ReceivingError([(None, f"供应商 {header['supplier']} 不存在")])
+
+    errors, cleaned = [], {}
+    for index, line in enumerate(lines):
+        try:
+            cleaned[index] = _clean_line(line, header)
+        except ValueError as e:
+            errors.append((index, str(e)))
+
+    product_ids = {purchase['product'] for purchase, _, _ in cleaned.values()}
+    products = dict(Product.select(Product.id, Product.name).where(Product.id.in_(list(product_ids))).tuples())
+    errors += [(index, f"产品 {purchase['product']} 不存在")
+               for index, (purchase, _, _) in cleaned.items() if purchase['product'] not in products]
+    if errors:
+        raise ReceivingError(sorted(errors)[:MAX_REPORTED_ERRORS])
+    return header, list(cleaned.values()), products
+
+
+# --- 写入 ---
+
+def _upsert_warehouse(rows):
+    """批量新建库存记录, (物资名称, 库位) 已存在 (例如并发的收货刚刚建立) 时累加数量。"""
+    if is_mysql():
+        added = fn.VALUES(Warehouse.quantity)
+        conflict = {'update': {Warehouse.quantity: Warehouse.quantity + added}}
+    else:
+        conflict = {'conflict_target': [Warehouse.material_name, Warehouse.location],
+                    'update': {Warehouse.quantity: Warehouse.quantity + EXCLUDED.quantity}}
+    Warehouse.insert_many(rows).on_conflict(**conflict).execute()
+
+
+def _post_stock(accepted, date, user_id, result):
+    """合格数量记入仓库库存。accepted 为 {(物资名称, 库位): (产品 ID, 数量)}。
+
+    与逐条 stock.stock_in 的结果相同: 指定库位时累加到该库位的记录, 未指定时累加到该物资的第一条记录,
+    找不到时新建 (库位为空); 每条明细的 (物资, 库位) 写一条流水, 流水的库位与库存记录一致。
+    """
+    names = list({name for name, _ in accepted})
+    by_key, first = {}, {}  # {(名称, 库位): ID}, {名称: 第一条记录的库位}
+    for item_id, name, location in (Warehouse
+                                    .select(Warehouse.id, Warehouse.material_name, Warehouse.location)
+                                    .where(Warehouse.material_name.in_(names))
+                                    .order_by(Warehouse.id)
+                                    .tuples()):
+        by_key[(name, location)] = item_id
+        first.setdefault(name, location)
+
+    # 每个明细键对应的库存记录 (唯一键); 新物资同时有指定库位与未指定库位的明细时, 未指定的并入指定库位的新记录
+    # (与逐条入库的顺序无关)
+    targets = {}
+    for name, location in accepted:
+        if location:
+            targets[(name, location)] = (name, location)
+        elif name in first:
+            targets[(name, location)] = (name, first[name])
+        else:
+            targets[(name, location)] = next((key for key in accepted if key[0] == name and key[1]), (name, ''))
+    totals = {}  # {唯一键: [产品 ID, 数量]}
+    for key, (product_id, quantity) in accepted.items():
+        totals.setdefault(targets[key], [product_id, 0])[1] += quantity
+
+    deltas = sorted((by_key[key], quantity) for key, (_, quantity) in totals.items() if key in by_key)
+    new = [key for key in totals if key not in by_key]
+    for batch in chunked(deltas, WRITE_BATCH_SIZE):  # 按 ID 顺序加锁
+        (Warehouse
+         .update(quantity=Warehouse.quantity + Case(Warehouse.id, batch, 0))
+         .where(Warehouse.id.in_([item_id for item_id, _ in batch]))
+         .execute())
+    for batch in chunked(new, WRITE_BATCH_SIZE):
+        _upsert_warehouse([{'material_name': name, 'location': location, 'product': totals[(name, location)][0],
+                            'quantity': totals[(name, location)][1]}
+                           for name, location in batch])
+    item_ids = {key: by_key[key] for key in totals if key in by_key}
+    if new:
+        # 按唯一键回查新记录的 ID (本事务写入或累加过的行, 读取结果确定)
+        for item_id, name, location in (Warehouse
+                                        .select(Warehouse.id, Warehouse.material_name, Warehouse.location)
+                                        .where(Warehouse.material_name.in_(list({name for name, _ in new})))
+                                        .tuples()):
+            if (name, location) in totals:
+                item_ids[(name, location)] = item_id
+
+    movements = [{'source': SOURCE_WAREHOUSE, 'item_id': item_ids[targets[key]], 'material_name': key[0],
+                  'location': targets[key][1], 'operation': 'in', 'quantity': quantity, 'date': date,
+                  'user_id': user_id}
+                 for key, (_, quantity) in accepted.items()]
+    for batch in chunked(movements, WRITE_BATCH_SIZE):
+        StockMovement.insert_many(batch).execute()
+    reorder.evaluate_many(SOURCE_WAREHOUSE, names)
+    result.warehouse_created = len(new)
+    result.warehouse_updated = len(deltas)
+
+
+def receive(order, user_id=None, max_lines=DEFAULT_MAX_LINES):
+    """收货: 校验整张收货单后在一个事务内写入采购、质检与入库, 返回 ReceiptResult。
+
+    order 为 {supplier, inspector, purchase_date?, received_date?, location?, lines: [...]},
+    每条明细为 {product, quantity, unit_price 或 total_price, accepted?, result?, inspector?, location?}。
+    任一明细无效时抛出 ReceivingError (包含全部错误), 不写入任何数据; 不合格数量不入库, 在结果中列出。
+    """
+    header, lines, products = _validate(order, max_lines)
+    accepted_total = sum(inspection['accepted_quantity'] for _, inspection, _ in lines)
+    rejected_total = sum(purchase['quantity'] for purchase, _, _ in lines) - accepted_total
+
+    with database.atomic():
+        lock_ledger()  # 合格数量入库时写库存流水
+        receipt = GoodsReceipt.create(supplier=header['supplier'], received_date=header['received_date'],
+                                      inspector=header['inspector'], line_count=len(lines),
+                                      accepted_quantity=accepted_total, rejected_quantity=rejected_total,
+                                      user_id=user_id)
+        result = ReceiptResult(receipt)
+
+        # 采购记录按明细顺序插入, 回查时按 ID 排序即与明细一一对应
+        for batch in chunked(lines, WRITE_BATCH_SIZE):
+            Purchase.insert_many([{**purchase, 'receipt_id': receipt.id} for purchase, _, _ in batch]).execute()
+        purchase_ids = [pk for pk, in (Purchase
+                                       .select(Purchase.id)
+                                       .where(Purchase.receipt_id == receipt.id)
+                                       .order_by(Purchase.id)
+                                       .tuples())]
+        for batch in chunked(zip(purchase_ids, lines), WRITE_BATCH_SIZE):
+            QualityControl.insert_many([{**inspection, 'purchase': purchase_id}
+                                        for purchase_id, (_, inspection, _) in batch]).execute()
+
+        totals, accepted = {}, {}
+        for index, (purchase_id, (purchase, inspection, location)) in enumerate(zip(purchase_ids, lines)):
+            product_id = purchase['product']
+            count, quantity, amount = totals.get(product_id, (0, 0, 0))
+            totals[product_id] = (count + 1, quantity + purchase['quantity'], amount + purchase['total_price'])
+
+            passed = inspection['accepted_quantity']
+            if passed:
+                key = (products[product_id], location)
+                accepted[key] = (product_id, accepted.get(key, (None, 0))[1] + passed)
+            if passed < purchase['quantity']:
+                result.rejected.append({
+                    'line': index,
+                    'purchase_id': purchase_id,
+                    'product': product_id,
+                    'material_name': products[product_id],
+                    'quantity': purchase['quantity'],
+                    'accepted': passed,
+                    'rejected': purchase['quantity'] - passed,
+                    'result': inspection['result'],
+                })
+        summary.record_purchases(totals)
+        if accepted:
+            _post_stock(accepted, header['received_date'], user_id, result)
+    return result
+
+
+def receipt_lines(receipt_id):
+    """收货单的明细 (采购记录, 含产品名称, 质检记录为 inspection 属性), 按明细顺序。"""
+    return (Purchase
+            .select(Purchase, Product.id, Product.name, QualityControl)
+            .join(Product)
+            .switch(Purchase)
+            .join(QualityControl, JOIN.LEFT_OUTER, on=(QualityControl.purchase == Purchase.id), attr='inspection')
+            .where(Purchase.receipt_id == receipt_id)
+            .order_by(Purchase.id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按 JSON 文件收货 (采购、质检、入库一次完成)')
+    parser.add_argument('path', help='收货单 JSON 文件')
+    args = parser.parse_args()
+
+    init_database()
+    with open(args.path, encoding='utf-8-sig') as f:
+        order = json.load(f)
+    with database.connection_context():
+        try:
+            result = receive(order)
+        except ReceivingError as e:
+            for index, message in e.errors:
+                print(message if index is None else f'第 {index + 1} 条明细: {message}')
+            raise SystemExit(1)
+
+    print(f"收货单 {result.receipt.id}: 明细 {result.receipt.line_count} 条, "
+          f"合格 {result.receipt.accepted_quantity}, 不合格 {result.receipt.rejected_quantity}")
+    for line in result.rejected:
+        print(f"第 {line['line'] + 1} 条明细 {line['material_name']}: 不合格 {line['rejected']} ({line['result']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import datetime
+import math
+
+from peewee import IntegrityError, fn
+
+from applications.database.database import database, Supplies, Warehouse, StockMovement, ReorderRule, StockAlert
+from applications.database.stock import SOURCE_WAREHOUSE, SOURCE_SUPPLIES
+
+# 补货提醒: 每次出入库后只检查被修改的物资 (evaluate), 低于补货点的物资保存在 StockAlert 中,
+# 提醒列表只读取这张表, 与库存表的大小无关
+
+# 建议采购量按最近该天数的日均出库量估算 (app.config['REORDER_LOOKBACK_DAYS'])
+DEFAULT_LOOKBACK_DAYS = 30
+
+# {变动对象: (库存模型, 名称列)}
+SOURCES = {
+    SOURCE_WAREHOUSE: (Warehouse, Warehouse.material_name),
+    SOURCE_SUPPLIES: (Supplies, Supplies.name),
+}
+
+
+def on_hand(source, material_name):
+    """同名库存记录 (不同库位或规格) 的合计数量。"""
+    model, name_field = SOURCES[source]
+    return model.select(fn.COALESCE(fn.SUM(model.quantity), 0)).where(name_field == material_name).scalar()
+
+
+def evaluate(source, material_name):
+    """重新检查一种物资是否低于补货点, 并增删提醒。返回是否低于补货点。
+
+    出入库写入后在同一事务内调用; 没有设置补货点的物资只执行一条查询。
+    """
+    rule = ReorderRule.get_or_none(ReorderRule.source == source, ReorderRule.material_name == material_name)
+    if rule is None:
+        return False
+    key = (StockAlert.source == source) & (StockAlert.material_name == material_name)
+    quantity = on_hand(source, material_name)
+    if quantity >= rule.reorder_point:
+        StockAlert.delete().where(key).execute()
+        return False
+
+    now = datetime.datetime.now()
+    updated = (StockAlert
+               .update(quantity=quantity, reorder_point=rule.reorder_point, updated_at=now)
+               .where(key)
+               .execute())
+    if not updated:
+        try:
+            with database.atomic():
+                StockAlert.create(source=source, material_name=material_name, quantity=quantity,
+                                  reorder_point=rule.reorder_point, created_at=now, updated_at=now)
+        except IntegrityError:  # 并发的出入库已经插入
+            StockAlert.update(quantity=quantity, updated_at=now).where(key).execute()
+    return True
+
+
+def evaluate_many(source, material_names):
+    """批量出入库后调用: 一条查询找出其中设置了补货点的物资, 只重新检查这些物资。"""
+    names = list(set(material_names))
+    if not names:
+        return
+    ruled = [name for name, in (ReorderRule
+                                .select(ReorderRule.material_name)
+                                .where(ReorderRule.source == source, ReorderRule.material_name.in_(names))
+                                .tuples())]
+    for material_name in ruled:
+        evaluate(source, material_name)
+
+
+def set_rule(source, material_name, reorder_point, reorder_quantity=0, lead_time_days=7):
+    """新增或修改补货点, 并立即检查该物资。"""
+    if source not in SOURCES:
+        raise ValueError(f'未知的库存类型: {source}')
+    if not material_name:
+        raise ValueError('请填写物资名称')
+    if reorder_point < 0 or reorder_quantity < 0 or lead_time_days < 0:
+        raise ValueError('补货点、最小采购量与提前期不能为负数')
+    with database.atomic():
+        values = {'reorder_point': reorder_point, 'reorder_quantity': reorder_quantity,
+                  'lead_time_days': lead_time_days}
+        updated = (ReorderRule
+                   .update(values)
+                   .where(ReorderRule.source == source, ReorderRule.material_name == material_name)
+                   .execute())
+        if not updated:
+            ReorderRule.create(source=source, material_name=material_name, **values)
+        return evaluate(source, material_name)
+
+
+def delete_rule(source, material_name):
+    with database.atomic():
+        ReorderRule.delete().where(ReorderRule.source == source, ReorderRule.material_name == material_name).execute()
+        StockAlert.delete().where(StockAlert.source == source, StockAlert.material_name == material_name).execute()
+
+
+def rebuild_alerts():
+    """按全部补货点重新检查 (只读取设置了补货点的物资), 用于上线时或库存被直接修改后校正。"""
+    with database.atomic():
+        StockAlert.delete().execute()
+        for rule in ReorderRule.select():
+            evaluate(rule.source, rule.material_name)
+
+
+def _consumption(alerts, since):
+    """{(变动对象, 名称): since 以来的出库总量}, 一条 GROUP BY 查询, 使用 (material_name, created_at) 索引。"""
+    names = {alert.material_name for alert in alerts}
+    if not names:
+        return {}
+    query = (StockMovement
+             .select(StockMovement.source, StockMovement.material_name, fn.SUM(StockMovement.quantity))
+             .where(StockMovement.material_name.in_(list(names)),
+                    StockMovement.created_at >= since,
+                    StockMovement.quantity < 0)
+             .group_by(StockMovement.source, StockMovement.material_name)
+             .tuples())
+    return {(source, name): -int(total) for source, name, total in query}
+
+
+def get_alerts(sources=None, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """当前低于补货点的物资及建议采购量, 缺口大的排在前面。
+
+    建议采购量 = 补到补货点的数量 + 采购提前期内按日均出库量估算的消耗, 且不少于最小采购量。
+    """
+    query = StockAlert.select()
+    if sources is not None:
+        query = query.where(StockAlert.source.in_(list(sources)))
+    alerts = list(query)
+    if not alerts:
+        return []
+    rules = {(rule.source, rule.material_name): rule
+             for rule in ReorderRule.select().where(ReorderRule.material_name.in_([a.material_name for a in alerts]))}
+    consumed = _consumption(alerts, datetime.datetime.now() - datetime.timedelta(days=lookback_days))
+
+    results = []
+    for alert in alerts:
+        rule = rules.get((alert.source, alert.material_name))
+        daily = consumed.get((alert.source, alert.material_name), 0) / max(lookback_days, 1)
+        lead_time = rule.lead_time_days if rule else 0
+        suggested = alert.reorder_point - alert.quantity + math.ceil(daily * lead_time)
+        results.append({
+            'source': alert.source,
+            'material_name': alert.material_name,
+            'quantity': alert.quantity,
+            'reorder_point': alert.reorder_point,
+            'daily_consumption': round(daily, 2),
+            'suggested_quantity': max(suggested, rule.reorder_quantity if rule else 0),
+            'since': alert.created_at,
+        })
+    results.sort(key=lambda row: row['quantity'] - row['reorder_point'])
+    return results
@@ -0,0 +1,318 @@
+import argparse
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from peewee import fn, DatabaseError, InterfaceError
+
+from applications.database.database import TableVersion, create_database
+
+# 读写分离: 列表页、报表、导出与搜索在 reading() 范围内执行, 其中事务外的 SELECT 发往只读副本,
+# 写入、事务内的查询以及写入之后的查询仍使用主库。副本定期检查延迟, 延迟过大或出错时回退到主库
+
+# 副本延迟超过该秒数时不再使用 (app.config['REPLICA_MAX_LAG'])
+DEFAULT_MAX_LAG = 5.0
+# 检查副本状态与延迟的间隔秒数 (app.config['REPLICA_CHECK_INTERVAL'])
+DEFAULT_CHECK_INTERVAL = 5.0
+# 用户写入后该秒数内的读取都使用主库, 保证能读到自己的写入 (app.config['REPLICA_STICKY_SECONDS'])
+DEFAULT_STICKY_SECONDS = 10.0
+# 会话中记录 "读取主库截止时间" 的键
+STICKY_KEY = '_primary_until'
+
+_READ_SQL = re.compile(r'\s*(?:SELECT|WITH)\b', re.IGNORECASE)
+_WRITE_SQL = re.compile(r'\s*(?:INSERT|REPLACE|UPDATE|DELETE|CREATE|ALTER|DROP|TRUNCATE)\b', re.IGNORECASE)
+
+
+class Replica:
+    def __init__(self, name, db):
+        self.name = name
+        self.db = db
+        self.healthy = False  # 第一次检查前不使用
+        self.lag = None  # 秒, 无法获取时为 None
+        self.error = None
+        self.queries = 0
+        self.failures = 0
+
+
+class Router:
+    """包装主库的 execute_sql, 在 reading() 范围内把查询改由副本执行。"""
+
+    def __init__(self):
+        self.primary = None
+        self.replicas = []
+        self.max_lag = DEFAULT_MAX_LAG
+        self.check_interval = DEFAULT_CHECK_INTERVAL
+        self.sticky_seconds = DEFAULT_STICKY_SECONDS
+        self._local = threading.local()  # depth: reading() 嵌套层数, replica: 本次使用的副本, wrote: 是否写入过
+        self._checked_at = float('-inf')
+        self._check_lock = threading.Lock()
+        self._next = 0
+
+    def configure(self, primary, replicas, max_lag=DEFAULT_MAX_LAG, check_interval=DEFAULT_CHECK_INTERVAL,
+                  sticky_seconds=DEFAULT_STICKY_SECONDS):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self._checked_at = float('-inf')
+        self._local = threading.local()
+        self._wrap(primary)
+
+    def _wrap(self, db):
+        if getattr(db, '_replicas_routed', False):
+            return
+        execute_sql = db.execute_sql
+
+        def routing_execute_sql(sql, params=None, *args, **kwargs):
+            state = self._local
+            if _WRITE_SQL.match(sql):
+                state.wrote = True  # 之后的读取都使用主库 (读到本次写入)
+                return execute_sql(sql, params, *args, **kwargs)
+            replica = getattr(state, 'replica', None)
+            if (replica is not None and _READ_SQL.match(sql) and not getattr(state, 'wrote', False)
+                    and not db.in_transaction()):
+                try:
+                    cursor = replica.db.execute_sql(sql, params, *args, **kwargs)
+                except (DatabaseError, InterfaceError) as e:
+                    self._mark_down(replica, e)
+                    state.replica = None  # 本次剩余的查询改用主库
+                else:
+                    replica.queries += 1
+                    return cursor
+            return execute_sql(sql, params, *args, **kwargs)
+
+        db.execute_sql = routing_execute_sql
+        db._replicas_routed = True
+
+    def _mark_down(self, replica, error):
+        replica.healthy = False
+        replica.error = str(error)
+        replica.failures += 1
+        if not replica.db.is_closed():
+            replica.db.close()
+
+    def _last_write(self, db):
+        # 各表最后写入时间的最大值, 副本与主库的差即为复制延迟的上界
+        return TableVersion.select(fn.MAX(TableVersion.updated_at)).bind(db).scalar()
+
+    def check(self):
+        """检查各副本是否可用并估计延迟。
+
+        延迟 = 主库最后一次写入的时间 - 副本上最后一次写入的时间。写入稀疏时这是高估 (副本只差一条写入也按
+        两次写入的间隔计), 因此只会更早地回退到主库, 不会读到超过 max_lag 的旧数据。
+        """
+        self._checked_at = time.monotonic()
+        primary_time = self._last_write(self.primary)
+        for replica in self.replicas:
+            try:
+                replica_time = self._last_write(replica.db)
+            except (DatabaseError, InterfaceError) as e:
+                self._mark_down(replica, e)
+                continue
+            if primary_time is None or (replica_time is not None and replica_time >= primary_time):
+                replica.lag = 0.0
+            elif replica_time is None:
+                replica.lag = None
+            else:
+                replica.lag = (primary_time - replica_time).total_seconds()
+            replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+            replica.error = None if replica.healthy else f'复制延迟过大: {replica.lag}'
+
+    def choose(self):
+        """返回一个可用的副本 (轮流使用), 都不可用时返回 None。到检查间隔时由一个线程执行检查。"""
+        if not self.replicas:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval and self._check_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._checked_at >= self.check_interval:
+                    self.check()
+            except (DatabaseError, InterfaceError):
+                pass  # 主库不可用时查询本身也会失败, 这里不处理
+            finally:
+                self._check_lock.release()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next]
+
+    @contextmanager
+    def reading(self):
+        """范围内事务外的查询由副本执行 (可嵌套, 同一范围内固定使用一个副本)。"""
+        state = self._local
+        depth = getattr(state, 'depth', 0)
+        if depth == 0:
+            state.replica = self.choose()
+        state.depth = depth + 1
+        try:
+            yield state.replica
+        finally:
+            state.depth = depth
+            if depth == 0:
+                state.replica = None
+
+    def read_database(self):
+        """当前范围内读取使用的数据库对象, 供直接使用游标的代码 (如流式导出) 选择连接。"""
+        state = self._local
+        replica = getattr(state, 'replica', None)
+        if replica is None or getattr(state, 'wrote', False) or self.primary.in_transaction():
+            return self.primary
+        replica.queries += 1
+        return replica.db
+
+    @contextmanager
+    def use_primary(self):
+        """范围内的查询改回主库, 用于读取后会放入进程缓存、被其他请求共用的数据。"""
+        state = self._local
+        replica = getattr(state, 'replica', None)
+        state.replica = None
+        try:
+            yield
+        finally:
+            state.replica = replica
+
+    def start(self):
+        """请求开始时调用, 清除上一个请求的写入标记。"""
+        self._local.wrote = False
+
+    def wrote(self):
+        return getattr(self._local, 'wrote', False)
+
+    def close(self):
+        """归还本线程打开的副本连接。"""
+        for replica in self.replicas:
+            if not replica.db.is_closed():
+                replica.db.close()
+
+
+ROUTER = Router()
+
+
+def reading():
+    return ROUTER.reading()
+
+
+def use_primary():
+    return ROUTER.use_primary()
+
+
+def read_database():
+    return ROUTER.read_database()
+
+
+def _replica_config(config, entry):
+    """副本的配置: 在主库配置上替换数据库文件 (sqlite) 或主机与端口 (mysql), entry 也可以是配置字典。"""
+    replica = dict(config)
+    if isinstance(entry, dict):
+        replica.update(entry)
+    elif config.get('DATABASE_ENGINE', 'mysql') == 'sqlite':
+        replica['DATABASE_NAME'] = entry
+    else:
+        host, _, port = entry.partition(':')
+        replica['DATABASE'] = {**config['DATABASE'], 'host': host, 'port': int(port or config['DATABASE']['port'])}
+    return replica
+
+
+def configure(primary, config):
+    """按配置创建副本的数据库对象 (不会立即连接) 并包装主库。没有配置副本时所有查询照常使用主库。"""
+    replicas = [Replica(entry if isinstance(entry, str) else str(index), create_database(_replica_config(config, entry)))
+                for index, entry in enumerate(config.get('DATABASE_REPLICAS') or ())]
+    ROUTER.configure(primary, replicas,
+                     max_lag=config.get('REPLICA_MAX_LAG', DEFAULT_MAX_LAG),
+                     check_interval=config.get('REPLICA_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL),
+                     sticky_seconds=config.get('REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS))
+
+
+def _use_replica():
+    from flask import request, session
+
+    if request.method not in ('GET', 'HEAD') or not ROUTER.replicas:
+        return False
+    return session.get(STICKY_KEY, 0) <= time.time()
+
+
+def read_replica(f):
+    """视图装饰器: GET 请求的查询由副本执行。用户最近写入过数据时仍使用主库。"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not _use_replica():
+            return f(*args, **kwargs)
+        with reading():
+            return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def stream(iterable):
+    """流式响应在视图返回后才执行查询, 用它包装生成器使查询同样由副本执行 (需配合 stream_with_context)。"""
+    if not _use_replica():
+        yield from iterable
+        return
+    with reading():
+        yield from iterable
+
+
+def _metric_lines():
+    lines = ['# HELP inventory_db_replica_healthy 副本是否可用',
+             '# TYPE inventory_db_replica_healthy gauge']
+    lines += [f'inventory_db_replica_healthy{{replica="{r.name}"}} {int(r.healthy)}' for r in ROUTER.replicas]
+    lines += ['# HELP inventory_db_replica_lag_seconds 副本复制延迟的估计值',
+              '# TYPE inventory_db_replica_lag_seconds gauge']
+    lines += [f'inventory_db_replica_lag_seconds{{replica="{r.name}"}} {r.lag}'
+              for r in ROUTER.replicas if r.lag is not None]
+    lines += ['# HELP inventory_db_replica_queries_total 由副本执行的查询条数',
+              '# TYPE inventory_db_replica_queries_total counter']
+    lines += [f'inventory_db_replica_queries_total{{replica="{r.name}"}} {r.queries}' for r in ROUTER.replicas]
+    lines += ['# HELP inventory_db_replica_failures_total 副本查询或检查失败次数',
+              '# TYPE inventory_db_replica_failures_total counter']
+    lines += [f'inventory_db_replica_failures_total{{replica="{r.name}"}} {r.failures}' for r in ROUTER.replicas]
+    return lines
+
+
+def init_app(app):
+    """请求开始时清除写入标记, 写入过的用户在 sticky 秒内读取主库, 请求结束时归还副本连接。"""
+    from flask import session
+    from applications.monitoring.metrics import register_collector
+
+    @app.before_request
+    def start():
+        ROUTER.start()
+
+    @app.after_request
+    def remember_write(response):
+        if ROUTER.replicas and ROUTER.wrote():
+            session[STICKY_KEY] = time.time() + ROUTER.sticky_seconds
+        return response
+
+    @app.teardown_request
+    def close_replicas(exception):
+        ROUTER.close()
+
+    if ROUTER.replicas:
+        register_collector(_metric_lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查只读副本的状态与复制延迟')
+    parser.parse_args()
+
+    from applications.database.database import database, init_database
+    from applications.database.replicas import ROUTER as router  # 以 -m 运行时本模块为 __main__, 需使用包内的实例
+    init_database()
+    if not router.replicas:
+        print('未配置只读副本 (INVENTORY_DB_REPLICAS)')
+        return
+    with database.connection_context():
+        router.check()
+    for replica in router.replicas:
+        status = '可用' if replica.healthy else f'不可用 ({replica.error})'
+        print(f'{replica.name}\t{status}\t延迟 {replica.lag} 秒')
+    router.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+import bisect
+import threading
+import time
+import unicodedata
+from array import array
+from urllib.parse import urlencode
+
+from applications.database.database import Supplies, Product, Warehouse, on_change
+from applications.database.versions import get_versions
+
+# 物资搜索: 进程内的 n-gram 倒排索引 (单字 + 二元组), 支持中文的前缀与子串匹配
+# 名称/规格只在新增行时写入 (数量变化不影响索引), 因此按表版本检测到写入后只需加载 id 更大的新行;
+# 通过模型 save()/delete_instance() 的修改由 on_change 回调立即更新, 其余修改由定期全量重建兜底
+
+# 每隔该秒数检查一次表版本 (app.config['SEARCH_REFRESH_INTERVAL'])
+DEFAULT_REFRESH_INTERVAL = 1.0
+# 全量重建的间隔 (秒), 用于纳入 UPDATE/DELETE 等未经模型实例的修改 (app.config['SEARCH_REBUILD_INTERVAL'])
+DEFAULT_REBUILD_INTERVAL = 3600
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# 建索引时每次读取的行数
+FETCH_SIZE = 10000
+
+# 多个字段拼接成一个字符串保存, 用查询中不会出现的字符分隔, 避免跨字段匹配
+_SEPARATOR = '\x00'
+
+
+def normalize(text):
+    """全角转半角、统一大小写, 使 "ＭＳ８" 与 "ms8" 可以互相匹配。"""
+    return unicodedata.normalize('NFKC', text or '').casefold().replace(_SEPARATOR, '').strip()
+
+
+# 前缀倒排表的键前缀: _PREFIX + 第一个字段的前 1~2 个字符
+_PREFIX = '\x01'
+
+
+def _grams(text):
+    parts = text.split(_SEPARATOR)
+    grams = {_PREFIX + parts[0][:1], _PREFIX + parts[0][:2]}
+    for part in parts:
+        grams.update(part)
+        grams.update(part[i:i + 2] for i in range(len(part) - 1))
+    return grams
+
+
+class NgramIndex:
+    """单个表的倒排索引: {n-gram: 有序的主键数组}。
+
+    前缀匹配的候选取第一个字段开头字符的倒排表, 子串匹配的候选取查询各 n-gram 中最短的倒排表,
+    再用保存的文本校验, 因此结果没有误报; 两者都在凑满 limit 条后停止扫描。
+    """
+
+    def __init__(self, name, model, fields, permission, url):
+        self.name = name
+        self.model = model
+        self.fields = fields  # 参与搜索的字段, 第一个字段用于前缀匹配排序
+        self.permission = permission  # 搜索该表所需的权限
+        self.url = url  # (row) -> 结果链接
+        self.rebuild_interval = DEFAULT_REBUILD_INTERVAL
+        self._texts = {}  # {主键: 规范化后的文本}
+        self._postings = {}  # {n-gram: array('q')}
+        self._max_id = 0
+        self._version = None
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    @property
+    def table(self):
+        return self.model._meta.table_name
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _text(self, values):
+        return _SEPARATOR.join(normalize(value) for value in values)
+
+    def _add(self, pk, text):
+        self._texts[pk] = text
+        for gram in _grams(text):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('q')
+            if not postings or postings[-1] < pk:
+                postings.append(pk)  # 新行主键递增, 绝大多数情况下直接追加
+            else:
+                position = bisect.bisect_left(postings, pk)
+                if position == len(postings) or postings[position] != pk:
+                    postings.insert(position, pk)
+        self._max_id = max(self._max_id, pk)
+
+    def _remove(self, pk):
+        text = self._texts.pop(pk, None)
+        if text is None:
+            return
+        for gram in _grams(text):
+            postings = self._postings[gram]
+            position = bisect.bisect_left(postings, pk)
+            if position < len(postings) and postings[position] == pk:
+                del postings[position]
+            if not postings:
+                del self._postings[gram]
+
+    def _load(self, after=0):
+        primary_key = self.model._meta.primary_key
+        columns = [primary_key] + [getattr(self.model, field) for field in self.fields]
+        while True:
+            rows = list(self.model
+                        .select(*columns)
+                        .where(primary_key > after)
+                        .order_by(primary_key)
+                        .limit(FETCH_SIZE)
+                        .tuples())
+            for pk, *values in rows:
+                if pk in self._texts:
+                    self._remove(pk)
+                self._add(pk, self._text(values))
+            if len(rows) < FETCH_SIZE:
+                return
+            after = rows[-1][0]
+
+    def rebuild(self, version=None):
+        with self._lock:
+            self._texts, self._postings, self._max_id = {}, {}, 0
+            self._load()
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def refresh(self, version):
+        """表版本变化后调用: 加载新增的行, 距上次全量重建超过 rebuild_interval 时重建。"""
+        with self._lock:
+            if version == self._version:
+                return
+            if self._built_at is None or time.monotonic() - self._built_at > self.rebuild_interval:
+                self.rebuild(version)
+                return
+            self._load(self._max_id)
+            self._version = version
+
+    def update(self, instance):
+        """on_change 回调: 按实例更新单行, instance 为 None (批量写入) 时下次检查版本时全量重建。"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            if instance is None:
+                self._built_at = 0.0
+                self._version = None
+                return
+            pk = instance.get_id()
+            self._remove(pk)
+            if self.model.select().where(self.model._meta.primary_key == pk).exists():
+                self._add(pk, self._text(getattr(instance, field) for field in self.fields))
+
+    def search(self, query, limit):
+        """返回匹配的主键列表: 第一个字段以 query 开头的排在前面, 其余按主键顺序。"""
+        query = normalize(query)
+        if not query:
+            return []
+        grams = [query] if len(query) == 1 else [query[i:i + 2] for i in range(len(query) - 1)]
+        with self._lock:
+            postings = [self._postings.get(gram) for gram in grams]
+            if not all(postings):
+                return []
+            texts = self._texts
+            candidates = min(postings, key=len)
+            prefix = []
+            for pk in min(self._postings.get(_PREFIX + query[:2], ()), candidates, key=len):
+                if texts[pk].startswith(query):
+                    prefix.append(pk)
+                    if len(prefix) >= limit:
+                        return prefix
+            seen = set(prefix)
+            substring = []
+            for pk in candidates:
+                if pk not in seen and query in texts[pk]:
+                    substring.append(pk)
+                    if len(prefix) + len(substring) >= limit:
+                        break
+        return prefix + substring
+
+
+# 结果链接指向列表页并带上前缀筛选参数
+INDEXES = {
+    'supplies': NgramIndex(
+        'supplies', Supplies, ('name', 'specification'), 'can_manage_supplies',
+        lambda row: '/manage_supplies?' + urlencode({'name': row.name, 'specification': row.specification})),
+    'products': NgramIndex(
+        'products', Product, ('name',), 'can_manage_products',
+        lambda row: '/manage_products?' + urlencode({'name': row.name})),
+    'warehouse': NgramIndex(
+        'warehouse', Warehouse, ('material_name',), 'can_manage_warehouses',
+        lambda row: '/warehouse_management?' + urlencode({'material_name': row.material_name})),
+}
+
+# Product 通过 save() 的写入立即更新索引 (Supplies / Warehouse 的名称不会被修改, 新增行按版本加载)
+on_change(Product, INDEXES['products'].update)
+
+_refresh_interval = DEFAULT_REFRESH_INTERVAL
+_checked_at = {}
+_check_lock = threading.Lock()
+
+
+def _refresh(indexes):
+    now = time.monotonic()
+    with _check_lock:
+        stale = [index for index in indexes
+                 if now - _checked_at.get(index.name, float('-inf')) >= _refresh_interval]
+        for index in stale:
+            _checked_at[index.name] = now
+    if not stale:
+        return
+    versions = get_versions([index.table for index in stale])
+    for index in stale:
+        index.refresh(versions[index.table][0])
+
+
+def _describe(name, row):
+    if name == 'supplies':
+        return {'name': row.name, 'specification': row.specification, 'quantity': row.quantity}
+    if name == 'products':
+        return {'name': row.name, 'unit': row.unit, 'price': str(row.price)}
+    return {'name': row.material_name, 'location': row.location, 'quantity': row.quantity}
+
+
+def search(query, names=None, limit=DEFAULT_LIMIT):
+    """在 names 指定的表 (默认全部) 中搜索, 返回结果字典列表, 每张表最多 limit 条。
+
+    每张有结果的表再执行一条按主键的 IN 查询读取展示字段; 已被删除的行不会出现在结果中。
+    """
+    indexes = [INDEXES[name] for name in (names or INDEXES)]
+    _refresh(indexes)
+    normalized = normalize(query)
+    results = []
+    for index in indexes:
+        ids = index.search(normalized, limit)
+        if not ids:
+            continue
+        rows = {row.get_id(): row for row in index.model.select().where(index.model._meta.primary_key.in_(ids))}
+        for pk in ids:
+            row = rows.get(pk)
+            if row is None:
+                continue
+            results.append({'source': index.name, 'id': pk, 'url': index.url(row), **_describe(index.name, row)})
+    return results
+
+
+def init_app(app):
+    global _refresh_interval
+    _refresh_interval = app.config.get('SEARCH_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+    for index in INDEXES.values():
+        index.rebuild_interval = app.config.get('SEARCH_REBUILD_INTERVAL', DEFAULT_REBUILD_INTERVAL)
@@ -0,0 +1,136 @@
+from peewee import IntegrityError
+
+from applications.database.database import database, is_mysql, Supplies, Warehouse, Product, StockMovement, AppLock
+from applications.database import summary
+
+# 流水中的变动对象
+SOURCE_WAREHOUSE = 'warehouse'
+SOURCE_SUPPLIES = 'supplies'
+# 写库存流水的事务与建检查点之间的锁行 (AppLock.name)
+LEDGER_LOCK = 'stock_ledger'
+
+
+class StockError(Exception):
+    """库存操作无法完成 (库存不足、找不到记录等), 消息可直接展示给用户。"""
+
+
+def lock_ledger(exclusive=False):
+    """对流水锁行加锁, 直到当前事务结束。
+
+    写流水的事务在开始处 (加任何行锁之前) 加共享锁, 相互之间不冲突; 建检查点时加排他锁, 等待进行中的写入
+    全部提交, 此时的最大流水 ID 以下不再有未提交的流水。MySQL 的自增 ID 在插入时分配、提交顺序不定, 因此需要
+    这把锁; SQLite 同一时刻只有一个写事务, 已提交的最大 ID 以下不会再出现新流水, 不需要加锁。
+    """
+    if is_mysql():
+        query = AppLock.select(AppLock.name).where(AppLock.name == LEDGER_LOCK)
+        list(query.for_update(True if exclusive else 'LOCK IN SHARE MODE'))
+
+
+def _record(source, item_id, material_name, quantity, location=None, date=None, user_id=None):
+    StockMovement.create(
+        source=source,
+        item_id=item_id,
+        material_name=material_name,
+        location=location,
+        operation='in' if quantity >= 0 else 'out',
+        quantity=quantity,
+        date=date,
+        user_id=user_id
+    )
+
+
+def _check_reorder(source, material_name):
+    from applications.database import reorder  # reorder 引用本模块的 SOURCE_* 常量, 在此延迟导入
+
+    reorder.evaluate(source, material_name)
+
+
+def _warehouse_item(material_name, location=None):
+    """返回 (ID, 库位), 找不到时返回 None。指定库位时为该库位的记录, 未指定时为该物资 ID 最小的记录。"""
+    # 只读取 ID, 数量的增减交给条件 UPDATE 在数据库内原子完成
+    query = Warehouse.select(Warehouse.id, Warehouse.location).where(Warehouse.material_name == material_name)
+    if location:
+        query = query.where(Warehouse.location == location)
+    return query.order_by(Warehouse.id).limit(1).tuples().first()
+
+
+def _add_or_create(model, key, quantity, **defaults):
+    """对 key (唯一键的字段值) 对应的记录做 quantity = quantity + n, 不存在时新建。返回 (记录 ID, 是否新建)。
+
+    并发的首次写入由唯一键保证只建一行: 插入冲突时退回 UPDATE。调用方应处于 database.atomic() 事务中。
+    """
+    where = [getattr(model, name) == value for name, value in key.items()]
+    item_id = model.select(model.id).where(*where).limit(1).scalar()
+    if item_id is not None:
+        model.update(quantity=model.quantity + quantity).where(model.id == item_id).execute()
+        return item_id, False
+    try:
+        with database.atomic():
+            return model.create(**key, **defaults, quantity=quantity).id, True
+    except IntegrityError:
+        pass
+    # 冲突的行由并发事务提交: 按唯一键 UPDATE (当前读, 能看到该行), 被本事务修改过的行随后的 SELECT 也能读到
+    model.update(quantity=model.quantity + quantity).where(*where).execute()
+    return model.select(model.id).where(*where).limit(1).scalar(), False
+
+
+def stock_in(material_name, quantity, location=None, date=None, user_id=None):
+    """入库: quantity = quantity + n, 库存记录不存在时新建。返回库存记录 ID。"""
+    if quantity <= 0:
+        raise StockError('入库数量必须大于零！')
+    with database.atomic():
+        lock_ledger()
+        found = _warehouse_item(material_name, location)
+        if found is not None:
+            item_id, location = found
+            (Warehouse
+             .update(quantity=Warehouse.quantity + quantity)
+             .where(Warehouse.id == item_id)
+             .execute())
+        else:
+            product = Product.get_or_none(Product.name == material_name)
+            if product is None:
+                raise StockError('没有找到对应的产品，请先在产品管理中添加！')
+            location = location or ''
+            item_id, _ = _add_or_create(Warehouse, {'material_name': material_name, 'location': location}, quantity,
+                                        product=product)
+        _record(SOURCE_WAREHOUSE, item_id, material_name, quantity, location, date, user_id)
+        _check_reorder(SOURCE_WAREHOUSE, material_name)
+    return item_id
+
+
+def stock_out(material_name, quantity, location=None, date=None, user_id=None):
+    """出库: quantity = quantity - n WHERE quantity >= n, 库存不足时不做任何修改。返回库存记录 ID。"""
+    if quantity <= 0:
+        raise StockError('出库数量必须大于零！')
+    with database.atomic():
+        lock_ledger()
+        found = _warehouse_item(material_name, location)
+        if found is None:
+            raise StockError('没有找到对应的库存记录！')
+        item_id, location = found
+        updated = (Warehouse
+                   .update(quantity=Warehouse.quantity - quantity)
+                   .where((Warehouse.id == item_id) & (Warehouse.quantity >= quantity))
+                   .execute())
+        if not updated:
+            raise StockError('出库数量超过库存！')
+        _record(SOURCE_WAREHOUSE, item_id, material_name, -quantity, location, date, user_id)
+        _check_reorder(SOURCE_WAREHOUSE, material_name)
+    return item_id
+
+
+def add_supplies(name, specification, quantity, user_id=None):
+    """增加物资数量, 相同名称和规格的物资已存在时累加, 否则新建。
+
+    返回 True 表示累加到了已有物资, False 表示新建。
+    """
+    if quantity <= 0:
+        raise StockError('数量必须大于零！')
+    with database.atomic():
+        lock_ledger()
+        item_id, created = _add_or_create(Supplies, {'name': name, 'specification': specification}, quantity)
+        _record(SOURCE_SUPPLIES, item_id, name, quantity, user_id=user_id)
+        summary.record_supplies_change(quantity)
+        _check_reorder(SOURCE_SUPPLIES, name)
+    return not created
@@ -0,0 +1,298 @@
+import argparse
+import datetime
+
+from peewee import fn
+
+from applications.database.database import database, init_database, Supplies, Warehouse, StockMovement, \
+    StockCheckpoint, StockSnapshot
+from applications.database.stock import SOURCE_WAREHOUSE, SOURCE_SUPPLIES, lock_ledger
+
+# 按时间点查询库存: 从离该时间点最近的检查点出发, 只累加 (或扣减) 两者之间的一段流水, 不重放全部历史
+# 检查点恰好包含 ID 不超过 last_movement_id 的流水; 时间点 t 之前的流水按记录时间 (created_at <= t) 判断,
+# 不假设 ID 顺序与记录时间一致 (MySQL 的自增 ID 在插入时分配, 提交顺序不定)
+
+# 距最新检查点的流水超过该条数时应新建检查点 (app.config['STOCK_CHECKPOINT_MOVEMENTS'])
+DEFAULT_CHECKPOINT_MOVEMENTS = 10000
+# 建检查点时每次读取/写入的行数, 以及 IN 查询每次携带的 ID 数
+BATCH_SIZE = 1000
+
+# {变动对象: (库存模型, 名称列, 库位列)}
+SOURCES = {
+    SOURCE_WAREHOUSE: (Warehouse, Warehouse.material_name, Warehouse.location),
+    SOURCE_SUPPLIES: (Supplies, Supplies.name, None),
+}
+
+
+def _chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _iter_items(source):
+    """按主键分批读取 (ID, 名称, 库位, 数量), 避免一次载入整张库存表。"""
+    model, name_field, location_field = SOURCES[source]
+    columns = [model.id, name_field, model.quantity] + ([location_field] if location_field else [])
+    after = 0
+    while True:
+        rows = list(model.select(*columns).where(model.id > after).order_by(model.id).limit(BATCH_SIZE).tuples())
+        for row in rows:
+            yield row[0], row[1], row[3] if location_field else None, row[2]
+        if len(rows) < BATCH_SIZE:
+            return
+        after = rows[-1][0]
+
+
+def _iter_snapshot(checkpoint_id, source):
+    """按记录 ID 分批读取检查点中的 (ID, 名称, 库位, 数量)。"""
+    after = -1
+    while True:
+        rows = list(StockSnapshot
+                    .select(StockSnapshot.item_id, StockSnapshot.material_name, StockSnapshot.location,
+                            StockSnapshot.quantity)
+                    .where(StockSnapshot.checkpoint == checkpoint_id, StockSnapshot.source == source,
+                           StockSnapshot.item_id > after)
+                    .order_by(StockSnapshot.item_id)
+                    .limit(BATCH_SIZE)
+                    .tuples())
+        yield from rows
+        if len(rows) < BATCH_SIZE:
+            return
+        after = rows[-1][0]
+
+
+class _SnapshotWriter:
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.count = 0
+        self._batch = []
+
+    def add(self, source, item_id, name, location, quantity):
+        self._batch.append({'checkpoint': self.checkpoint.id, 'source': source, 'item_id': item_id,
+                            'material_name': name, 'location': location, 'quantity': quantity})
+        if len(self._batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            StockSnapshot.insert_many(self._batch).execute()
+            self.count += len(self._batch)
+            self._batch = []
+
+
+def latest_checkpoint():
+    return StockCheckpoint.select().order_by(StockCheckpoint.last_movement_id.desc()).first()
+
+
+def _watermark():
+    """返回一个流水 ID, 不超过它的流水均已提交, 之后也不会再出现。
+
+    对流水锁行加排他锁, 等待进行中的写入提交后读取最大 ID, 随即提交释放, 出入库只在这一瞬间等待。
+    """
+    with database.atomic():
+        lock_ledger(exclusive=True)
+        return StockMovement.select(fn.MAX(StockMovement.id)).scalar() or 0
+
+
+def _movements_until(low, high):
+    return (StockMovement
+            .select(fn.MAX(StockMovement.created_at))
+            .where(StockMovement.id > low, StockMovement.id <= high)
+            .scalar())
+
+
+def take_checkpoint():
+    """新建检查点, 返回 StockCheckpoint。
+
+    由上一个检查点的快照加上两者之间的流水 (上一个检查点的 last_movement_id, 本次的水位] 得出, 不读取当前库存,
+    因此与进行中的写入无关。没有检查点时 (首次) 读取当前库存: 整个过程持有流水锁的排他锁, 期间出入库等待。
+    """
+    previous = latest_checkpoint()
+    if previous is None:
+        return _take_first_checkpoint()
+
+    last_id = _watermark()
+    with database.atomic():
+        until = _movements_until(previous.last_movement_id, last_id)
+        checkpoint = StockCheckpoint.create(last_movement_id=last_id,
+                                            movements_until=max(filter(None, (previous.movements_until, until)),
+                                                                default=None))
+        writer = _SnapshotWriter(checkpoint)
+        for source in SOURCES:
+            deltas = dict(StockMovement
+                          .select(StockMovement.item_id, fn.SUM(StockMovement.quantity))
+                          .where(StockMovement.source == source,
+                                 StockMovement.id > previous.last_movement_id,
+                                 StockMovement.id <= last_id)
+                          .group_by(StockMovement.item_id)
+                          .tuples())
+            for item_id, name, location, quantity in _iter_snapshot(previous.id, source):
+                writer.add(source, item_id, name, location, quantity + int(deltas.pop(item_id, 0)))
+            # 上一个检查点之后新建的库存记录; 名称与库位在记录创建后不会改变, 从当前表读取
+            for batch in _chunks(sorted(deltas)):
+                items = _find_items(source, item_ids=batch)
+                for item_id in batch:
+                    name, location = items.get(item_id, ('', None))
+                    writer.add(source, item_id, name, location, int(deltas[item_id]))
+        writer.flush()
+        checkpoint.item_count = writer.count
+        checkpoint.save()
+    return checkpoint
+
+
+def _take_first_checkpoint():
+    with database.atomic():
+        lock_ledger(exclusive=True)
+        last_id = StockMovement.select(fn.MAX(StockMovement.id)).scalar() or 0
+        checkpoint = StockCheckpoint.create(last_movement_id=last_id, movements_until=_movements_until(0, last_id))
+        writer = _SnapshotWriter(checkpoint)
+        for source in SOURCES:
+            for item_id, name, location, quantity in _iter_items(source):
+                writer.add(source, item_id, name, location, quantity)
+        writer.flush()
+        checkpoint.item_count = writer.count
+        checkpoint.save()
+    return checkpoint
+
+
+def pending_movements():
+    """返回最新检查点之后的流水条数 (没有检查点时为全部流水条数)。"""
+    last_id = StockMovement.select(fn.MAX(StockMovement.id)).scalar() or 0
+    checkpointed = StockCheckpoint.select(fn.MAX(StockCheckpoint.last_movement_id)).scalar() or 0
+    return last_id - checkpointed
+
+
+def nearest_checkpoint(at):
+    """返回建立时间离 at 最近的检查点 (可能在它之前或之后), 没有检查点时返回 None。"""
+    before = (StockCheckpoint
+              .select()
+              .where(StockCheckpoint.taken_at <= at)
+              .order_by(StockCheckpoint.taken_at.desc())
+              .first())
+    after = (StockCheckpoint
+             .select()
+             .where(StockCheckpoint.taken_at > at)
+             .order_by(StockCheckpoint.taken_at)
+             .first())
+    candidates = [checkpoint for checkpoint in (before, after) if checkpoint is not None]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda checkpoint: abs(checkpoint.taken_at - at))
+
+
+def _find_items(source, material_name=None, location=None, item_id=None, item_ids=None):
+    """按条件查找库存记录, 返回 {ID: (名称, 库位)}。名称与库位在记录创建后不会改变, 因此可以用当前表筛选。"""
+    model, name_field, location_field = SOURCES[source]
+    if location and location_field is None:
+        raise ValueError('物资没有库位, 不能按库位查询')
+    query = model.select(model.id, name_field, *([location_field] if location_field else []))
+    if material_name:
+        query = query.where(name_field == material_name)
+    if location:
+        query = query.where(location_field == location)
+    if item_id is not None:
+        query = query.where(model.id == item_id)
+    if item_ids is not None:
+        query = query.where(model.id.in_(item_ids))
+    return {row[0]: (row[1], row[2] if location_field else None) for row in query.tuples()}
+
+
+def stock_at(at, source=SOURCE_WAREHOUSE, material_name=None, location=None, item_id=None):
+    """返回时间点 at 各库存记录的数量。
+
+    读取最近检查点中匹配记录的数量, 加上检查点之后、记录时间不晚于 at 的流水, 减去检查点包含的、记录时间晚于 at
+    的流水。返回字典, movements 为参与汇总的流水条数。
+    """
+    if source not in SOURCES:
+        raise ValueError(f'未知的库存类型: {source}')
+    if not (material_name or location or item_id is not None):
+        raise ValueError('请指定物资名称、库位或库存记录 ID')
+
+    items = _find_items(source, material_name, location, item_id)
+    checkpoint = nearest_checkpoint(at)
+    quantities = dict.fromkeys(items, 0)
+    last_id = checkpoint.last_movement_id if checkpoint is not None else 0
+    # 两个范围分别汇总, 各自可用 (source, item_id, created_at) 索引
+    ranges = [((StockMovement.id > last_id) & (StockMovement.created_at <= at), 1)]
+    if checkpoint is not None and checkpoint.movements_until is not None and checkpoint.movements_until > at:
+        # 检查点包含的流水记录时间都不晚于 movements_until, 以此限定需要扣减的范围
+        ranges.append(((StockMovement.id <= last_id) & (StockMovement.created_at > at)
+                       & (StockMovement.created_at <= checkpoint.movements_until), -1))
+
+    scanned = 0
+    ids = list(items)
+    for batch in _chunks(ids):
+        if checkpoint is not None:
+            snapshot = (StockSnapshot
+                        .select(StockSnapshot.item_id, StockSnapshot.quantity)
+                        .where(StockSnapshot.checkpoint == checkpoint.id,
+                               StockSnapshot.source == source,
+                               StockSnapshot.item_id.in_(batch))
+                        .tuples())
+            quantities.update(snapshot)
+        for condition, sign in ranges:
+            deltas = (StockMovement
+                      .select(StockMovement.item_id, fn.SUM(StockMovement.quantity), fn.COUNT(StockMovement.id))
+                      .where(StockMovement.source == source, StockMovement.item_id.in_(batch), condition)
+                      .group_by(StockMovement.item_id)
+                      .tuples())
+            for pk, total, count in deltas:
+                quantities[pk] += sign * int(total)
+                scanned += count
+
+    rows = [{'item_id': pk, 'material_name': items[pk][0], 'location': items[pk][1], 'quantity': quantities[pk]}
+            for pk in sorted(items)]
+    return {
+        'at': at,
+        'source': source,
+        'checkpoint': None if checkpoint is None else {
+            'id': checkpoint.id,
+            'taken_at': checkpoint.taken_at,
+            'last_movement_id': checkpoint.last_movement_id,
+        },
+        'movements': scanned,
+        'items': rows,
+        'total': sum(row['quantity'] for row in rows),
+    }
+
+
+def parse_time(value):
+    """解析 ISO 格式的时间点; 只有日期时表示当天结束 (例如月末盘点)。"""
+    try:
+        if len(value) == 10:
+            return datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time.max)
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'无效的时间: {value}, 应为 YYYY-MM-DD 或 YYYY-MM-DDTHH:MM:SS')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='库存检查点与按时间点查询库存')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    checkpoint_parser = subparsers.add_parser('checkpoint', help='新建检查点 (可由 cron 定期执行)')
+    checkpoint_parser.add_argument('--min-movements', type=int, default=0,
+                                   help='距最新检查点的流水少于该条数时跳过')
+    at_parser = subparsers.add_parser('at', help='查询某一时间点的库存')
+    at_parser.add_argument('time', help='YYYY-MM-DD (当天结束) 或 YYYY-MM-DDTHH:MM:SS')
+    at_parser.add_argument('--source', choices=sorted(SOURCES), default=SOURCE_WAREHOUSE)
+    at_parser.add_argument('--material')
+    at_parser.add_argument('--location')
+    args = parser.parse_args()
+
+    init_database()
+    with database.connection_context():
+        if args.command == 'checkpoint':
+            pending = pending_movements()
+            if pending < args.min_movements:
+                print(f'距最新检查点只有 {pending} 条流水, 跳过')
+                return
+            checkpoint = take_checkpoint()
+            print(f'已新建检查点 {checkpoint.id}: {checkpoint.item_count} 项库存, 流水 ID {checkpoint.last_movement_id}')
+        else:
+            result = stock_at(parse_time(args.time), args.source, args.material, args.location)
+            for row in result['items']:
+                print(f"{row['item_id']}\t{row['material_name']}\t{row['location'] or ''}\t{row['quantity']}")
+            print(f"合计 {result['total']} (汇总流水 {result['movements']} 条)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+import datetime
+import random
+from decimal import Decimal
+
+from peewee import Case, IntegrityError, fn
+
+from applications.database.database import database, init_database, Supplies, Purchase, Finance, Product, \
+    SummaryTotal, PurchaseSummary, FinanceSummary, FinanceRollup
+
+# 汇总项名称
+SUPPLIES_QUANTITY = 'supplies_quantity'
+# 频繁累加的汇总项分散到多个计数行 (名称:序号), 每次写入随机累加其中一行, 读取时求和,
+# 避免所有写入事务排队等待同一行的行锁。只能调大, 调小后序号超出范围的行不再被读取
+SUMMARY_SLOTS = 16
+
+# 财务时间序列的粒度
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+PERIODS = (DAY, WEEK, MONTH)
+# 收入与支出的类型值 (与财务管理表单一致)
+INCOME = 'income'
+EXPENSE = 'expense'
+# 单次时间序列查询最多返回的区间数
+MAX_SERIES_POINTS = 5000
+
+
+def _increment(model, key, **deltas):
+    """对汇总行做 "value = value + delta" 的原子累加, 行不存在时插入。
+
+    先 UPDATE 再 INSERT, 同时兼容 MySQL 与 SQLite; 并发插入冲突时退回 UPDATE。
+    调用方应处于与业务写入相同的 database.atomic() 事务中。
+    """
+    where = [getattr(model, name) == value for name, value in key.items()]
+    updates = {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items()}
+    if model.update(updates).where(*where).execute():
+        return
+    try:
+        with database.atomic():
+            model.create(**key, **deltas)
+    except IntegrityError:
+        model.update(updates).where(*where).execute()
+
+
+# --- 增量维护 ---
+
+def _slot_names(name):
+    return [name] + [f'{name}:{slot}' for slot in range(SUMMARY_SLOTS)]
+
+
+def record_supplies_change(quantity_delta):
+    """物资数量变化 (新增或累加) 后调用。"""
+    if quantity_delta:
+        slot = f'{SUPPLIES_QUANTITY}:{random.randrange(SUMMARY_SLOTS)}'
+        _increment(SummaryTotal, {'name': slot}, value=quantity_delta)
+
+
+def record_purchase(product_id, quantity, total_price, count=1):
+    """新增采购记录后调用。批量写入时可一次传入合计值与条数。"""
+    _increment(PurchaseSummary, {'product': product_id},
+               purchase_count=count, total_quantity=quantity, total_amount=total_price)
+
+
+def record_purchases(totals):
+    """批量新增采购记录后调用, totals 为 {产品 ID: (条数, 数量, 金额)}。
+
+    已有的汇总行用一条 UPDATE ... CASE 累加, 其余一条 INSERT; 并发插入冲突时逐个退回 record_purchase。
+    """
+    product_ids = sorted(totals)
+    existing = [pk for pk, in (PurchaseSummary
+                               .select(PurchaseSummary.product)
+                               .where(PurchaseSummary.product.in_(product_ids))
+                               .order_by(PurchaseSummary.product)
+                               .tuples())]
+    if existing:
+        def delta(index):
+            return Case(PurchaseSummary.product, [(pk, totals[pk][index]) for pk in existing], 0)
+
+        (PurchaseSummary
+         .update(purchase_count=PurchaseSummary.purchase_count + delta(0),
+                 total_quantity=PurchaseSummary.total_quantity + delta(1),
+                 total_amount=PurchaseSummary.total_amount + delta(2))
+         .where(PurchaseSummary.product.in_(existing))
+         .execute())
+    missing = [pk for pk in product_ids if pk not in set(existing)]
+    if not missing:
+        return
+    try:
+        with database.atomic():
+            PurchaseSummary.insert_many([{'product': pk, 'purchase_count': totals[pk][0],
+                                          'total_quantity': totals[pk][1], 'total_amount': totals[pk][2]}
+                                         for pk in missing]).execute()
+    except IntegrityError:
+        for pk in missing:
+            count, quantity, amount = totals[pk]
+            record_purchase(pk, quantity, amount, count=count)
+
+
+def as_date(value):
+    """表单与导入文件中的日期可能是字符串。"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def period_start(period, date):
+    """date 所在区间的第一天: 当天 / 所在周的周一 / 所在月的 1 日。"""
+    if period == DAY:
+        return date
+    if period == WEEK:
+        return date - datetime.timedelta(days=date.weekday())
+    if period == MONTH:
+        return date.replace(day=1)
+    raise ValueError(f'未知的统计粒度: {period}')
+
+
+def record_finance(transaction_type, amount, count=1, date=None):
+    """新增财务记录后调用。给出 date 时同时累加日/周/月汇总。"""
+    _increment(FinanceSummary, {'type': transaction_type}, record_count=count, total_amount=amount)
+    if date is not None:
+        date = as_date(date)
+        for period in PERIODS:
+            _increment(FinanceRollup, {'period': period, 'period_start': period_start(period, date),
+                                       'type': transaction_type},
+                       record_count=count, total_amount=amount)
+
+
+def record_finance_rows(rows):
+    """批量写入财务记录后调用, rows 为含 type / amount / date 的字典。先在内存中按汇总键合并再累加。"""
+    totals, rollups = {}, {}
+    for row in rows:
+        for bucket, key in [(totals, row['type'])] + [
+                (rollups, (period, period_start(period, as_date(row['date'])), row['type']))
+                for period in PERIODS if row.get('date')]:
+            count, amount = bucket.get(key, (0, 0))
+            bucket[key] = (count + 1, amount + row['amount'])
+    for transaction_type, (count, amount) in totals.items():
+        _increment(FinanceSummary, {'type': transaction_type}, record_count=count, total_amount=amount)
+    for (period, start, transaction_type), (count, amount) in rollups.items():
+        _increment(FinanceRollup, {'period': period, 'period_start': start, 'type': transaction_type},
+                   record_count=count, total_amount=amount)
+
+
+# --- 全量重建 ---
+
+def rebuild_summaries():
+    """用 GROUP BY 聚合从明细表重建所有汇总表。
+
+    用于首次上线时填充汇总表, 或在怀疑汇总与明细不一致时校正。
+    """
+    with database.atomic():
+        SummaryTotal.delete().execute()
+        PurchaseSummary.delete().execute()
+        FinanceSummary.delete().execute()
+
+        supplies_quantity = Supplies.select(fn.COALESCE(fn.SUM(Supplies.quantity), 0)).scalar()
+        SummaryTotal.create(name=SUPPLIES_QUANTITY, value=supplies_quantity)
+
+        PurchaseSummary.insert_from(
+            Purchase.select(Purchase.product,
+                            fn.COUNT(Purchase.id),
+                            fn.SUM(Purchase.quantity),
+                            fn.SUM(Purchase.total_price))
+            .group_by(Purchase.product),
+            [PurchaseSummary.product, PurchaseSummary.purchase_count,
+             PurchaseSummary.total_quantity, PurchaseSummary.total_amount]).execute()
+
+        FinanceSummary.insert_from(
+            Finance.select(Finance.type, fn.COUNT(Finance.id), fn.SUM(Finance.amount))
+            .group_by(Finance.type),
+            [FinanceSummary.type, FinanceSummary.record_count, FinanceSummary.total_amount]).execute()
+
+        rebuild_finance_rollups()
+
+
+def rebuild_finance_rollups():
+    """按日 GROUP BY 聚合财务明细, 再在内存中合并出周/月汇总 (日期函数在 MySQL 与 SQLite 间不通用)。"""
+    with database.atomic():
+        FinanceRollup.delete().execute()
+        rollups = {}
+        daily = (Finance
+                 .select(Finance.date, Finance.type, fn.COUNT(Finance.id), fn.SUM(Finance.amount))
+                 .where(Finance.date.is_null(False))
+                 .group_by(Finance.date, Finance.type)
+                 .tuples())
+        for date, transaction_type, count, amount in daily:
+            date = as_date(date)
+            for period in PERIODS:
+                key = (period, period_start(period, date), transaction_type)
+                total_count, total_amount = rollups.get(key, (0, 0))
+                rollups[key] = (total_count + count, total_amount + _decimal(amount))
+        rows = [{'period': period, 'period_start': start, 'type': transaction_type,
+                 'record_count': count, 'total_amount': amount}
+                for (period, start, transaction_type), (count, amount) in rollups.items()]
+        for offset in range(0, len(rows), 1000):
+            FinanceRollup.insert_many(rows[offset:offset + 1000]).execute()
+
+
+# --- 报表读取 ---
+
+def get_total(name):
+    """汇总项的值: 全量重建写入的行与各计数行之和。"""
+    total = (SummaryTotal
+             .select(fn.SUM(SummaryTotal.value))
+             .where(SummaryTotal.name.in_(_slot_names(name)))
+             .scalar())
+    return _decimal(total)
+
+
+def get_purchase_breakdown():
+    """按物资统计的采购次数、总量与总金额, 字段与 report.html 对应。"""
+    return (PurchaseSummary
+            .select(Product.name.alias('material_name'),
+                    PurchaseSummary.purchase_count,
+                    PurchaseSummary.total_quantity,
+                    PurchaseSummary.total_amount)
+            .join(Product)
+            .order_by(PurchaseSummary.total_amount.desc())
+            .dicts())
+
+
+def get_finance_totals():
+    """返回 {类型: 总金额}。"""
+    return {row.type: row.total_amount for row in FinanceSummary.select()}
+
+
+def _decimal(value):
+    # SUM 的结果在 SQLite 中是浮点数
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def _next_period(period, start):
+    if period == DAY:
+        return start + datetime.timedelta(days=1)
+    if period == WEEK:
+        return start + datetime.timedelta(days=7)
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _finance_result(by_type, count):
+    income = by_type.get(INCOME, _decimal(0))
+    expense = by_type.get(EXPENSE, _decimal(0))
+    return {'income': income, 'expense': expense, 'net': income - expense, 'count': count, 'by_type': by_type}
+
+
+def get_finance_range(start, end):
+    """start ~ end (含) 之间的收入、支出与净额。
+
+    完整月份读取月汇总, 首尾不足一个月的部分读取日汇总, 只执行一条查询, 与明细表的行数无关。
+    """
+    if start > end:
+        raise ValueError('开始日期不能晚于结束日期')
+    first_month = start if start.day == 1 else _next_period(MONTH, start.replace(day=1))
+    last_month = period_start(MONTH, end)
+    if _next_period(MONTH, last_month) - datetime.timedelta(days=1) != end:
+        last_month = period_start(MONTH, last_month - datetime.timedelta(days=1))  # end 所在月不完整
+    if first_month <= last_month:
+        months_end = _next_period(MONTH, last_month)
+        condition = (((FinanceRollup.period == MONTH)
+                      & FinanceRollup.period_start.between(first_month, last_month))
+                     | ((FinanceRollup.period == DAY)
+                        & (FinanceRollup.period_start.between(start, first_month - datetime.timedelta(days=1))
+                           | FinanceRollup.period_start.between(months_end, end))))
+    else:
+        condition = (FinanceRollup.period == DAY) & FinanceRollup.period_start.between(start, end)
+
+    by_type, count = {}, 0
+    query = (FinanceRollup
+             .select(FinanceRollup.type, fn.SUM(FinanceRollup.record_count), fn.SUM(FinanceRollup.total_amount))
+             .where(condition)
+             .group_by(FinanceRollup.type)
+             .tuples())
+    for transaction_type, records, amount in query:
+        by_type[transaction_type] = _decimal(amount)
+        count += int(records)
+    return _finance_result(by_type, count)
+
+
+def get_finance_series(period, start, end):
+    """start ~ end 之间按 period 划分的收支序列, 没有记录的区间补零。"""
+    if period not in PERIODS:
+        raise ValueError(f'未知的统计粒度: {period}')
+    if start > end:
+        raise ValueError('开始日期不能晚于结束日期')
+    first = period_start(period, start)
+    points = {}
+    bucket = first
+    while bucket <= end:
+        points[bucket] = {}
+        if len(points) > MAX_SERIES_POINTS:
+            raise ValueError(f'区间过多 (最多 {MAX_SERIES_POINTS} 个), 请缩小范围或改用更大的粒度')
+        bucket = _next_period(period, bucket)
+
+    counts = dict.fromkeys(points, 0)
+    query = (FinanceRollup
+             .select(FinanceRollup.period_start, FinanceRollup.type, FinanceRollup.record_count,
+                     FinanceRollup.total_amount)
+             .where(FinanceRollup.period == period, FinanceRollup.period_start.between(first, end))
+             .tuples())
+    for bucket, transaction_type, records, amount in query:
+        bucket = as_date(bucket)
+        points[bucket][transaction_type] = _decimal(amount)
+        counts[bucket] += records
+    return [{'period_start': bucket, **_finance_result(by_type, counts[bucket])} for bucket, by_type in points.items()]
+
+
+# 报表页使用的模型 (用于 HTTP 缓存与后台任务的去重)
+REPORT_MODELS = (Supplies, SummaryTotal, PurchaseSummary, Product, FinanceSummary, FinanceRollup)
+# 报表中按月收支显示的月数
+REPORT_MONTHS = 12
+
+
+def report_date():
+    """报表按月收支的截止日期 (当天); 报表页缓存以此区分, 跨日后重新渲染。"""
+    return datetime.date.today()
+
+
+def report_context(supplies_limit=None):
+    """report.html 的模板变量。supplies_limit 为物资明细最多显示的条数, None 表示全部。"""
+    supplies_data = Supplies.select().order_by(Supplies.quantity.desc())
+    if supplies_limit:
+        supplies_data = supplies_data.limit(supplies_limit)
+    total_supplies_value = get_total(SUPPLIES_QUANTITY)  # 假设价值等同于数量，你需要根据实际情况修改
+
+    purchase_data = list(get_purchase_breakdown())
+    total_purchase_amount = sum(row['total_amount'] for row in purchase_data)
+
+    finance_totals = get_finance_totals()
+    total_income = finance_totals.get(INCOME, 0)
+    total_expenses = finance_totals.get(EXPENSE, 0)
+    today = report_date()
+    first_month = today.replace(day=1)
+    for _ in range(REPORT_MONTHS - 1):
+        first_month = period_start(MONTH, first_month - datetime.timedelta(days=1))
+    return {
+        'monthly_finance': get_finance_series(MONTH, first_month, today),
+        'supplies_data': supplies_data,
+        'total_supplies_value': total_supplies_value,
+        'purchase_data': purchase_data,
+        'total_purchase_amount': total_purchase_amount,
+        'total_income': total_income,
+        'total_expenses': total_expenses,
+        'net_profit': total_income - total_expenses,
+    }
+
+
+if __name__ == '__main__':
+    init_database()
+    with database.connection_context():
+        rebuild_summaries()
+    print("汇总表已重建。")
@@ -0,0 +1,69 @@
+import datetime
+import functools
+import re
+
+from applications.database.database import database, after_commit, TableVersion
+
+# 从 peewee 生成的写语句中取出表名, 例如 INSERT INTO "purchase" / UPDATE `warehouse` / DELETE FROM "finance"
+_WRITE_SQL = re.compile(r'\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+[`"]?(\w+)[`"]?',
+                        re.IGNORECASE)
+# 不记录版本的表 (版本表自身、迁移记录、后台任务状态与审计日志, 后两者写入频繁且没有页面依赖它们)
+UNTRACKED = {'table_version', 'schema_version', 'job', 'audit_log'}
+
+# table_version 已由迁移创建; 只记住肯定的结果, 进程在迁移之前启动时之后的写入会重新检查
+_enabled = False
+
+
+def reset():
+    """迁移创建或删除 table_version 后调用, 下次写入时重新检查。"""
+    global _enabled
+    _enabled = False
+
+
+def _is_enabled():
+    global _enabled
+    if not _enabled:
+        _enabled = TableVersion._meta.table_name in database.get_tables()
+    return _enabled
+
+
+def bump(table):
+    """递增 table 的版本 (单独的自动提交语句)。"""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+    updated = (TableVersion
+               .update(version=TableVersion.version + 1, updated_at=now)
+               .where(TableVersion.name == table)
+               .execute())
+    if not updated:
+        TableVersion.insert(name=table, version=1, updated_at=now).on_conflict_ignore().execute()
+
+
+def track(db):
+    """包装数据库对象的 execute_sql, 写语句所在的事务提交后递增对应表的版本, 每张表每个事务一次。
+
+    版本行不在写入的事务内更新, 否则同一张表的所有写入事务都要排队等待这一行的行锁直到提交。
+    提交后递增失败 (或进程在此时退出) 只会让依赖该表的缓存等到过期才更新。
+    """
+    if getattr(db, '_versions_tracked', False):
+        return
+    execute_sql = db.execute_sql
+
+    def tracking_execute_sql(sql, params=None, *args, **kwargs):
+        cursor = execute_sql(sql, params, *args, **kwargs)
+        match = _WRITE_SQL.match(sql)
+        if match and match.group(1) not in UNTRACKED and _is_enabled():
+            table = match.group(1)
+            after_commit(functools.partial(bump, table), key=('table_version', table))
+        return cursor
+
+    db.execute_sql = tracking_execute_sql
+    db._versions_tracked = True
+
+
+def get_versions(tables):
+    """返回 {表名: (版本号, 最后写入时间)}, 从未写入过的表为 (0, None)。只执行一条查询。"""
+    versions = {table: (0, None) for table in tables}
+    query = TableVersion.select().where(TableVersion.name.in_(list(tables)))
+    for row in query:
+        versions[row.name] = (row.version, row.updated_at)
+    return versions
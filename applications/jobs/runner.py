@@ -0,0 +1,279 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from peewee import fn, IntegrityError, DatabaseError, InterfaceError
+
+from applications.database import audit
+from applications.database.database import database, Job
+from applications.database.versions import get_versions
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ACTIVE = (PENDING, RUNNING)
+
+# 默认工作线程数 (app.config['JOB_WORKERS'])
+DEFAULT_WORKERS = 2
+# 进度写回数据库的最小间隔 (秒)
+PROGRESS_INTERVAL = 0.5
+# 任务结束后保留结果文件的天数 (app.config['JOB_RETENTION_DAYS'])
+DEFAULT_RETENTION_DAYS = 7
+# 上传待导入文件的文件名前缀
+UPLOAD_PREFIX = 'upload-'
+# 执行中的任务每隔该秒数更新一次心跳; 心跳超过 STALE_HEARTBEAT_SECONDS 未更新的任务视为所在进程已退出,
+# 恢复时标记为失败 (仍在执行的任务不受影响, 与执行时长无关)
+HEARTBEAT_INTERVAL = 30
+STALE_HEARTBEAT_SECONDS = 300
+# 提交时与并发提交的相同任务冲突后重新查找的次数
+SUBMIT_ATTEMPTS = 3
+
+
+class Task:
+    def __init__(self, kind, handler, models=(), reuse_result=True):
+        self.kind = kind
+        self.handler = handler  # handler(context, params) -> 结果摘要
+        self.models = models  # 结果依赖的模型 (或按参数返回模型的函数), 数据未变时复用已完成的结果
+        self.reuse_result = reuse_result
+
+    def tables(self, params):
+        models = self.models(params) if callable(self.models) else self.models
+        return [model._meta.table_name for model in models]
+
+
+# {任务类型: Task}
+TASKS = {}
+
+
+def task(kind, models=(), reuse_result=True):
+    """注册任务处理函数。models 中任一表被写入后, 相同参数的请求会重新计算。"""
+
+    def decorator(handler):
+        TASKS[kind] = Task(kind, handler, models, reuse_result)
+        return handler
+
+    return decorator
+
+
+class JobContext:
+    """传给任务处理函数, 用于汇报进度与写结果文件。"""
+
+    def __init__(self, job, result_dir):
+        self.job = job
+        self.result_dir = result_dir
+        self._progress = 0
+        self._reported_at = 0.0
+
+    def progress(self, percent, message=None):
+        percent = max(0, min(99, int(percent)))  # 100 只在任务完成时写入
+        now = time.monotonic()
+        if percent == self._progress or now - self._reported_at < PROGRESS_INTERVAL:
+            return
+        self._progress = percent
+        self._reported_at = now
+        updates = {Job.progress: percent}
+        if message is not None:
+            updates[Job.message] = message
+        Job.update(updates).where(Job.id == self.job.id).execute()
+
+    def result_file(self, filename, content_type, mode='w'):
+        """打开结果文件用于写入, 下载时以 filename 为文件名。"""
+        self.job.result_path = os.path.join(self.result_dir, f'{self.job.id}-{filename}')
+        self.job.content_type = content_type
+        self.job.filename = filename
+        if 'b' in mode:
+            return open(self.job.result_path, mode)
+        return open(self.job.result_path, mode, encoding='utf-8', newline='')
+
+
+def _now():
+    return datetime.datetime.now()
+
+
+class JobRunner:
+    """进程内的任务执行器: 任务持久化在 Job 表, 由线程池执行, 不依赖外部消息队列。
+
+    多个进程共用同一数据库时, 通过条件 UPDATE 认领任务, 同一任务只会被执行一次; 相同的未完成任务
+    由 Job.active_key 的唯一索引保证只有一个。
+    """
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, result_dir=None, retention_days=DEFAULT_RETENTION_DAYS):
+        self.app = app
+        self.result_dir = result_dir or os.path.join(tempfile.gettempdir(), 'inventory-jobs')
+        self.retention_days = retention_days
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._recovered = False
+        self._running = set()  # 本进程正在执行的任务 ID, 由心跳线程定期更新 heartbeat_at
+        self._heartbeat_thread = None
+        self._heartbeat_pid = None
+
+    def dedup_key(self, task, params):
+        tables = task.tables(params)
+        versions = get_versions(tables) if tables else {}
+        payload = json.dumps([task.kind, params, sorted((name, version) for name, (version, _) in versions.items())],
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def submit(self, kind, params, permission, user_id=None):
+        """提交任务, 返回 (job, 是否新建)。已有相同的未完成任务 (或数据未变的已完成任务) 时直接返回它。"""
+        if kind not in TASKS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        task = TASKS[kind]
+        if not self._recovered:
+            self.recover()
+        key = self.dedup_key(task, params)
+
+        for _ in range(SUBMIT_ATTEMPTS):
+            existing = (Job
+                        .select()
+                        .where(Job.active_key == key)
+                        .first())
+            if existing is None and task.reuse_result:
+                existing = (Job
+                            .select()
+                            .where(Job.dedup_key == key, Job.status == DONE)
+                            .order_by(Job.id.desc())
+                            .first())
+                if existing is not None and not os.path.exists(existing.result_path or ''):
+                    existing = None
+            if existing is not None and existing.status == RUNNING and self._fail_stale(Job.id == existing.id):
+                continue  # 执行它的进程已退出, 标记失败后重新提交
+            if existing is not None:
+                return existing, False
+            try:
+                with database.atomic():
+                    job = Job.create(kind=kind, params=json.dumps(params, ensure_ascii=False, default=str),
+                                     dedup_key=key, active_key=key, permission=permission, user_id=user_id)
+            except IntegrityError:
+                continue  # 其他进程/线程刚提交了相同的任务, 重新查找并返回它
+            self._executor.submit(self._run, job.id)
+            return job, True
+        raise RuntimeError('提交任务失败: 相同的任务反复冲突')
+
+    def recover(self):
+        """重新排队上次进程退出时未执行的任务, 把心跳长时间未更新的任务标记为失败, 并清理过期的结果文件。"""
+        self._recovered = True
+        self.purge()
+        self._fail_stale()
+        for job_id, in Job.select(Job.id).where(Job.status == PENDING).tuples():
+            self._executor.submit(self._run, job_id)
+
+    def _fail_stale(self, *conditions):
+        """把心跳超过 STALE_HEARTBEAT_SECONDS 未更新的执行中任务标记为失败并释放去重键, 返回更新的行数。"""
+        stale = _now() - datetime.timedelta(seconds=STALE_HEARTBEAT_SECONDS)
+        return (Job
+                .update(status=FAILED, active_key=None, message='任务执行中断', finished_at=_now())
+                .where(Job.status == RUNNING, fn.COALESCE(Job.heartbeat_at, Job.started_at) < stale, *conditions)
+                .execute())
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_pid == os.getpid() and self._heartbeat_thread is not None:
+            return
+        with self._lock:
+            if self._heartbeat_pid != os.getpid() or self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+                self._heartbeat_thread.start()
+                self._heartbeat_pid = os.getpid()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                with database.connection_context():
+                    (Job
+                     .update(heartbeat_at=_now())
+                     .where(Job.id.in_(job_ids), Job.status == RUNNING)
+                     .execute())
+            except (DatabaseError, InterfaceError):
+                self.app.logger.exception('更新后台任务心跳失败')
+
+    def purge(self):
+        """删除结束超过 retention_days 天的任务及其结果文件。"""
+        expired = _now() - datetime.timedelta(days=self.retention_days)
+        query = Job.select().where(Job.status.in_((DONE, FAILED)), Job.finished_at < expired)
+        for job in query:
+            if job.result_path and os.path.exists(job.result_path):
+                os.remove(job.result_path)
+        Job.delete().where(Job.status.in_((DONE, FAILED)), Job.finished_at < expired).execute()
+        if os.path.isdir(self.result_dir):
+            for name in os.listdir(self.result_dir):
+                path = os.path.join(self.result_dir, name)
+                if name.startswith(UPLOAD_PREFIX) and os.path.getmtime(path) < expired.timestamp():
+                    os.remove(path)
+
+    def save_upload(self, stream):
+        """保存上传文件, 返回 (路径, SHA-256)。相同内容的文件保存为同一路径, 便于去重。"""
+        os.makedirs(self.result_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temporary = tempfile.mkstemp(dir=self.result_dir, prefix='.upload-')
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(1 << 20), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        path = os.path.join(self.result_dir, f'{UPLOAD_PREFIX}{digest.hexdigest()}')
+        os.replace(temporary, path)
+        return path, digest.hexdigest()
+
+    def _run(self, job_id):
+        with self.app.app_context(), database.connection_context():
+            # 条件 UPDATE 认领任务, 其他线程/进程已认领时跳过
+            now = _now()
+            claimed = (Job
+                       .update(status=RUNNING, started_at=now, heartbeat_at=now)
+                       .where(Job.id == job_id, Job.status == PENDING)
+                       .execute())
+            if not claimed:
+                return
+            with self._lock:
+                self._running.add(job_id)
+            self._ensure_heartbeat()
+            try:
+                self._execute(job_id)
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+
+    def _execute(self, job_id):
+        job = Job.get_by_id(job_id)
+        context = JobContext(job, self.result_dir)
+        try:
+            os.makedirs(self.result_dir, exist_ok=True)
+            with audit.acting_as(job.user_id, f'任务 {job.id} ({job.kind})'):
+                message = TASKS[job.kind].handler(context, json.loads(job.params))
+        except Exception as e:
+            current_app.logger.exception(f'后台任务 {job_id} ({job.kind}) 失败')
+            (Job
+             .update(status=FAILED, active_key=None, message=str(e), finished_at=_now())
+             .where(Job.id == job_id)
+             .execute())
+        else:
+            (Job
+             .update(status=DONE, active_key=None, progress=100, message=message, result_path=job.result_path,
+                     content_type=job.content_type, filename=job.filename, finished_at=_now())
+             .where(Job.id == job_id)
+             .execute())
+
+
+def get_runner():
+    return current_app.extensions['jobs']
+
+
+def init_app(app):
+    """创建任务执行器 (工作线程在提交第一个任务时才启动)。"""
+    from applications.jobs import tasks  # 注册任务类型
+
+    app.extensions['jobs'] = JobRunner(app, workers=app.config.get('JOB_WORKERS', DEFAULT_WORKERS),
+                                       result_dir=app.config.get('JOB_RESULT_DIR'),
+                                       retention_days=app.config.get('JOB_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
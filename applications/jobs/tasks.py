@@ -0,0 +1,67 @@
+import json
+
+from flask import render_template
+
+from applications.database import summary, stock_history
+from applications.database.export import EXPORTS, FORMATS, build_query, generate
+from applications.database.bulk_import import import_rows, read_rows
+from applications.jobs.runner import task
+
+# 导入进度按行数估算, 每读取该行数汇报一次
+IMPORT_PROGRESS_ROWS = 1000
+
+
+@task('report', models=summary.REPORT_MODELS)
+def report(context, params):
+    """完整统计报表 (不限制物资明细条数), 结果为 HTML 文件。"""
+    report_data = summary.report_context(params.get('supplies_limit'))
+    html = render_template('report.html', **report_data)
+    with context.result_file('report.html', 'text/html; charset=utf-8') as f:
+        f.write(html)
+    return f"物资 {len(report_data['supplies_data'])} 项"
+
+
+@task('export', models=lambda params: (EXPORTS[params['table']][0],))
+def export(context, params):
+    table, fmt = params['table'], params.get('format', 'csv')
+    query, names = build_query(table, params.get('columns'), params.get('start'), params.get('end'))
+    total = query.count()
+    exported = 0
+
+    def on_progress(rows):
+        nonlocal exported
+        exported = rows
+        context.progress(rows * 100 / max(total, 1))
+
+    with context.result_file(f'{table}.{fmt}', FORMATS[fmt]) as f:
+        for chunk in generate(query, names, fmt, on_progress=on_progress):
+            f.write(chunk)
+    return f'导出 {exported} 行'
+
+
+@task('import', reuse_result=False)
+def bulk_import(context, params):
+    """导入上传的文件 (params['path']), 结果为 ImportResult 的 JSON。"""
+    path = params['path']
+    with open(path, 'rb') as f:
+        total = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b'')) or 1
+
+    def rows(stream):
+        for number, (line, row) in enumerate(read_rows(stream, params['format']), start=1):
+            if number % IMPORT_PROGRESS_ROWS == 0:
+                context.progress(line * 100 / total)
+            yield line, row
+
+    with open(path, 'rb') as f:
+        result = import_rows(params['kind'], rows(f), chunk_size=params.get('chunk_size', 1000),
+                             user_id=params.get('user_id'))
+    with context.result_file('import-result.json', 'application/json') as f:
+        json.dump(result.to_dict(), f, ensure_ascii=False)
+    return f'新增 {result.inserted} 条, 更新 {result.updated} 条, 错误 {result.error_count} 条'
+
+
+@task('stock_checkpoint', reuse_result=False)
+def stock_checkpoint(context, params):
+    """新建库存检查点 (没有结果文件)。"""
+    checkpoint = stock_history.take_checkpoint()
+    return f'检查点 {checkpoint.id}: {checkpoint.item_count} 项库存'
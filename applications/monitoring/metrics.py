@@ -0,0 +1,180 @@
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, has_request_context, request
+from playhouse.pool import PooledDatabase
+
+from applications.database.database import database
+
+# 请求耗时直方图的分桶 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每请求 SQL 条数直方图的分桶
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+# 慢请求日志中最多记录的 SQL 条数
+MAX_LOGGED_QUERIES = 50
+
+metrics = Blueprint('metrics', __name__)
+
+# 其他模块注册的指标输出函数, 每个返回 Prometheus 文本行的列表
+_collectors = []
+
+
+class Histogram:
+    """按标签分组的累积直方图, 输出 Prometheus 文本格式。"""
+
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}  # {标签值元组: [各桶计数..., 总和, 总数]}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+# 指标按进程统计, 多进程部署时由 Prometheus 分别抓取各个工作进程
+REQUEST_LATENCY = Histogram('inventory_request_duration_seconds', '请求处理耗时', LATENCY_BUCKETS,
+                            ('endpoint', 'method'))
+REQUEST_QUERIES = Histogram('inventory_request_sql_queries', '每个请求执行的 SQL 条数', QUERY_COUNT_BUCKETS,
+                            ('endpoint',))
+SQL_SECONDS = Counter('inventory_sql_seconds_total', 'SQL 累计耗时', ('endpoint',))
+REQUESTS = Counter('inventory_requests_total', '请求数', ('endpoint', 'method', 'status'))
+
+
+# --- SQL 计时 ---
+
+def _instrument(db):
+    """包装数据库对象的 execute_sql, 在请求上下文中累计 SQL 条数与耗时。"""
+    if getattr(db, '_metrics_instrumented', False):
+        return
+    execute_sql = db.execute_sql
+
+    def instrumented_execute_sql(sql, params=None, *args, **kwargs):
+        if not has_request_context() or 'sql_count' not in g:
+            return execute_sql(sql, params, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return execute_sql(sql, params, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            g.sql_count += 1
+            g.sql_time += elapsed
+            if g.sql_queries is not None and len(g.sql_queries) < MAX_LOGGED_QUERIES:
+                g.sql_queries.append((elapsed, sql, params))
+
+    db.execute_sql = instrumented_execute_sql
+    db._metrics_instrumented = True
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    # 只有开启慢请求日志或测试模式 (查询条数检查) 时才保留 SQL 明细
+    config = current_app.config
+    g.sql_queries = [] if config.get('SLOW_REQUEST_THRESHOLD') or config.get('TESTING') else None
+
+
+def _finish_request(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_LATENCY.observe((endpoint, request.method), elapsed)
+    REQUEST_QUERIES.observe((endpoint,), g.sql_count)
+    SQL_SECONDS.inc((endpoint,), g.sql_time)
+    REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+
+    threshold = current_app.config.get('SLOW_REQUEST_THRESHOLD')
+    if threshold and elapsed >= threshold:
+        lines = [f'慢请求 {request.method} {request.full_path} 耗时 {elapsed * 1000:.1f}ms, '
+                 f'SQL {g.sql_count} 条共 {g.sql_time * 1000:.1f}ms']
+        for query_time, sql, params in g.sql_queries:
+            lines.append(f'  {query_time * 1000:.1f}ms {sql} {params}')
+        current_app.logger.warning('\n'.join(lines))
+    return response
+
+
+def _pool_lines():
+    db = database.obj
+    if not isinstance(db, PooledDatabase):
+        return []
+    return [
+        '# HELP inventory_db_pool_connections 连接池中的连接数',
+        '# TYPE inventory_db_pool_connections gauge',
+        f'inventory_db_pool_connections{{state="in_use"}} {len(db._in_use)}',
+        f'inventory_db_pool_connections{{state="idle"}} {len(db._connections)}',
+        '# HELP inventory_db_pool_max_connections 连接池上限',
+        '# TYPE inventory_db_pool_max_connections gauge',
+        f'inventory_db_pool_max_connections {db._max_connections or 0}',
+    ]
+
+
+def register_collector(collector):
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+@metrics.route('/metrics')
+def export_metrics():
+    lines = []
+    for metric in (REQUEST_LATENCY, REQUEST_QUERIES, SQL_SECONDS, REQUESTS):
+        lines.extend(metric.render())
+    lines.extend(_pool_lines())
+    for collector in _collectors:
+        lines.extend(collector())
+    return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    """注册请求计时钩子与 /metrics 路由。需在数据库绑定 (init_database) 之后调用。"""
+    _instrument(database.obj)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.register_blueprint(metrics)
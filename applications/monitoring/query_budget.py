@@ -0,0 +1,136 @@
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from flask import g, request, request_finished
+
+# 各页面每个请求允许的最多 SQL 条数 (含 Flask-Login 加载当前用户的 1 条, cached_page 查询表版本的 1 条)
+# 列表页必须是固定条数, 与每页行数无关; 出现 N+1 查询时条数会随行数增长而超出预算
+ROUTE_QUERY_BUDGETS = {
+    '/manage_supplies': 3,
+    '/manage_suppliers': 3,
+    '/manage_products': 3,
+    '/purchase_management': 5,  # 另含供应商/产品下拉框各 1 条 (缓存未命中时)
+    '/quality_control': 3,
+    '/warehouse_management': 3,
+    '/finance_management': 3,
+    '/report': 7,
+    '/system_management': 3,
+    '/api/v1/purchases': 2,
+    '/api/v1/quality_controls': 2,
+    '/api/v1/finance/summary?start=2020-01-15&end=2024-06-10': 2,  # 日/月汇总合为一条查询, 与明细行数无关
+    '/api/v1/finance/series?period=week': 2,
+    '/reorder_alerts': 3,  # 提醒表与补货点表各 1 条 (没有提醒时不查询消耗), 与库存表大小无关
+    '/api/v1/search?q=产品1': 8,  # 表版本 1 条, 每张有结果的表 1 条; 首次请求另含建索引的每表 1 条
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def capture_queries(app):
+    """记录期间 app 处理的每个请求的 (路径, SQL 条数, SQL 明细)。
+
+    依赖 metrics.init_app 注册的 SQL 计数; SQL 明细只在 TESTING 或开启慢请求日志时记录。
+    """
+    records = []
+
+    def on_finished(sender, response, **extra):
+        if 'sql_count' in g:
+            records.append((request.path, g.sql_count, list(g.sql_queries or [])))
+
+    with request_finished.connected_to(on_finished, app):
+        yield records
+
+
+def assert_max_queries(client, url, max_queries, method='GET', **kwargs):
+    """用测试客户端请求 url, SQL 条数超过 max_queries 时抛出 QueryBudgetExceeded, 否则返回响应。"""
+    with capture_queries(client.application) as records:
+        response = client.open(url, method=method, **kwargs)
+    count = sum(record[1] for record in records)
+    if count > max_queries:
+        lines = [f'{method} {url} 执行了 {count} 条 SQL, 预算 {max_queries} 条']
+        for _, _, queries in records:
+            lines.extend(f'  {sql} {params}' for _, sql, params in queries)
+        raise QueryBudgetExceeded('\n'.join(lines))
+    return response
+
+
+def check_budgets(client, budgets=None):
+    """依次检查 budgets ({路径: 最多条数}, 默认 ROUTE_QUERY_BUDGETS), 返回超出预算的错误信息列表。"""
+    errors = []
+    for url, max_queries in (budgets or ROUTE_QUERY_BUDGETS).items():
+        try:
+            response = assert_max_queries(client, url, max_queries)
+        except QueryBudgetExceeded as e:
+            errors.append(str(e))
+            continue
+        if response.status_code != 200:
+            errors.append(f'GET {url} 返回 {response.status_code}')
+    return errors
+
+
+# --- 命令行: 在临时 SQLite 库中造数据并检查所有页面 ---
+
+class _CheckConfig:
+    DATABASE_ENGINE = 'sqlite'
+    TESTING = True
+
+
+def _seed(rows):
+    from werkzeug.security import generate_password_hash
+    from applications.database.database import PERMISSIONS, Users, Supplies, Supplier, Product, Purchase, \
+        QualityControl, Warehouse, Finance
+
+    Users.create(username='admin', password=generate_password_hash('admin'), is_admin=True,
+                 **{name: True for name in PERMISSIONS})
+    today = datetime.date.today()
+    Supplies.insert_many([{'name': f'物资{i}', 'specification': '规格', 'quantity': i} for i in range(rows)]).execute()
+    Supplier.insert_many([{'name': f'供应商{i}', 'contact_person': '联系人', 'phone': '1', 'address': '地址'}
+                          for i in range(rows)]).execute()
+    Product.insert_many([{'name': f'产品{i}', 'description': '', 'unit': '个', 'price': 1}
+                         for i in range(rows)]).execute()
+    Purchase.insert_many([{'supplier': i + 1, 'product': i + 1, 'quantity': 1, 'total_price': 1,
+                           'purchase_date': today} for i in range(rows)]).execute()
+    QualityControl.insert_many([{'purchase': i + 1, 'inspection_date': today, 'inspector': '质检员',
+                                 'result': '合格'} for i in range(rows)]).execute()
+    Warehouse.insert_many([{'material_name': f'产品{i}', 'product': i + 1, 'quantity': 1, 'location': 'A'}
+                           for i in range(rows)]).execute()
+    Finance.insert_many([{'date': today, 'type': 'income', 'amount': 1, 'description': ''}
+                         for i in range(rows)]).execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查各页面每个请求的 SQL 条数是否超出预算')
+    parser.add_argument('--rows', type=int, default=120, help='每张表造的行数 (应超过一页)')
+    args = parser.parse_args()
+
+    from app import create_app
+    from applications.database import migrations, audit
+    from applications.database.database import database
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = type('Config', (_CheckConfig,), {'DATABASE_NAME': os.path.join(directory, 'check.db')})
+        app = create_app(config)
+        with database.connection_context():
+            migrations.upgrade()
+            _seed(args.rows)
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        errors = check_budgets(client)
+        audit.flush()  # 临时数据库删除前写完审计日志
+        database.close()
+
+    for error in errors:
+        print(error)
+    print('全部页面均在预算内' if not errors else f'{len(errors)} 个页面超出预算')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+
+
+# 应用配置, 所有项均可通过同名环境变量 (INVENTORY_ 前缀) 覆盖
+class Config:
+    # 数据库类型: mysql 或 sqlite (本地开发/测试用, 此时 DATABASE_NAME 为文件路径)
+    DATABASE_ENGINE = os.environ.get('INVENTORY_DB_ENGINE', 'mysql')
+    # 数据库名称与连接参数
+    DATABASE_NAME = os.environ.get('INVENTORY_DB_NAME', 'Inventory')
+    DATABASE = {
+        'user': os.environ.get('INVENTORY_DB_USER', 'Inventory'),
+        'password': os.environ.get('INVENTORY_DB_PASSWORD', 'password'),
+        'host': os.environ.get('INVENTORY_DB_HOST', 'xxx.xxx.xxx.xxx'),
+        'port': int(os.environ.get('INVENTORY_DB_PORT', 3306)),
+    }
+
+    # 连接池参数
+    DATABASE_POOL = {
+        'max_connections': int(os.environ.get('INVENTORY_DB_MAX_CONNECTIONS', 20)),  # 每个进程最多打开的连接数
+        'stale_timeout': int(os.environ.get('INVENTORY_DB_STALE_TIMEOUT', 300)),  # 连接空闲/存活超过该秒数即回收重建
+        'timeout': int(os.environ.get('INVENTORY_DB_POOL_TIMEOUT', 10)),  # 连接池耗尽时等待空闲连接的秒数
+    }
+
+    # 只读副本: 列表页、报表、导出与搜索的查询发往副本, 写入及写入后的读取使用主库。逗号分隔,
+    # mysql 时为 host[:port] (其余连接参数与连接池参数同主库), sqlite 时为数据库文件路径; 未设置则全部使用主库
+    DATABASE_REPLICAS = [entry.strip() for entry in os.environ.get('INVENTORY_DB_REPLICAS', '').split(',')
+                         if entry.strip()]
+    # 副本延迟超过该秒数时回退到主库; 每隔该秒数检查一次副本状态与延迟
+    REPLICA_MAX_LAG = float(os.environ.get('INVENTORY_REPLICA_MAX_LAG', 5))
+    REPLICA_CHECK_INTERVAL = float(os.environ.get('INVENTORY_REPLICA_CHECK_INTERVAL', 5))
+    # 用户写入数据后该秒数内的页面都读取主库, 保证能看到自己的修改
+    REPLICA_STICKY_SECONDS = float(os.environ.get('INVENTORY_REPLICA_STICKY_SECONDS', 10))
+
+    # 慢请求日志: 请求耗时超过该秒数时记录其执行的 SQL, 未设置则关闭
+    SLOW_REQUEST_THRESHOLD = float(os.environ['INVENTORY_SLOW_REQUEST_THRESHOLD']) \
+        if os.environ.get('INVENTORY_SLOW_REQUEST_THRESHOLD') else None
+
+    # 产品/供应商缓存: 最多缓存的条数与过期秒数
+    REFERENCE_CACHE_SIZE = int(os.environ.get('INVENTORY_REFERENCE_CACHE_SIZE', 10000))
+    REFERENCE_CACHE_TTL = int(os.environ.get('INVENTORY_REFERENCE_CACHE_TTL', 300))
+    # 采购页的产品/供应商下拉框最多列出的条数, 超过时改为输入 ID (列出的条目作为输入提示)
+    REFERENCE_OPTIONS_LIMIT = int(os.environ.get('INVENTORY_REFERENCE_OPTIONS_LIMIT', 500))
+    # 多个工作进程共享的缓存版本文件 (SQLite), 任一进程修改产品/供应商后其他进程随之失效; 未设置则只在本进程内失效
+    CACHE_VERSION_FILE = os.environ.get('INVENTORY_CACHE_VERSION_FILE')
+
+    # 列表页/报表页渲染结果缓存: 最多缓存的页数与过期秒数
+    PAGE_CACHE_SIZE = int(os.environ.get('INVENTORY_PAGE_CACHE_SIZE', 500))
+    PAGE_CACHE_TTL = int(os.environ.get('INVENTORY_PAGE_CACHE_TTL', 300))
+    # 响应体超过该字节数时按 Accept-Encoding 进行 gzip/brotli 压缩
+    COMPRESS_MIN_SIZE = int(os.environ.get('INVENTORY_COMPRESS_MIN_SIZE', 1024))
+
+    # 后台任务 (报表/导出/导入): 每个进程的工作线程数、结果文件目录 (多进程部署时需为共享目录) 与保留天数
+    JOB_WORKERS = int(os.environ.get('INVENTORY_JOB_WORKERS', 2))
+    JOB_RESULT_DIR = os.environ.get('INVENTORY_JOB_RESULT_DIR')  # 默认为系统临时目录下的 inventory-jobs
+    JOB_RETENTION_DAYS = int(os.environ.get('INVENTORY_JOB_RETENTION_DAYS', 7))
+
+    # 物资搜索索引: 检查表版本以加载新增行的间隔 (秒) 与全量重建的间隔 (秒)
+    SEARCH_REFRESH_INTERVAL = float(os.environ.get('INVENTORY_SEARCH_REFRESH_INTERVAL', 1.0))
+    SEARCH_REBUILD_INTERVAL = int(os.environ.get('INVENTORY_SEARCH_REBUILD_INTERVAL', 3600))
+
+    # 按时间点查询库存: 距最新检查点的流水超过该条数时在后台新建检查点 (也可用 cron 执行
+    # python -m applications.database.stock_history checkpoint)
+    STOCK_CHECKPOINT_MOVEMENTS = int(os.environ.get('INVENTORY_STOCK_CHECKPOINT_MOVEMENTS', 10000))
+
+    # 补货提醒: 建议采购量按最近该天数的日均出库量估算
+    REORDER_LOOKBACK_DAYS = int(os.environ.get('INVENTORY_REORDER_LOOKBACK_DAYS', 30))
+
+    # 收货 (POST /api/v1/receipts): 单张收货单最多的明细条数
+    RECEIVING_MAX_LINES = int(os.environ.get('INVENTORY_RECEIVING_MAX_LINES', 5000))
+
+    # 审计日志: 写入事件进入进程内队列, 由后台线程批量写入 audit_log。队列容量 (条)、队列满时写入方等待的秒数
+    # (超时后丢弃并记录错误)、每批条数与攒批的最长秒数
+    AUDIT_ENABLED = os.environ.get('INVENTORY_AUDIT_ENABLED', '1') == '1'
+    AUDIT_QUEUE_SIZE = int(os.environ.get('INVENTORY_AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_PUT_TIMEOUT = float(os.environ.get('INVENTORY_AUDIT_PUT_TIMEOUT', 5))
+    AUDIT_BATCH_SIZE = int(os.environ.get('INVENTORY_AUDIT_BATCH_SIZE', 500))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('INVENTORY_AUDIT_FLUSH_INTERVAL', 1))
+
+    # 登录的密码校验在进程池中执行 (0 表示在请求线程内计算), 进程降低优先级 (nice) 以免挤占页面请求;
+    # 同时排队的校验数超过 PASSWORD_HASH_QUEUE 时最多等待 PASSWORD_HASH_WAIT 秒, 仍无空位返回 503。
+    # PASSWORD_HASH_METHOD 为新哈希的算法 (werkzeug 格式), 修改后用户下次登录时自动按新算法重新计算
+    PASSWORD_HASH_METHOD = os.environ.get('INVENTORY_PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('INVENTORY_PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('INVENTORY_PASSWORD_HASH_QUEUE', 0)) or None  # 默认为进程数 * 4
+    PASSWORD_HASH_WAIT = float(os.environ.get('INVENTORY_PASSWORD_HASH_WAIT', 5))
+    PASSWORD_HASH_NICE = int(os.environ.get('INVENTORY_PASSWORD_HASH_NICE', 10))
+    # 登录失败限制: 窗口秒数内同一用户名/同一 IP 失败达到次数后, 在计算哈希之前直接拒绝 (429)
+    LOGIN_FAILURE_WINDOW = int(os.environ.get('INVENTORY_LOGIN_FAILURE_WINDOW', 300))
+    LOGIN_MAX_USER_FAILURES = int(os.environ.get('INVENTORY_LOGIN_MAX_USER_FAILURES', 5))
+    LOGIN_MAX_IP_FAILURES = int(os.environ.get('INVENTORY_LOGIN_MAX_IP_FAILURES', 50))
+
+    # 会话密钥: 多个工作进程/多台主机必须使用同一个密钥, 否则登录状态只在签发它的进程内有效。
+    # 未设置时读取 SECRET_KEY_FILE (默认为 instance/secret_key), 文件不存在则生成一次并写入,
+    # 同一台机器上的进程共用该文件; 多台主机部署时应通过 INVENTORY_SECRET_KEY 配置
+    SECRET_KEY = os.environ.get('INVENTORY_SECRET_KEY')
+    SECRET_KEY_FILE = os.environ.get('INVENTORY_SECRET_KEY_FILE')
+    # 通过 HTTPS 访问时设为 1, 会话 Cookie 只在 HTTPS 连接中发送
+    SESSION_COOKIE_SECURE = os.environ.get('INVENTORY_SESSION_COOKIE_SECURE', '0') == '1'
+    REMEMBER_COOKIE_SECURE = SESSION_COOKIE_SECURE
+    # 位于反向代理/负载均衡之后时设为代理的层数, 按 X-Forwarded-For/-Proto/-Host 还原客户端地址与协议
+    PROXY_FIX_HOPS = int(os.environ.get('INVENTORY_PROXY_FIX_HOPS', 0))
+
+    # 生产部署 (gunicorn -c gunicorn.conf.py wsgi:app): 监听地址、工作进程数 (默认 CPU 核数 * 2 + 1)、
+    # 每个进程的线程数与请求超时秒数。每个进程的线程数 + JOB_WORKERS 不应超过连接池的 max_connections
+    WEB_BIND = os.environ.get('INVENTORY_WEB_BIND', '0.0.0.0:8000')
+    WEB_WORKERS = int(os.environ.get('INVENTORY_WEB_WORKERS', 0)) or (os.cpu_count() or 1) * 2 + 1
+    WEB_THREADS = int(os.environ.get('INVENTORY_WEB_THREADS', 4))
+    WEB_TIMEOUT = int(os.environ.get('INVENTORY_WEB_TIMEOUT', 60))
+    # 在主进程中创建应用后再 fork 工作进程 (节省内存、加快启动); 工作进程启动时丢弃继承的数据库连接
+    WEB_PRELOAD = os.environ.get('INVENTORY_WEB_PRELOAD', '1') == '1'
@@ -0,0 +1,27 @@
+# gunicorn 配置: gunicorn -c gunicorn.conf.py wsgi:app
+# 参数取自 config.Config, 可通过 INVENTORY_WEB_* 环境变量覆盖
+from config import Config
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+worker_class = 'gthread'
+timeout = Config.WEB_TIMEOUT
+preload_app = Config.WEB_PRELOAD
+# 工作进程处理一定数量的请求后重启, 避免内存缓慢增长 (加随机量避免同时重启)
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = '-'
+
+
+def on_starting(server):
+    pool_size = Config.DATABASE_POOL['max_connections']
+    if Config.DATABASE_ENGINE == 'mysql' and threads + Config.JOB_WORKERS > pool_size:
+        server.log.warning(f'每个进程的线程数 ({threads}) + 后台任务线程数 ({Config.JOB_WORKERS}) '
+                           f'超过连接池大小 ({pool_size}), 请求可能等待空闲连接')
+
+
+def post_fork(server, worker):
+    # 预加载时工作进程继承了主进程的数据库对象, 丢弃其中的连接, 由各进程自行建立
+    from applications.database.database import after_fork
+    after_fork()
@@ -0,0 +1,288 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request, request_finished
+
+from app import create_app
+from applications.database.database import database, Purchase, Product, Supplier, Warehouse
+from applications.database import migrations, audit
+from config import Config
+from generate_data import generate, create_benchmark_user, table_sizes, BENCHMARK_USER, BENCHMARK_PASSWORD
+
+# 基准测试: 用 Flask 测试客户端 (可多线程并发) 请求 app.py 中的各个路由, 统计延迟、吞吐量与每请求 SQL 条数
+# 用法:
+#   PYTHONPATH=. python test/benchmark.py --rows 10000 --concurrency 8   # 临时 SQLite 库, 自动生成数据
+#   PYTHONPATH=. python test/benchmark.py --save-baseline                # 把本次结果保存为基线
+#   PYTHONPATH=. python test/benchmark.py --engine mysql                 # 使用 config.Config 中的 MySQL (需先运行 generate_data.py)
+#   PYTHONPATH=. python test/benchmark.py --routes login,index,search --concurrency 16   # 登录高峰: 登录与其他页面并发时的 p99
+#   PYTHONPATH=. python test/benchmark.py --routes receive --concurrency 4           # 收货: 每张收货单 RECEIPT_LINES 条明细
+# 与基线文件比较, 任一路由 p95 延迟或 SQL 条数、或总吞吐量超出容差则以退出码 1 结束;
+# 基线文件不存在时同样以退出码 1 结束 (需先在目标环境中用 --save-baseline 创建)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# p95 延迟与吞吐量相对基线允许的波动比例
+DEFAULT_TOLERANCE = 0.25
+# 每请求平均 SQL 条数允许比基线多出的条数 (渲染缓存命中率的差异)
+QUERY_TOLERANCE = 0.5
+
+
+class Route:
+    def __init__(self, name, method, url, form=None, json=None):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.form = form  # (rng, sizes) -> 表单数据, 用于 POST
+        self.json = json  # (rng, sizes) -> JSON 请求体, 用于 POST
+
+
+# 收货基准中每张收货单的明细条数
+RECEIPT_LINES = 200
+
+
+def _supplies_form(rng, sizes):
+    return {'物资名称': f'基准物资{rng.randrange(100)}', '规格': 'M8', '数量': rng.randrange(1, 10)}
+
+
+def _purchase_form(rng, sizes):
+    return {'supplier': rng.randrange(sizes['suppliers']) + 1, 'product': rng.randrange(sizes['products']) + 1,
+            'quantity': rng.randrange(1, 100), 'unit_price': round(rng.uniform(1, 100), 2),
+            'purchase_date': '2024-06-01'}
+
+
+def _stock_in_form(rng, sizes):
+    return {'operation_type': 'in', 'material_name': f'产品{rng.randrange(sizes["warehouses"])}',
+            'quantity': rng.randrange(1, 10), 'location': '', 'date': '2024-06-01'}
+
+
+def _finance_form(rng, sizes):
+    return {'transaction_type': rng.choice(['income', 'expense']), 'amount': round(rng.uniform(10, 1000), 2),
+            'date': '2024-06-01', 'description': '基准测试'}
+
+
+def _receipt_json(rng, sizes):
+    lines = [{'product': rng.randrange(sizes['products']) + 1, 'quantity': 10, 'unit_price': 1.5,
+              'accepted': rng.choice([10, 10, 10, 8]), 'location': f'A-{rng.randrange(20):02d}'}
+             for _ in range(RECEIPT_LINES)]
+    return {'supplier': rng.randrange(sizes['suppliers']) + 1, 'inspector': '基准测试', 'lines': lines}
+
+
+def _login_form(rng, sizes):
+    return {'username': BENCHMARK_USER, 'password': BENCHMARK_PASSWORD}
+
+
+ROUTES = [
+    Route('index', 'GET', '/'),
+    Route('manage_supplies', 'GET', '/manage_supplies'),
+    Route('manage_supplies_filtered', 'GET', '/manage_supplies?name=钢板&sort=quantity&order=desc'),
+    Route('manage_suppliers', 'GET', '/manage_suppliers'),
+    Route('manage_products', 'GET', '/manage_products'),
+    Route('purchase_management', 'GET', '/purchase_management'),
+    Route('purchase_management_sorted', 'GET', '/purchase_management?sort=purchase_date&order=desc'),
+    Route('quality_control', 'GET', '/quality_control'),
+    Route('warehouse_management', 'GET', '/warehouse_management'),
+    Route('finance_management', 'GET', '/finance_management'),
+    Route('report', 'GET', '/report'),
+    Route('system_management', 'GET', '/system_management'),
+    Route('api_purchases', 'GET', '/api/v1/purchases?per_page=100'),
+    Route('api_stock_movements', 'GET', '/api/v1/stock_movements?sort=created_at&order=desc'),
+    Route('search', 'GET', '/api/v1/search?q=钢板1'),
+    Route('export_finance', 'GET', '/export/finance?start=2023-01-01&end=2023-01-31'),
+    Route('metrics', 'GET', '/metrics'),
+    Route('login', 'POST', '/login', form=_login_form),
+    Route('add_supplies', 'POST', '/manage_supplies', form=_supplies_form),
+    Route('add_purchase', 'POST', '/purchase_management', form=_purchase_form),
+    Route('stock_in', 'POST', '/warehouse_management', form=_stock_in_form),
+    Route('add_finance', 'POST', '/finance_management', form=_finance_form),
+    Route('receive', 'POST', '/api/v1/receipts', json=_receipt_json),
+]
+
+
+def percentile(sorted_values, p):
+    """最近秩法求百分位数, sorted_values 需已排序。"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def _prepare(args):
+    overrides = {'DATABASE_ENGINE': args.engine}
+    temporary = None
+    if args.engine == 'sqlite':
+        if args.database is None:
+            temporary = tempfile.TemporaryDirectory()
+            args.database = os.path.join(temporary.name, 'benchmark.db')
+        overrides['DATABASE_NAME'] = args.database
+    app = create_app(type('BenchmarkConfig', (Config,), overrides))
+
+    with database.connection_context():
+        migrations.upgrade()
+        if not Purchase.select().exists():
+            print(f'生成合成数据 ({args.rows} 行)...')
+            start = time.perf_counter()
+            generate(args.rows, args.seed)
+            print(f'数据生成耗时 {time.perf_counter() - start:.1f} 秒')
+        create_benchmark_user()
+        # 实际表大小 (复用已有数据库时可能与 --rows 不同)
+        sizes = table_sizes(args.rows)
+        sizes.update(suppliers=Supplier.select().count(), products=Product.select().count(),
+                     warehouses=Warehouse.select().count())
+    return app, sizes, temporary
+
+
+def run(app, routes, sizes, requests_per_route, concurrency, seed=0):
+    """按随机顺序把每个路由请求 requests_per_route 次, 返回 (各路由统计, 总耗时)。"""
+    rng = random.Random(seed)
+    jobs = [(route, random.Random(rng.random())) for route in routes for _ in range(requests_per_route)]
+    rng.shuffle(jobs)
+
+    samples = {route.name: [] for route in routes}  # {路由名: [(耗时, 状态码)]}
+    queries = {route.name: [] for route in routes}
+    local = threading.local()
+
+    def on_finished(sender, response, **extra):
+        name = request.environ.get('benchmark.route')
+        if name is not None and 'sql_count' in g:
+            queries[name].append(g.sql_count)
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+            local.client.post('/login', data=_login_form(None, sizes))
+        return local.client
+
+    def execute(job):
+        route, job_rng = job
+        data = route.form(job_rng, sizes) if route.form else None
+        body = route.json(job_rng, sizes) if route.json else None
+        test_client = client()
+        start = time.perf_counter()
+        response = test_client.open(route.url, method=route.method, data=data, json=body,
+                                    environ_overrides={'benchmark.route': route.name})
+        response.get_data()  # 读完流式响应 (导出)
+        samples[route.name].append((time.perf_counter() - start, response.status_code))
+
+    with request_finished.connected_to(on_finished, app):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(execute, jobs))
+        elapsed = time.perf_counter() - start
+
+    results = {}
+    for route in routes:
+        latencies = sorted(latency for latency, _ in samples[route.name])
+        route_queries = queries[route.name]
+        results[route.name] = {
+            'requests': len(latencies),
+            'errors': sum(1 for _, status in samples[route.name] if status >= 400),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries': round(sum(route_queries) / len(route_queries), 2) if route_queries else 0,
+        }
+    return results, elapsed
+
+
+def compare(result, baseline, tolerance):
+    """返回相对基线的退化描述列表。"""
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = result['routes'].get(name)
+        if current is None:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms, 基线 {base['p95_ms']}ms")
+        if current['queries'] > base['queries'] + QUERY_TOLERANCE:
+            regressions.append(f"{name}: 每请求 SQL {current['queries']} 条, 基线 {base['queries']} 条")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{name}: 错误 {current['errors']} 个, 基线 {base['errors']} 个")
+    if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f"吞吐量 {result['throughput']} 请求/秒, 基线 {baseline['throughput']} 请求/秒")
+    return regressions
+
+
+def print_report(result):
+    print(f"{'路由':<28}{'请求':>6}{'错误':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'SQL/请求':>10}")
+    for name, stats in result['routes'].items():
+        print(f"{name:<28}{stats['requests']:>6}{stats['errors']:>6}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['queries']:>10}")
+    print(f"共 {result['requests']} 个请求, 耗时 {result['elapsed']} 秒, 吞吐量 {result['throughput']} 请求/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='库存管理系统基准测试')
+    parser.add_argument('--engine', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--database', help='SQLite 数据库文件, 不存在数据时自动生成 (默认使用临时文件)')
+    parser.add_argument('--rows', type=int, default=10000, help='合成数据明细表的行数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=50, help='每个路由的请求次数')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发线程数, 1 为顺序执行')
+    parser.add_argument('--routes', help='只测试这些路由 (逗号分隔的名称)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写入基线文件')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--output', help='把本次结果写入该 JSON 文件')
+    args = parser.parse_args()
+
+    routes = ROUTES
+    if args.routes:
+        names = set(args.routes.split(','))
+        unknown = names - {route.name for route in ROUTES}
+        if unknown:
+            parser.error(f"未知的路由: {', '.join(sorted(unknown))}")
+        routes = [route for route in ROUTES if route.name in names]
+
+    app, sizes, temporary = _prepare(args)
+    try:
+        run(app, routes, sizes, 2, 1, args.seed)  # 预热: 模板编译、连接建立、缓存填充
+        routes_result, elapsed = run(app, routes, sizes, args.requests, args.concurrency, args.seed)
+    finally:
+        audit.flush()  # 临时数据库删除前写完审计日志
+        database.close()
+        if temporary is not None:
+            temporary.cleanup()
+
+    total = sum(stats['requests'] for stats in routes_result.values())
+    result = {
+        'config': {'engine': args.engine, 'rows': args.rows, 'requests': args.requests,
+                   'concurrency': args.concurrency},
+        'routes': routes_result,
+        'requests': total,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(total / elapsed, 1) if elapsed else 0,
+    }
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'已保存基线: {args.baseline}')
+        return
+    if not os.path.exists(args.baseline):
+        print(f'没有基线文件 {args.baseline}, 无法检查退化 (使用 --save-baseline 创建)')
+        sys.exit(1)
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['config'] != result['config']:
+        print(f"警告: 基线的测试参数 {baseline['config']} 与本次不同")
+    regressions = compare(result, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'退化: {regression}')
+    if regressions:
+        sys.exit(1)
+    print('未发现退化')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 from werkzeug.security import generate_password_hash
-from applications.database.database import Users, database
+from applications.database.database import Users, database, init_database
 
+init_database()  # 按 config.Config 绑定数据库 (表结构需先执行 python -m applications.database.migrations upgrade)
 
 
 # 检查是否已经存在管理员用户，如果不存在则创建一个
@@ -0,0 +1,162 @@
+import argparse
+import datetime
+import itertools
+import random
+import time
+
+from werkzeug.security import generate_password_hash
+
+from applications.database.database import database, init_database, PERMISSIONS, Users, Supplies, Supplier, \
+    Product, Purchase, QualityControl, Warehouse, Finance, StockMovement
+from applications.database import migrations, summary
+from applications.database.stock import SOURCE_SUPPLIES, SOURCE_WAREHOUSE
+
+# 合成数据生成器: 按 rows 等比例生成各表数据, 同一 seed 生成的数据完全相同
+# 用法: PYTHONPATH=. python test/generate_data.py --rows 100000 (数据库按 config.Config / INVENTORY_* 环境变量)
+
+# 每个 INSERT 写入的行数与每个事务包含的 INSERT 数
+INSERT_BATCH = 500
+BATCHES_PER_TRANSACTION = 20
+
+BENCHMARK_USER = 'benchmark'
+BENCHMARK_PASSWORD = 'benchmark'
+
+MATERIALS = ['钢板', '螺栓', '螺母', '轴承', '电机', '导线', '油漆', '胶水', '纸箱', '木托盘', '铝型材', '密封圈']
+SPECIFICATIONS = ['M6', 'M8', 'M10', '1mm', '2mm', '5kg', '10kg', '小号', '中号', '大号']
+UNITS = ['个', '箱', '米', '千克', '卷']
+LOCATIONS = [f'{area}-{shelf:02d}' for area in 'ABCD' for shelf in range(1, 21)]
+TYPES = ['income', 'expense']
+START_DATE = datetime.date(2020, 1, 1)
+DAYS = 365 * 4
+
+
+def table_sizes(rows):
+    """各表的行数。rows 为明细表 (物资、采购、财务、库存流水) 的行数, 引用表按比例缩小。"""
+    return {
+        'supplies': rows,
+        'suppliers': max(rows // 100, 10),
+        'products': max(rows // 10, 10),
+        'purchases': rows,
+        'quality_controls': rows // 2,
+        'warehouses': max(rows // 10, 10),
+        'finance': rows,
+        'stock_movements': rows,
+    }
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _insert(model, rows):
+    """分批写入 rows (dict 的迭代器), 返回写入行数。数据边生成边写入, 内存占用与总行数无关。"""
+    count = 0
+    for batches in _chunks(_chunks(rows, INSERT_BATCH), BATCHES_PER_TRANSACTION):
+        with database.atomic():
+            for batch in batches:
+                model.insert_many(batch).execute()
+                count += len(batch)
+    return count
+
+
+def _date(rng):
+    return START_DATE + datetime.timedelta(days=rng.randrange(DAYS))
+
+
+def _material(i):
+    return f'{MATERIALS[i % len(MATERIALS)]}{i}'
+
+
+def generate(rows, seed=0):
+    """向已迁移的空库写入合成数据并重建汇总表, 返回 {表: 行数}。"""
+    rng = random.Random(seed)
+    sizes = table_sizes(rows)
+    counts = {}
+
+    counts['supplies'] = _insert(Supplies, (
+        {'name': _material(i), 'specification': rng.choice(SPECIFICATIONS), 'quantity': rng.randrange(1000)}
+        for i in range(sizes['supplies'])))
+    counts['suppliers'] = _insert(Supplier, (
+        {'name': f'供应商{i}', 'contact_person': f'联系人{i}', 'phone': f'138{i:08d}', 'address': f'工业园{i}号'}
+        for i in range(sizes['suppliers'])))
+    counts['products'] = _insert(Product, (
+        {'name': f'产品{i}', 'description': f'{rng.choice(MATERIALS)}制品', 'unit': rng.choice(UNITS),
+         'price': round(rng.uniform(1, 500), 2)}
+        for i in range(sizes['products'])))
+
+    def purchases():
+        for _ in range(sizes['purchases']):
+            quantity = rng.randrange(1, 100)
+            yield {'supplier': rng.randrange(sizes['suppliers']) + 1, 'product': rng.randrange(sizes['products']) + 1,
+                   'quantity': quantity, 'total_price': round(quantity * rng.uniform(1, 500), 2),
+                   'purchase_date': _date(rng)}
+
+    counts['purchases'] = _insert(Purchase, purchases())
+    counts['quality_controls'] = _insert(QualityControl, (
+        {'purchase': rng.randrange(sizes['purchases']) + 1, 'inspection_date': _date(rng),
+         'inspector': f'质检员{rng.randrange(20)}', 'result': '合格' if rng.random() < 0.95 else '不合格'}
+        for _ in range(sizes['quality_controls'])))
+    counts['warehouses'] = _insert(Warehouse, (
+        {'material_name': f'产品{i}', 'product': i + 1, 'quantity': rng.randrange(10000),
+         'location': rng.choice(LOCATIONS)}
+        for i in range(sizes['warehouses'])))
+    counts['finance'] = _insert(Finance, (
+        {'date': _date(rng), 'type': rng.choice(TYPES), 'amount': round(rng.uniform(10, 100000), 2),
+         'description': '合成数据'}
+        for _ in range(sizes['finance'])))
+
+    def movements():
+        for _ in range(sizes['stock_movements']):
+            if rng.random() < 0.5:
+                item = rng.randrange(sizes['warehouses'])
+                yield {'source': SOURCE_WAREHOUSE, 'item_id': item + 1, 'material_name': f'产品{item}',
+                       'location': rng.choice(LOCATIONS), 'operation': rng.choice(['in', 'out']),
+                       'quantity': rng.randrange(1, 50) * rng.choice([1, -1]), 'date': _date(rng)}
+            else:
+                item = rng.randrange(sizes['supplies'])
+                yield {'source': SOURCE_SUPPLIES, 'item_id': item + 1, 'material_name': _material(item),
+                       'operation': 'in', 'quantity': rng.randrange(1, 50), 'date': _date(rng)}
+
+    counts['stock_movements'] = _insert(StockMovement, movements())
+
+    summary.rebuild_summaries()
+    return counts
+
+
+def create_benchmark_user():
+    """创建 (或重置) 拥有全部权限的基准测试用户。"""
+    user = Users.get_or_none(Users.username == BENCHMARK_USER)
+    if user is None:
+        user = Users(username=BENCHMARK_USER)
+    user.password = generate_password_hash(BENCHMARK_PASSWORD)
+    user.is_admin = True
+    user.is_active = True
+    user.set_permissions(PERMISSIONS)
+    user.save()
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成基准测试用的合成数据')
+    parser.add_argument('--rows', type=int, default=10000, help='明细表的行数 (1000 ~ 10000000)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    init_database()
+    with database.connection_context():
+        migrations.upgrade()
+        start = time.perf_counter()
+        counts = generate(args.rows, args.seed)
+        create_benchmark_user()
+    for table, count in counts.items():
+        print(f'{table}: {count} 行')
+    print(f'耗时 {time.perf_counter() - start:.1f} 秒')
+
+
+if __name__ == '__main__':
+    main()
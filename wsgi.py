@@ -0,0 +1,5 @@
+# WSGI 入口: gunicorn -c gunicorn.conf.py wsgi:app
+# 应用只绑定数据库而不连接, 可以在主进程中预加载后再 fork 工作进程
+from app import create_app
+
+app = create_app()